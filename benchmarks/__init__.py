@@ -0,0 +1,8 @@
+"""Benchmarks of plend on synthetic formula libraries
+
+Run them from the repository root::
+
+    python -m benchmarks run --ingredients 300 --nutrients 40 \
+        --formulas 100 --output before.json
+    python -m benchmarks compare before.json after.json
+"""
@@ -0,0 +1,138 @@
+from typing import List
+
+import numpy as np
+
+from plend import Formula, FormulaLibrary, Ingredient, Nutrient
+from plend.presets import poultry
+
+
+PRESET_NUTRIENTS = [poultry.energy, poultry.protein, poultry.fiber,
+                    poultry.calcium, poultry.phosphorous, poultry.sodium,
+                    poultry.chloride, poultry.methionine, poultry.lysine]
+
+PRESET_INGREDIENTS = [poultry.corn, poultry.wheat, poultry.soybean_meal,
+                      poultry.meat_meal, poultry.oil, poultry.limestone]
+
+
+def make_nutrients(count: int) -> List[Nutrient]:
+    """Make the poultry preset nutrients, then numbered extra ones
+
+    Args:
+        count (int): number of nutrients
+
+    Returns:
+        list[Nutrient]
+    """
+    nutrients = [Nutrient(n.name, unit=n.unit)
+                 for n in PRESET_NUTRIENTS[:count]]
+    nutrients += [Nutrient(f'Nutrient {i}')
+                  for i in range(len(nutrients), count)]
+    return nutrients
+
+
+def make_ingredients(count: int, nutrients: List[Nutrient],
+                     rng: np.random.Generator,
+                     density: float = 0.3) -> List[Ingredient]:
+    """Make ingredients that vary the poultry preset ingredients
+
+    Each ingredient scales the nutrient profile and cost of a preset
+    ingredient by random factors around 1. Nutrients past the preset ones
+    are given to about density of the ingredients.
+
+    Args:
+        count (int): number of ingredients
+        nutrients (list[Nutrient]): nutrients of make_nutrients
+        rng (np.random.Generator): random numbers to use
+        density (float, optional): share of the ingredients having each
+            extra nutrient. Defaults to 0.3.
+
+    Returns:
+        list[Ingredient]
+    """
+    ingredients = []
+    extra = nutrients[len(PRESET_NUTRIENTS):]
+    for i in range(count):
+        base = PRESET_INGREDIENTS[i % len(PRESET_INGREDIENTS)]
+        ingredient = Ingredient(
+            f'{base.name} {i}',
+            cost=round(base.cost * rng.lognormal(0, 0.2), 2))
+        for inut in base.nutrients:
+            position = PRESET_NUTRIENTS.index(inut.nutrient)
+            if position < len(nutrients):
+                ingredient.add_nutrient(nutrients[position],
+                                        inut.amount * rng.lognormal(0, 0.1))
+        for nutrient in extra:
+            if rng.random() < density:
+                ingredient.add_nutrient(nutrient, rng.uniform(0.01, 10))
+        ingredients.append(ingredient)
+    return ingredients
+
+
+def make_formula(name: str, ingredients: List[Ingredient],
+                 nutrients: List[Nutrient], rng: np.random.Generator,
+                 batch_size: float = 100) -> Formula:
+    """Make a feasible formula from some ingredients
+
+    The nutrient bounds are set around the nutrient levels of a random
+    blend of the ingredients, so the blend always satisfies them.
+
+    Args:
+        name (str): name of the formula
+        ingredients (list[Ingredient]): ingredients of the formula
+        nutrients (list[Nutrient]): nutrients of the formula
+        rng (np.random.Generator): random numbers to use
+        batch_size (float, optional): size of the batch. Defaults to 100.
+
+    Returns:
+        Formula
+    """
+    formula = Formula(name, batch_size=batch_size)
+    blend = rng.dirichlet(np.ones(len(ingredients)))
+    for ingredient in ingredients:
+        formula.add_ingredient(ingredient)
+    levels = np.zeros(len(nutrients))
+    index = {n: row for row, n in enumerate(nutrients)}
+    for share, ingredient in zip(blend, ingredients):
+        for inut in ingredient.nutrients:
+            row = index.get(inut.nutrient)
+            if row is not None:
+                levels[row] += share * inut.amount
+    for nutrient, level in zip(nutrients, levels):
+        bound = rng.random()
+        if bound < 0.6:
+            formula.add_nutrient(nutrient, minimum=round(level * 0.95, 4))
+        elif bound < 0.8:
+            formula.add_nutrient(nutrient, maximum=round(level * 1.05, 4))
+        else:
+            formula.add_nutrient(nutrient)
+    return formula
+
+
+def make_library(num_ingredients: int, num_nutrients: int,
+                 num_formulas: int, formula_ingredients: int = None,
+                 seed: int = 0) -> FormulaLibrary:
+    """Make a synthetic formula library shaped like the poultry presets
+
+    Args:
+        num_ingredients (int): number of ingredients in the catalog
+        num_nutrients (int): number of nutrients in the catalog
+        num_formulas (int): number of formulas
+        formula_ingredients (int, optional): number of catalog ingredients
+            each formula uses. Defaults to all of them.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        FormulaLibrary
+    """
+    rng = np.random.default_rng(seed)
+    nutrients = make_nutrients(num_nutrients)
+    ingredients = make_ingredients(num_ingredients, nutrients, rng)
+    size = min(formula_ingredients or num_ingredients, num_ingredients)
+    formulas = []
+    for f in range(num_formulas):
+        chosen = rng.choice(num_ingredients, size=size, replace=False)
+        formulas.append(make_formula(
+            f'Formula {f}', [ingredients[i] for i in sorted(chosen)],
+            nutrients, rng))
+    return FormulaLibrary('Benchmark', nutrients=nutrients,
+                          ingredients=ingredients, formulas=formulas)
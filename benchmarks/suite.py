@@ -0,0 +1,213 @@
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+import plend
+from plend import FormulaSolver
+
+from .catalog import make_library
+
+
+PHASES = ('build', 'solve', 'readback', 'library')
+
+
+def time_formulas(library: plend.FormulaLibrary,
+                  backend: str = 'pulp') -> Dict[str, float]:
+    """Time building, solving and reading back each library formula
+
+    Args:
+        library (FormulaLibrary): library of the formulas to time
+        backend (str, optional): solver backend. Defaults to 'pulp'.
+
+    Returns:
+        dict: seconds spent on each phase summed over the formulas
+    """
+    timings = dict.fromkeys(('build', 'solve', 'readback'), 0.0)
+    for formula in library.formulas:
+        solver = FormulaSolver(formula, backend=backend)
+        start = time.perf_counter()
+        solver.create_problem(formula)
+        built = time.perf_counter()
+        result = solver.backend.solve(formula.problem)
+        solved = time.perf_counter()
+        solver.read_result(formula, result)
+        read = time.perf_counter()
+        timings['build'] += built - start
+        timings['solve'] += solved - built
+        timings['readback'] += read - solved
+    return timings
+
+
+def time_library(library: plend.FormulaLibrary, backend: str = 'pulp',
+                 workers: int = None) -> float:
+    """Time FormulaLibrary.optimize
+
+    Args:
+        library (FormulaLibrary): library to optimize
+        backend (str, optional): solver backend. Defaults to 'pulp'.
+        workers (int, optional): worker processes. Defaults to None.
+
+    Returns:
+        seconds taken
+    """
+    for formula in library.formulas:
+        formula.solver = FormulaSolver(formula, backend=backend)
+    start = time.perf_counter()
+    library.optimize(workers=workers)
+    return time.perf_counter() - start
+
+
+def run_benchmark(ingredients: int = 50, nutrients: int = 15,
+                  formulas: int = 20, formula_ingredients: int = None,
+                  backend: str = 'pulp', workers: int = None,
+                  repeat: int = 3, seed: int = 0) -> Dict[str, Any]:
+    """Benchmark a synthetic library
+
+    Every repeat times the phases on a freshly generated library, so no
+    repeat reuses problems built by another.
+
+    Args:
+        ingredients (int, optional): catalog ingredients. Defaults to 50.
+        nutrients (int, optional): catalog nutrients. Defaults to 15.
+        formulas (int, optional): formulas. Defaults to 20.
+        formula_ingredients (int, optional): ingredients per formula.
+            Defaults to all of them.
+        backend (str, optional): solver backend. Defaults to 'pulp'.
+        workers (int, optional): worker processes of the library optimize.
+            Defaults to None.
+        repeat (int, optional): number of runs. Defaults to 3.
+        seed (int, optional): random seed of the library. Defaults to 0.
+
+    Returns:
+        dict: record of the environment, parameters and the seconds of each
+        phase in every run
+    """
+    parameters = {'ingredients': ingredients, 'nutrients': nutrients,
+                  'formulas': formulas,
+                  'formula_ingredients': formula_ingredients,
+                  'backend': backend, 'workers': workers, 'repeat': repeat,
+                  'seed': seed}
+
+    def library():
+        return make_library(ingredients, nutrients, formulas,
+                            formula_ingredients, seed)
+
+    runs = {phase: [] for phase in PHASES}
+    for _ in range(repeat):
+        for phase, seconds in time_formulas(library(), backend).items():
+            runs[phase].append(seconds)
+        runs['library'].append(time_library(library(), backend, workers))
+    return {
+        'environment': environment(),
+        'parameters': parameters,
+        'runs': runs,
+        'summary': {phase: summarize(seconds)
+                    for phase, seconds in runs.items()},
+    }
+
+
+def environment() -> Dict[str, str]:
+    """Describe the machine and versions a benchmark ran with
+    """
+    return {
+        'plend': plend.__version__,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'timestamp': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+    }
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    """Summarize the seconds of the runs of a phase
+    """
+    return {'min': min(seconds), 'median': statistics.median(seconds),
+            'mean': statistics.mean(seconds), 'max': max(seconds)}
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any],
+            statistic: str = 'median') -> Dict[str, float]:
+    """Compare two benchmark records
+
+    Args:
+        old (dict): baseline record of run_benchmark
+        new (dict): record to compare with the baseline
+        statistic (str, optional): summary statistic to compare.
+            Defaults to 'median'.
+
+    Returns:
+        dict: new / old ratio of each phase both records have
+    """
+    ratios = {}
+    for phase, summary in new['summary'].items():
+        if phase in old['summary'] and old['summary'][phase][statistic]:
+            ratios[phase] = summary[statistic] / \
+                old['summary'][phase][statistic]
+    return ratios
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Benchmark plend on synthetic formula libraries')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run a benchmark')
+    run.add_argument('--ingredients', type=int, default=50)
+    run.add_argument('--nutrients', type=int, default=15)
+    run.add_argument('--formulas', type=int, default=20)
+    run.add_argument('--formula-ingredients', type=int, default=None)
+    run.add_argument('--backend', default='pulp')
+    run.add_argument('--workers', type=int, default=None)
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--output', '-o', help='JSON file to write')
+
+    diff = commands.add_parser('compare', help='compare two JSON records')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--statistic', default='median')
+    diff.add_argument('--threshold', type=float, default=1.2,
+                      help='ratio above which a phase is a regression')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        record = run_benchmark(args.ingredients, args.nutrients,
+                               args.formulas, args.formula_ingredients,
+                               args.backend, args.workers, args.repeat,
+                               args.seed)
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(record, file, indent=2)
+            for phase, summary in record['summary'].items():
+                print(f'{phase:10} {summary["median"]:10.4f}s')
+        else:
+            print(json.dumps(record, indent=2))
+        return 0
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    regressed = False
+    for phase, ratio in compare(old, new, args.statistic).items():
+        flag = ''
+        if ratio > args.threshold:
+            regressed = True
+            flag = '  REGRESSION'
+        print(f'{phase:10} {ratio:6.2f}x{flag}')
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -61,7 +61,7 @@ finisher.add_nutrient(calcium, minimum=0.85)
 
 
 formulas = FormulaLibrary(name='Broiler')
-formulas.add_formulas(starter, grower, finisher)
+formulas.add_formulas([starter, grower, finisher])
 
 formulas.optimize()
 
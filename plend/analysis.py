@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from typing import List, Sequence
+
+from .matrix import SparseMatrix
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class Analysis:
+    def __init__(self, amounts: np.ndarray, totals: np.ndarray,
+                 costs: np.ndarray, nutrients: np.ndarray,
+                 nutrient_shortfall: np.ndarray, nutrient_excess: np.ndarray,
+                 ingredient_shortfall: np.ndarray,
+                 ingredient_excess: np.ndarray, nutrient_codes: List[str],
+                 ingredient_codes: List[str]):
+        """Nutrient levels, cost and bound violations of a batch of mixes
+
+        Args:
+            amounts (np.ndarray): (mixes, ingredients) ingredient amounts
+            totals (np.ndarray): total amount of each mix
+            costs (np.ndarray): cost per unit of each mix
+            nutrients (np.ndarray): (mixes, nutrients) nutrient levels per
+                unit of each mix
+            nutrient_shortfall (np.ndarray): (mixes, nutrients) how far each
+                level is below its minimum, 0 if it is not
+            nutrient_excess (np.ndarray): (mixes, nutrients) how far each
+                level is above its maximum, 0 if it is not
+            ingredient_shortfall (np.ndarray): (mixes, ingredients) how far
+                each amount, scaled to the batch size, is below its minimum,
+                0 if it is not
+            ingredient_excess (np.ndarray): (mixes, ingredients) how far
+                each amount, scaled to the batch size, is above its maximum,
+                0 if it is not
+            nutrient_codes (list[str]): code of each nutrient
+            ingredient_codes (list[str]): code of each ingredient
+        """
+        self.amounts = amounts
+        self.totals = totals
+        self.costs = costs
+        self.nutrients = nutrients
+        self.nutrient_shortfall = nutrient_shortfall
+        self.nutrient_excess = nutrient_excess
+        self.ingredient_shortfall = ingredient_shortfall
+        self.ingredient_excess = ingredient_excess
+        self.nutrient_codes = nutrient_codes
+        self.ingredient_codes = ingredient_codes
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def feasible(self, tolerance: float = 1e-6) -> np.ndarray:
+        """Check which mixes meet every nutrient and ingredient bound
+
+        Args:
+            tolerance (float, optional): largest violation to ignore.
+                Defaults to 1e-6.
+
+        Returns:
+            bool of each mix (np.ndarray)
+        """
+        return ((self.nutrient_shortfall <= tolerance)
+                & (self.nutrient_excess <= tolerance)).all(axis=1) \
+            & ((self.ingredient_shortfall <= tolerance)
+               & (self.ingredient_excess <= tolerance)).all(axis=1)
+
+    def level(self, code: str) -> np.ndarray:
+        """Get the level of a nutrient in each mix
+
+        Args:
+            code (str): code of the nutrient
+
+        Returns:
+            level in each mix (np.ndarray)
+        """
+        return self.nutrients[:, self.nutrient_codes.index(code)]
+
+
+def analyze_amounts(matrix: SparseMatrix, costs: Sequence[float],
+                    amounts: Sequence[Sequence[float]],
+                    nutrient_bounds: Sequence[Sequence[float]],
+                    ingredient_bounds: Sequence[Sequence[float]],
+                    nutrient_codes: List[str],
+                    ingredient_codes: List[str],
+                    batch_size: float = None) -> Analysis:
+    """Analyze a batch of mixes with one product of the nutrient matrix
+
+    Nutrient levels and costs are per unit of each mix, the mix total
+    being the sum of its amounts, which is the batch size of a solved
+    formula. Amounts are scaled to the batch size before checking the
+    ingredient bounds, so a mix and any multiple of it get the same
+    analysis.
+
+    Args:
+        matrix (SparseMatrix): (nutrients, ingredients) nutrient amounts
+        costs (list[float]): cost of each ingredient
+        amounts (list): (mixes, ingredients) ingredient amounts
+        nutrient_bounds (list): (minimum, maximum) of each nutrient,
+            -inf and inf if unbounded
+        ingredient_bounds (list): (minimum, maximum) of each ingredient,
+            -inf and inf if unbounded
+        nutrient_codes (list[str]): code of each nutrient
+        ingredient_codes (list[str]): code of each ingredient
+        batch_size (float, optional): total the ingredient bounds apply to.
+            Defaults to the total of each mix, checking the amounts as
+            given.
+
+    Returns:
+        Analysis
+    """
+    amounts = np.atleast_2d(np.asarray(amounts, dtype=float))
+    if amounts.shape[1] != matrix.shape[1]:
+        raise ValueError(f'expected {matrix.shape[1]} amounts per mix, '
+                         f'got {amounts.shape[1]}')
+    totals = amounts.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(totals != 0, 1 / totals, np.nan)
+    nutrients = matrix.dot(amounts.T).T * scale[:, None]
+    scaled = amounts if batch_size is None \
+        else amounts * (batch_size * scale)[:, None]
+    nutrient_bounds = np.asarray(nutrient_bounds, dtype=float).reshape(-1, 2)
+    ingredient_bounds = np.asarray(ingredient_bounds,
+                                   dtype=float).reshape(-1, 2)
+    return Analysis(
+        amounts, totals,
+        costs=amounts @ np.asarray(costs, dtype=float) * scale,
+        nutrients=nutrients,
+        nutrient_shortfall=np.maximum(nutrient_bounds[:, 0] - nutrients, 0),
+        nutrient_excess=np.maximum(nutrients - nutrient_bounds[:, 1], 0),
+        ingredient_shortfall=np.maximum(ingredient_bounds[:, 0] - scaled, 0),
+        ingredient_excess=np.maximum(scaled - ingredient_bounds[:, 1], 0),
+        nutrient_codes=nutrient_codes, ingredient_codes=ingredient_codes)
@@ -0,0 +1,582 @@
+from __future__ import annotations
+
+import copy
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+from .matrix import SparseMatrix
+from .utils import lazy_import
+
+# solvers are imported when a problem is first built
+np = lazy_import('numpy')
+pulp = lazy_import('pulp')
+highspy = lazy_import('highspy', optional=True)
+
+
+class LinearProgram:
+    """Minimization problem in array form
+
+    minimize costs @ x
+    subject to row_lower <= matrix @ x <= row_upper
+               lower <= x <= upper
+               x integer where integrality is 1
+
+    Missing bounds are -inf or inf.
+    """
+
+    def __init__(self, name: str, costs: Sequence[float],
+                 lower: Sequence[float], upper: Sequence[float],
+                 matrix: SparseMatrix, row_lower: Sequence[float],
+                 row_upper: Sequence[float], col_names: List[str] = None,
+                 row_names: List[str] = None,
+                 integrality: Sequence[int] = None):
+        """Create a LinearProgram
+
+        Args:
+            name (str): name of the problem
+            costs (list): objective coefficient of each column
+            lower (list): lower bound of each column
+            upper (list): upper bound of each column
+            matrix (SparseMatrix): constraint matrix
+            row_lower (list): lower bound of each row
+            row_upper (list): upper bound of each row
+            col_names (list[str], optional): name of each column.
+                Defaults to None.
+            row_names (list[str], optional): name of each row.
+                Defaults to None.
+            integrality (list[int], optional): 1 for each integer column,
+                0 for each continuous one. Defaults to None, a linear
+                program.
+        """
+        self.name = name
+        self.costs = np.asarray(costs, dtype=float)
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.matrix = matrix
+        self.row_lower = np.asarray(row_lower, dtype=float)
+        self.row_upper = np.asarray(row_upper, dtype=float)
+        self.col_names = col_names or [f'x{j}' for j in range(self.num_cols)]
+        self.row_names = row_names or [f'r{i}' for i in range(self.num_rows)]
+        self.integrality = None if integrality is None else \
+            np.asarray(integrality, dtype=np.int8)
+
+    @property
+    def is_mip(self) -> bool:
+        """True if some columns are integer
+        """
+        return self.integrality is not None and bool(self.integrality.any())
+
+    @property
+    def num_cols(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def num_rows(self) -> int:
+        return self.matrix.shape[0]
+
+    def with_costs(self, costs: Sequence[float]) -> 'LinearProgram':
+        """Copy the program with other objective coefficients
+
+        Args:
+            costs (list): objective coefficient of each column
+
+        Returns:
+            LinearProgram sharing everything else with this one
+        """
+        program = copy.copy(self)
+        program.costs = np.asarray(costs, dtype=float)
+        return program
+
+    def same_structure(self, other: 'LinearProgram') -> bool:
+        """Check if another LinearProgram only differs in costs and bounds
+
+        Args:
+            other (LinearProgram): program to compare
+
+        Returns:
+            bool
+        """
+        return (self.col_names == other.col_names
+                and self.row_names == other.row_names
+                and self.matrix.shape == other.matrix.shape
+                and np.array_equal(self.matrix.indptr, other.matrix.indptr)
+                and np.array_equal(self.matrix.indices, other.matrix.indices)
+                and np.array_equal(self.matrix.data, other.matrix.data)
+                and np.array_equal(self._integrality, other._integrality))
+
+    @property
+    def _integrality(self) -> np.ndarray:
+        if self.integrality is None:
+            return np.zeros(self.num_cols, dtype=np.int8)
+        return self.integrality
+
+    def changed_columns(self, other: 'LinearProgram') -> Tuple[np.ndarray,
+                                                               np.ndarray]:
+        """Get the columns whose cost or bounds differ in another program
+
+        Returns:
+            (columns with changed costs, columns with changed bounds)
+        """
+        return (np.flatnonzero(self.costs != other.costs),
+                np.flatnonzero((self.lower != other.lower)
+                               | (self.upper != other.upper)))
+
+    def changed_rows(self, other: 'LinearProgram') -> np.ndarray:
+        """Get the rows whose bounds differ in another program
+        """
+        return np.flatnonzero((self.row_lower != other.row_lower)
+                              | (self.row_upper != other.row_upper))
+
+    def digest(self, settings: Dict[str, Any] = None) -> str:
+        """Get a hash of the costs, bounds and matrix of the program, equal
+        for programs that solve to the same result
+
+        Args:
+            settings (dict, optional): solver settings that change the
+                result, see SolverBackend.settings. Defaults to None.
+        """
+        import hashlib
+        digest = hashlib.sha256()
+        digest.update(np.asarray(self.matrix.shape, dtype='<i8').tobytes())
+        for values in (self.costs, self.lower, self.upper, self.row_lower,
+                       self.row_upper, self.matrix.data):
+            # adding zero turns -0.0 into 0.0
+            digest.update((np.asarray(values, dtype='<f8') + 0.0).tobytes())
+        for values in (self.matrix.indptr, self.matrix.indices):
+            digest.update(np.asarray(values, dtype='<i8').tobytes())
+        if self.is_mip:
+            digest.update(self.integrality.astype('<i1').tobytes())
+        if settings:
+            digest.update(repr(sorted(settings.items())).encode())
+        return digest.hexdigest()
+
+
+class SolverResult:
+    def __init__(self, status: str, values: Sequence[float],
+                 objective: float = None, row_duals: Sequence[float] = None,
+                 reduced_costs: Sequence[float] = None,
+                 iterations: int = None, mip_gap: float = None):
+        """Solution returned by a solver backend
+
+        Args:
+            status (str): PuLP style status ('Optimal', 'Infeasible', ...)
+            values (list): value of each column, nan if it has none
+            objective (float, optional): objective value. Defaults to None.
+            row_duals (list, optional): dual value of each row, if the
+                solver reports them. Defaults to None.
+            reduced_costs (list, optional): reduced cost of each column, if
+                the solver reports them. Defaults to None.
+            iterations (int, optional): simplex iterations, if the solver
+                reports them. Defaults to None.
+            mip_gap (float, optional): relative gap between the solution
+                and the best bound of an integer program, if the solver
+                reports it. Defaults to None.
+        """
+        self.status = status
+        self.values = np.asarray(values, dtype=float)
+        self.objective = objective
+        self.row_duals = _optional_array(row_duals)
+        self.reduced_costs = _optional_array(reduced_costs)
+        self.iterations = iterations
+        self.mip_gap = mip_gap
+
+
+class SolverBackend:
+    """Builds and solves LinearPrograms with a specific solver
+    """
+    name = None
+
+    def build(self, program: LinearProgram) -> Any:
+        """Build the solver problem for a LinearProgram
+
+        Args:
+            program (LinearProgram): problem to build
+
+        Returns:
+            the solver specific problem
+        """
+        raise NotImplementedError
+
+    def variables(self, problem: Any) -> List[Any]:
+        """Get the solver variable of each column of a built problem
+        """
+        raise NotImplementedError
+
+    def update(self, problem: Any, old: LinearProgram,
+               new: LinearProgram) -> bool:
+        """Patch a built problem with the costs and bounds of a program
+        with the same structure
+
+        Args:
+            problem: problem built from old
+            old (LinearProgram): program the problem was built from
+            new (LinearProgram): program with new costs and bounds
+
+        Returns:
+            False if the problem could not be patched and has to be rebuilt
+        """
+        return False
+
+    def set_start(self, problem: Any, values: Sequence[float]):
+        """Give a built problem a starting solution for the integer
+        solver, backends that can't use one ignore it
+
+        Args:
+            problem: problem returned by build
+            values (list): value of each column
+        """
+
+    def solve(self, problem: Any) -> SolverResult:
+        """Solve a built problem
+
+        Args:
+            problem: problem returned by build
+
+        Returns:
+            SolverResult
+        """
+        raise NotImplementedError
+
+    def settings(self) -> Dict[str, Any]:
+        """Get the solver settings that can change the result of a solve,
+        like time limits and gaps, to keep results of different settings
+        apart in a solution cache
+        """
+        return {}
+
+
+def __getattr__(name: str) -> Any:
+    if name == 'PulpProblem':
+        return _pulp_problem()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def _pulp_problem() -> type:
+    """Get the PulpProblem class, defined on first use because subclassing
+    pulp.LpProblem imports pulp
+    """
+    global PulpProblem
+    if 'PulpProblem' not in globals():
+        class PulpProblem(pulp.LpProblem):
+            """LpProblem that remembers the variable of each LinearProgram
+            column
+            """
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.columns = []
+                self.rows = []
+                self.warm_start = False
+        PulpProblem.__qualname__ = 'PulpProblem'
+    return PulpProblem
+
+
+class PulpBackend(SolverBackend):
+    name = 'pulp'
+
+    def __init__(self, solver: pulp.LpSolver = None,
+                 time_limit: float = None, mip_gap: float = None,
+                 threads: int = None):
+        """Solve with PuLP, writing the problem for its solver command
+
+        Args:
+            solver (LpSolver, optional): PuLP solver to use.
+                Defaults to PuLP's default solver, or CBC with the limits
+                below if any is given.
+            time_limit (float, optional): seconds the solver may run, an
+                integer program returns the best solution found by then
+                with the status 'Feasible'. Defaults to None.
+            mip_gap (float, optional): relative gap to the best bound at
+                which an integer program counts as solved.
+                Defaults to None.
+            threads (int, optional): solver threads. Defaults to None.
+        """
+        self.solver = solver
+        self.time_limit = time_limit
+        self.mip_gap = mip_gap
+        self.threads = threads
+
+    def build(self, program: LinearProgram) -> PulpProblem:
+        problem = _pulp_problem()(program.name, pulp.LpMinimize)
+        problem.columns = [
+            pulp.LpVariable(name=name,
+                            lowBound=_finite(lower),
+                            upBound=_finite(upper),
+                            cat=pulp.LpInteger if integer
+                            else pulp.LpContinuous)
+            for name, lower, upper, integer in zip(
+                program.col_names, program.lower.tolist(),
+                program.upper.tolist(), program._integrality.tolist())]
+        problem += pulp.lpSum([variable * cost for variable, cost
+                               in zip(problem.columns, program.costs.tolist())
+                               if cost])
+        for row, name in enumerate(program.row_names):
+            indices, values = program.matrix.row_entries(row)
+            total = pulp.LpAffineExpression(
+                [(problem.columns[j], value)
+                 for j, value in zip(indices.tolist(), values.tolist())])
+            lower = _finite(program.row_lower[row])
+            upper = _finite(program.row_upper[row])
+            if lower is not None and lower == upper:
+                constraint = total == lower
+                problem += constraint, name
+                problem.rows.append((constraint, constraint))
+                continue
+            minimum = maximum = None
+            if lower is not None:
+                minimum = total >= lower
+                problem += minimum, f'min_{name}'
+            if upper is not None:
+                maximum = total <= upper
+                problem += maximum, f'max_{name}'
+            problem.rows.append((minimum, maximum))
+        return problem
+
+    def variables(self, problem: PulpProblem) -> List[pulp.LpVariable]:
+        return problem.columns
+
+    def update(self, problem: PulpProblem, old: LinearProgram,
+               new: LinearProgram) -> bool:
+        if not isinstance(problem, _pulp_problem()):
+            return False
+        costs, bounds = old.changed_columns(new)
+        for j in costs.tolist():
+            problem.objective[problem.columns[j]] = float(new.costs[j])
+        for j in bounds.tolist():
+            problem.columns[j].lowBound = _finite(new.lower[j])
+            problem.columns[j].upBound = _finite(new.upper[j])
+        for row in old.changed_rows(new).tolist():
+            minimum, maximum = problem.rows[row]
+            lower = _finite(new.row_lower[row])
+            upper = _finite(new.row_upper[row])
+            # constraints can only be moved, not added, removed or merged
+            if (minimum is maximum) != (lower is not None and lower == upper):
+                return False
+            if (minimum is None) != (lower is None) \
+                    or (maximum is None) != (upper is None):
+                return False
+            if minimum is not None:
+                minimum.changeRHS(lower)
+            if maximum is not None:
+                maximum.changeRHS(upper)
+        return True
+
+    def set_start(self, problem: PulpProblem, values: Sequence[float]):
+        for variable, value in zip(problem.columns, values):
+            variable.setInitialValue(value)
+        problem.warm_start = True
+
+    def solve(self, problem: PulpProblem) -> SolverResult:
+        solver = self.solver
+        if solver is None and (problem.warm_start
+                               or self.time_limit is not None
+                               or self.mip_gap is not None
+                               or self.threads is not None):
+            solver = pulp.PULP_CBC_CMD(timeLimit=self.time_limit,
+                                       gapRel=self.mip_gap,
+                                       threads=self.threads,
+                                       warmStart=problem.warm_start)
+        problem.solve(solver)
+        row_duals = []
+        for minimum, maximum in problem.rows:
+            constraints = [minimum] if minimum is maximum else \
+                [minimum, maximum]
+            duals = [c.pi for c in constraints if c is not None]
+            row_duals.append(None if None in duals else sum(duals))
+        reduced_costs = [v.dj for v in problem.columns]
+        status = pulp.LpStatus[problem.status]
+        # CBC stopped by a limit reports its incumbent as optimal
+        if getattr(problem, 'sol_status', None) == \
+                pulp.LpSolutionIntegerFeasible:
+            status = 'Feasible'
+        return SolverResult(
+            status,
+            [v.varValue for v in problem.columns],
+            pulp.value(problem.objective),
+            row_duals=None if None in row_duals else row_duals,
+            reduced_costs=None if None in reduced_costs else reduced_costs)
+
+    def settings(self) -> Dict[str, Any]:
+        solver = self.solver
+        settings = {
+            'time_limit': self.time_limit if solver is None
+            else getattr(solver, 'timeLimit', None),
+            'mip_gap': self.mip_gap if solver is None
+            else getattr(solver, 'optionsDict', {}).get('gapRel'),
+        }
+        return {k: v for k, v in settings.items() if v is not None}
+
+
+class HighsBackend(SolverBackend):
+    name = 'highs'
+
+    def __init__(self, options: Dict[str, Any] = None,
+                 time_limit: float = None, mip_gap: float = None,
+                 threads: int = None):
+        """Solve in process with HiGHS, without writing any files
+
+        Requires the highspy package.
+
+        Args:
+            options (dict, optional): HiGHS options to set on each problem.
+                Defaults to None.
+            time_limit (float, optional): seconds the solver may run, an
+                integer program returns the best solution found by then
+                with the status 'Feasible'. Defaults to None.
+            mip_gap (float, optional): relative gap to the best bound at
+                which an integer program counts as solved.
+                Defaults to None.
+            threads (int, optional): solver threads. Defaults to None.
+        """
+        if highspy is None:
+            raise ImportError('the highs backend requires highspy, '
+                              'install it with `pip install highspy`')
+        self.options = dict(options or {})
+        for option, value in (('time_limit', time_limit),
+                              ('mip_rel_gap', mip_gap),
+                              ('threads', threads)):
+            if value is not None:
+                self.options[option] = value
+
+    def build(self, program: LinearProgram) -> 'highspy.Highs':
+        lp = highspy.HighsLp()
+        lp.model_name_ = program.name
+        lp.num_col_ = program.num_cols
+        lp.num_row_ = program.num_rows
+        lp.col_cost_ = program.costs
+        lp.col_lower_ = program.lower
+        lp.col_upper_ = program.upper
+        lp.row_lower_ = program.row_lower
+        lp.row_upper_ = program.row_upper
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+        lp.a_matrix_.num_col_ = program.num_cols
+        lp.a_matrix_.num_row_ = program.num_rows
+        lp.a_matrix_.start_ = program.matrix.indptr
+        lp.a_matrix_.index_ = program.matrix.indices
+        lp.a_matrix_.value_ = program.matrix.data
+        if program.is_mip:
+            lp.integrality_ = [highspy.HighsVarType.kInteger if integer
+                               else highspy.HighsVarType.kContinuous
+                               for integer in program.integrality.tolist()]
+        problem = highspy.Highs()
+        problem.setOptionValue('output_flag', False)
+        for option, value in self.options.items():
+            problem.setOptionValue(option, value)
+        problem.passModel(lp)
+        return problem
+
+    def variables(self, problem: 'highspy.Highs') -> List[int]:
+        return list(range(problem.getNumCol()))
+
+    def update(self, problem: 'highspy.Highs', old: LinearProgram,
+               new: LinearProgram) -> bool:
+        # HiGHS keeps the current basis, so the next run warm starts from it
+        if not isinstance(problem, highspy.Highs):
+            return False
+        costs, bounds = old.changed_columns(new)
+        if len(costs):
+            problem.changeColsCost(len(costs), costs.astype(np.int32),
+                                   new.costs[costs])
+        if len(bounds):
+            problem.changeColsBounds(len(bounds), bounds.astype(np.int32),
+                                     new.lower[bounds], new.upper[bounds])
+        rows = old.changed_rows(new)
+        if len(rows):
+            problem.changeRowsBounds(len(rows), rows.astype(np.int32),
+                                     new.row_lower[rows], new.row_upper[rows])
+        return True
+
+    def set_start(self, problem: 'highspy.Highs', values: Sequence[float]):
+        start = highspy.HighsSolution()
+        start.col_value = list(values)
+        start.value_valid = True
+        problem.setSolution(start)
+
+    def solve(self, problem: 'highspy.Highs') -> SolverResult:
+        problem.run()
+        solution = problem.getSolution()
+        info = problem.getInfo()
+        # the node count is -1 for a linear program
+        is_mip = info.mip_node_count >= 0
+        status = _highs_status(
+            problem.getModelStatus(),
+            is_mip and info.primal_solution_status
+            == highspy.SolutionStatus.kSolutionStatusFeasible)
+        # the values of a solve stopped early need not be feasible
+        values = solution.col_value \
+            if solution.value_valid and status != 'Not Solved' \
+            else [np.nan] * problem.getNumCol()
+        if solution.dual_valid:
+            row_duals, reduced_costs = solution.row_dual, solution.col_dual
+        else:
+            row_duals = reduced_costs = None
+        mip_gap = info.mip_gap if is_mip else None
+        return SolverResult(status, values, info.objective_function_value,
+                            row_duals=row_duals, reduced_costs=reduced_costs,
+                            iterations=info.simplex_iteration_count,
+                            mip_gap=mip_gap)
+
+    def settings(self) -> Dict[str, Any]:
+        # options that only change how the solve runs or logs
+        return {k: v for k, v in self.options.items()
+                if k not in ('threads', 'output_flag', 'log_to_console',
+                             'log_file')}
+
+
+BACKENDS = {
+    PulpBackend.name: PulpBackend,
+    HighsBackend.name: HighsBackend,
+}
+
+
+def get_backend(backend: Union[str, SolverBackend] = None) -> SolverBackend:
+    """Get a solver backend by name
+
+    Args:
+        backend (str or SolverBackend, optional): name of the backend
+            ('pulp' or 'highs') or a backend instance. Defaults to 'pulp'.
+
+    Returns:
+        SolverBackend
+    """
+    if isinstance(backend, SolverBackend):
+        return backend
+    if backend is None:
+        backend = PulpBackend.name
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown solver backend {backend!r}, '
+                         f'expected one of {sorted(BACKENDS)}')
+    return BACKENDS[backend]()
+
+
+def _optional_array(values: Sequence[float]) -> np.ndarray:
+    """Convert values to an array, keeping None
+    """
+    return None if values is None else np.asarray(values, dtype=float)
+
+
+def _finite(value: float) -> float:
+    """Convert an infinite bound to None
+    """
+    return float(value) if np.isfinite(value) else None
+
+
+def _highs_status(status: Any, incumbent: bool = False) -> str:
+    """Convert a HiGHS model status to a PuLP style status
+
+    An integer program stopped by a limit with a feasible incumbent is
+    'Feasible', the remaining gap is in SolverResult.mip_gap. Any other
+    solve stopped by a limit is 'Not Solved'.
+    """
+    statuses = {
+        highspy.HighsModelStatus.kOptimal: 'Optimal',
+        highspy.HighsModelStatus.kInfeasible: 'Infeasible',
+        highspy.HighsModelStatus.kUnbounded: 'Unbounded',
+        highspy.HighsModelStatus.kUnboundedOrInfeasible: 'Undefined',
+        highspy.HighsModelStatus.kModelEmpty: 'Optimal',
+    }
+    if status not in statuses and incumbent and status in (
+            highspy.HighsModelStatus.kTimeLimit,
+            highspy.HighsModelStatus.kIterationLimit,
+            highspy.HighsModelStatus.kSolutionLimit):
+        return 'Feasible'
+    return statuses.get(status, 'Not Solved')
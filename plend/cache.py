@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from .backends import SolverResult
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class SolutionCache:
+    """Least recently used cache of solver results keyed by the digest of
+    the LinearProgram that was solved, optionally backed by a directory
+    """
+
+    def __init__(self, maxsize: int = 1024, path: str = None):
+        """Create a SolutionCache
+
+        Args:
+            maxsize (int, optional): number of results to keep in memory.
+                Defaults to 1024.
+            path (str, optional): directory to also store results in,
+                shared by every cache (and process) using it.
+                Defaults to None.
+        """
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._results or (
+            self.path is not None and os.path.exists(self._file(key)))
+
+    def __getstate__(self) -> Dict:
+        # copies sent to other processes start empty, only the directory
+        # and the settings are shared
+        state = self.__dict__.copy()
+        state['hits'] = state['misses'] = 0
+        state['_results'] = OrderedDict()
+        return state
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Hit and miss statistics of the cache
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self),
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def get(self, key: str) -> SolverResult:
+        """Get a result, counting the lookup as a hit or a miss
+
+        Args:
+            key (str): digest of the solved LinearProgram
+
+        Returns:
+            SolverResult, or None if the cache does not have it
+        """
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+        elif self.path is not None:
+            result = self._load(key)
+            if result is not None:
+                self._remember(key, result)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result: SolverResult):
+        """Add a result
+
+        Args:
+            key (str): digest of the solved LinearProgram
+            result (SolverResult): result of solving it
+        """
+        self._remember(key, result)
+        if self.path is not None:
+            self._store(key, result)
+
+    def items(self) -> List[Tuple[str, SolverResult]]:
+        """Get the results in memory, least recently used first
+        """
+        return list(self._results.items())
+
+    def update(self, items: List[Tuple[str, SolverResult]]):
+        """Add results from items of another cache
+        """
+        for key, result in items:
+            self._remember(key, result)
+
+    def clear(self):
+        """Forget the results in memory and reset the statistics
+        """
+        self._results.clear()
+        self.hits = self.misses = 0
+
+    def _remember(self, key: str, result: SolverResult):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.npz')
+
+    def _load(self, key: str) -> SolverResult:
+        try:
+            with np.load(self._file(key), allow_pickle=False) as data:
+                objective = float(data['objective'])
+                return SolverResult(
+                    str(data['status']), data['values'],
+                    None if np.isnan(objective) else objective,
+                    row_duals=data['row_duals'] if 'row_duals' in data
+                    else None,
+                    reduced_costs=data['reduced_costs']
+                    if 'reduced_costs' in data else None)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _store(self, key: str, result: SolverResult):
+        arrays = {'status': np.array(result.status),
+                  'values': result.values,
+                  'objective': np.array(np.nan if result.objective is None
+                                        else result.objective)}
+        if result.row_duals is not None:
+            arrays['row_duals'] = result.row_duals
+        if result.reduced_costs is not None:
+            arrays['reduced_costs'] = result.reduced_costs
+        import tempfile
+        # write to a temporary file first so readers never see a partial one
+        handle, temporary = tempfile.mkstemp(dir=self.path, suffix='.npz')
+        with os.fdopen(handle, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temporary, self._file(key))
@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import csv
+import os
+import struct
+import zipfile
+from typing import Any, Dict, List, Sequence
+
+from . import utils
+
+np = utils.lazy_import('numpy')
+
+# column names of the catalog tables
+NAME_COLUMNS = ('name', 'ingredient')
+CODE_COLUMN = 'code'
+COST_COLUMN = 'cost'
+NUTRIENT_COLUMN = 'nutrient'
+AMOUNT_COLUMN = 'amount'
+
+
+class Catalog:
+    """Ingredient by nutrient table of a catalog of ingredients
+
+    The amounts are kept as one (ingredients, nutrients) array, nan where an
+    ingredient does not have a nutrient. Ingredient and Nutrient objects are
+    only created when they are first asked for and are the same objects on
+    every later request.
+    """
+
+    def __init__(self, ingredient_names: Sequence[str],
+                 nutrient_names: Sequence[str], amounts: np.ndarray,
+                 costs: Sequence[float] = None,
+                 ingredient_codes: Sequence[str] = None,
+                 nutrient_codes: Sequence[str] = None,
+                 units: Sequence[str] = None):
+        """Create a Catalog
+
+        Args:
+            ingredient_names (list[str]): name of each ingredient (row)
+            nutrient_names (list[str]): name of each nutrient (column)
+            amounts (np.ndarray): (ingredients, nutrients) nutrient amounts
+            costs (list, optional): cost of each ingredient. Defaults to 0.
+            ingredient_codes (list[str], optional): code of each ingredient.
+                Defaults to the cleaned names.
+            nutrient_codes (list[str], optional): code of each nutrient.
+                Defaults to the cleaned names.
+            units (list[str], optional): unit of each nutrient.
+                Defaults to None.
+        """
+        self.ingredient_names = np.asarray(ingredient_names, dtype=str)
+        self.nutrient_names = np.asarray(nutrient_names, dtype=str)
+        self.amounts = amounts
+        self.costs = np.zeros(len(self.ingredient_names)) if costs is None \
+            else np.nan_to_num(np.asarray(costs, dtype=float))
+        self._ingredient_codes = ingredient_codes
+        self._nutrient_codes = nutrient_codes
+        self.units = units
+        self._ingredients = {}
+        self._nutrients = {}
+        self._ingredient_index = None
+        self._nutrient_index = None
+
+    def __len__(self) -> int:
+        return len(self.ingredient_names)
+
+    @property
+    def shape(self):
+        return self.amounts.shape
+
+    @property
+    def ingredient_codes(self) -> List[str]:
+        if self._ingredient_codes is None:
+            self._ingredient_codes = [utils.clean_name(n)
+                                      for n in self.ingredient_names]
+        return list(self._ingredient_codes)
+
+    @property
+    def nutrient_codes(self) -> List[str]:
+        if self._nutrient_codes is None:
+            self._nutrient_codes = [utils.clean_name(n)
+                                    for n in self.nutrient_names]
+        return list(self._nutrient_codes)
+
+    def ingredient_row(self, key: Any) -> int:
+        """Get the row of an ingredient
+
+        Args:
+            key: row, code or name of the ingredient
+
+        Returns:
+            row (int)
+        """
+        if isinstance(key, (int, np.integer)):
+            return int(key)
+        if self._ingredient_index is None:
+            self._ingredient_index = _index(self.ingredient_codes,
+                                            self.ingredient_names)
+        return self._ingredient_index[key]
+
+    def nutrient_column(self, key: Any) -> int:
+        """Get the column of a nutrient
+
+        Args:
+            key: column, code or name of the nutrient
+
+        Returns:
+            column (int)
+        """
+        if isinstance(key, (int, np.integer)):
+            return int(key)
+        if self._nutrient_index is None:
+            self._nutrient_index = _index(self.nutrient_codes,
+                                          self.nutrient_names)
+        return self._nutrient_index[key]
+
+    def get_nutrient(self, key: Any) -> Any:
+        """Get the Nutrient of a column, creating it on first use
+
+        Args:
+            key: column, code or name of the nutrient
+
+        Returns:
+            Nutrient
+        """
+        from .models import Nutrient
+        column = self.nutrient_column(key)
+        nutrient = self._nutrients.get(column)
+        if nutrient is None:
+            nutrient = Nutrient(str(self.nutrient_names[column]),
+                                code=self.nutrient_codes[column],
+                                unit=self.units[column] if self.units
+                                is not None else None)
+            self._nutrients[column] = nutrient
+        return nutrient
+
+    def get_ingredient(self, key: Any) -> Any:
+        """Get the Ingredient of a row, creating it and the Nutrients it
+        has on first use
+
+        Args:
+            key: row, code or name of the ingredient
+
+        Returns:
+            Ingredient
+        """
+        from .models import Ingredient
+        row = self.ingredient_row(key)
+        ingredient = self._ingredients.get(row)
+        if ingredient is None:
+            ingredient = Ingredient(str(self.ingredient_names[row]),
+                                    code=self.ingredient_codes[row],
+                                    cost=float(self.costs[row]))
+            amounts = np.asarray(self.amounts[row], dtype=float)
+            for column in np.flatnonzero(np.nan_to_num(amounts)).tolist():
+                ingredient.add_nutrient(self.get_nutrient(column),
+                                        float(amounts[column]))
+            self._ingredients[row] = ingredient
+        return ingredient
+
+    @property
+    def ingredients(self) -> List[Any]:
+        """All ingredients, creating those not created yet
+        """
+        return [self.get_ingredient(row) for row in range(len(self))]
+
+    @property
+    def nutrients(self) -> List[Any]:
+        """All nutrients, creating those not created yet
+        """
+        return [self.get_nutrient(column)
+                for column in range(len(self.nutrient_names))]
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'Catalog':
+        """Load a catalog from a CSV, Parquet or NPZ file
+
+        CSV and Parquet tables are either wide, one row per ingredient with
+        a name (or ingredient) column, optional code and cost columns and
+        one column per nutrient, or long, with ingredient, nutrient and
+        amount columns and an optional cost column. NPZ files are written
+        by save_npz.
+
+        Args:
+            path (str): file to load, the format is told by its extension
+            mmap (bool, optional): memory map the amounts of uncompressed
+                NPZ files instead of reading them. Parquet files are memory
+                mapped while they are read, but their amounts are copied
+                into one array. Defaults to True.
+
+        Returns:
+            Catalog
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.npz':
+            return cls._from_arrays(_load_npz(path, mmap))
+        if extension in ('.parquet', '.pq'):
+            return cls._from_columns(_read_parquet(path, mmap))
+        if extension in ('.csv', '.txt'):
+            return cls._from_columns(_read_csv(path))
+        raise ValueError(f'unknown catalog format {extension!r}')
+
+    def save_npz(self, path: str):
+        """Save the catalog uncompressed, so that load can memory map it
+
+        Args:
+            path (str): file to write
+        """
+        np.savez(path, **self.to_arrays())
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Get the arrays save_npz writes
+        """
+        arrays = {'ingredient_names': self.ingredient_names,
+                  'nutrient_names': self.nutrient_names,
+                  'amounts': np.asarray(self.amounts, dtype=float),
+                  'costs': self.costs,
+                  'ingredient_codes': np.asarray(self.ingredient_codes),
+                  'nutrient_codes': np.asarray(self.nutrient_codes)}
+        if self.units is not None:
+            arrays['units'] = np.asarray(self.units, dtype=str)
+        return arrays
+
+    @classmethod
+    def _from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'Catalog':
+        def strings(name):
+            return arrays[name].tolist() if name in arrays else None
+        return cls(arrays['ingredient_names'], arrays['nutrient_names'],
+                   arrays['amounts'], costs=arrays.get('costs'),
+                   ingredient_codes=strings('ingredient_codes'),
+                   nutrient_codes=strings('nutrient_codes'),
+                   units=strings('units'))
+
+    @classmethod
+    def _from_columns(cls, columns: Dict[str, np.ndarray]) -> 'Catalog':
+        names = next((c for c in NAME_COLUMNS if c in columns), None)
+        if NUTRIENT_COLUMN in columns and AMOUNT_COLUMN in columns:
+            return cls._from_long(columns, names or NAME_COLUMNS[1])
+        if names is None:
+            raise ValueError(f'catalog has none of the columns {NAME_COLUMNS}')
+        nutrients = [c for c in columns
+                     if c not in (names, CODE_COLUMN, COST_COLUMN)]
+        amounts = np.column_stack([_floats(columns[n]) for n in nutrients]) \
+            if nutrients else np.zeros((len(columns[names]), 0))
+        return cls(columns[names], nutrients, amounts,
+                   costs=_floats(columns[COST_COLUMN])
+                   if COST_COLUMN in columns else None,
+                   ingredient_codes=[str(c) for c in columns[CODE_COLUMN]]
+                   if CODE_COLUMN in columns else None)
+
+    @classmethod
+    def _from_long(cls, columns: Dict[str, np.ndarray],
+                   names: str) -> 'Catalog':
+        ingredients, rows = _unique(np.asarray(columns[names], dtype=str))
+        nutrients, cols = _unique(
+            np.asarray(columns[NUTRIENT_COLUMN], dtype=str))
+        amounts = np.full((len(ingredients), len(nutrients)), np.nan)
+        amounts[rows, cols] = _floats(columns[AMOUNT_COLUMN])
+        costs = None
+        if COST_COLUMN in columns:
+            # the cost of the first line of each ingredient
+            costs = np.full(len(ingredients), np.nan)
+            costs[rows[::-1]] = _floats(columns[COST_COLUMN])[::-1]
+        return cls(ingredients, nutrients, amounts, costs=costs)
+
+
+def _index(codes: Sequence[str], names: Sequence[str]) -> Dict[str, int]:
+    """Index positions by name and by code, codes winning over names
+    """
+    index = {str(name): i for i, name in enumerate(names)}
+    index.update((code, i) for i, code in enumerate(codes))
+    return index
+
+
+def _unique(values: np.ndarray):
+    """Unique values in the order they first appear and the position of
+    each value in them
+    """
+    unique, first, inverse = np.unique(values, return_index=True,
+                                       return_inverse=True)
+    order = np.argsort(first)
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    return unique[order], position[inverse.ravel()]
+
+
+def _floats(values: Sequence[Any]) -> np.ndarray:
+    """Convert a column to floats, empty cells and None become nan
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'fiub':
+        return values.astype(float, copy=False)
+    values = np.where((values == '') | (values == None),  # noqa: E711
+                      'nan', values)
+    return values.astype(float)
+
+
+def _read_csv(path: str) -> Dict[str, np.ndarray]:
+    try:
+        import pyarrow.csv
+    except ImportError:
+        pass
+    else:
+        table = pyarrow.csv.read_csv(path)
+        return {name.strip():
+                table.column(name).to_numpy(zero_copy_only=False)
+                for name in table.column_names}
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = [row for row in reader if row]
+    table = np.array(rows, dtype=str).reshape(len(rows), len(header))
+    return {name.strip(): table[:, i] for i, name in enumerate(header)}
+
+
+def _read_parquet(path: str, mmap: bool) -> Dict[str, np.ndarray]:
+    import pyarrow.parquet
+    table = pyarrow.parquet.read_table(path, memory_map=mmap)
+    return {name: table.column(name).to_numpy()
+            for name in table.column_names}
+
+
+def _load_npz(path: str, mmap: bool) -> Dict[str, np.ndarray]:
+    """Load the arrays of an npz file, memory mapping the uncompressed
+    numeric ones
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            with archive.open(info) as member:
+                version = np.lib.format.read_magic(member)
+                if version == (1, 0):
+                    header = np.lib.format.read_array_header_1_0(member)
+                else:
+                    header = np.lib.format.read_array_header_2_0(member)
+                shape, fortran, dtype = header
+                if mmap and info.compress_type == zipfile.ZIP_STORED \
+                        and dtype.kind in 'fiub':
+                    arrays[name] = np.memmap(
+                        path, dtype=dtype, mode='r', shape=shape,
+                        order='F' if fortran else 'C',
+                        offset=_data_offset(path, info) + member.tell())
+                    continue
+            with archive.open(info) as member:
+                arrays[name] = np.lib.format.read_array(member,
+                                                        allow_pickle=False)
+    return arrays
+
+
+def _data_offset(path: str, info: zipfile.ZipInfo) -> int:
+    """Offset of the data of a zip member in the archive file
+    """
+    with open(path, 'rb') as file:
+        file.seek(info.header_offset)
+        header = struct.unpack('<4s5H3L2H', file.read(30))
+    # fixed header, then the file name and extra field lengths
+    return info.header_offset + 30 + header[9] + header[10]
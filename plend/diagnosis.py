@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+from typing import Any, List, Sequence, Tuple
+
+from .backends import LinearProgram, SolverBackend
+from .matrix import SparseMatrix
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+# (row or column, index, 'minimum' or 'maximum', limit) of an elastic slack
+Slack = Tuple[str, int, str, float]
+
+
+class BoundConflict:
+    def __init__(self, item_type: str, name: str, code: str, bound: str,
+                 limit: float, value: float):
+        """A bound that has to be moved to make a formula feasible
+
+        Args:
+            item_type (str): 'ingredient', 'nutrient' or 'formula' for the
+                batch total
+            name (str): name of the item or formula
+            code (str): code of the item or formula
+            bound (str): 'minimum', 'maximum' or 'batch_size'
+            limit (float): current value of the bound
+            value (float): value the bound has to be moved to
+        """
+        self.item_type = item_type
+        self.name = name
+        self.code = code
+        self.bound = bound
+        self.limit = limit
+        self.value = value
+
+    @property
+    def violation(self) -> float:
+        """How far the bound has to move
+        """
+        return abs(self.value - self.limit)
+
+    def __repr__(self) -> str:
+        return (f'BoundConflict({self.item_type} {self.name!r} {self.bound} '
+                f'{self.limit:g} -> {self.value:g})')
+
+
+class Diagnosis:
+    def __init__(self, status: str, conflicts: List[BoundConflict],
+                 penalty: float = None):
+        """Diagnosis of an infeasible formula
+
+        Args:
+            status (str): solver status of the elastic problem
+            conflicts (list[BoundConflict]): bounds to move, largest
+                relative violation first
+            penalty (float, optional): weighted sum of the violations.
+                Defaults to None.
+        """
+        self.status = status
+        self.conflicts = conflicts
+        self.penalty = penalty
+
+
+def elastic_program(program: LinearProgram, fixed_rows: Sequence[int] = ()
+                    ) -> Tuple[LinearProgram, List[Slack]]:
+    """Relax the bounds of a program with slack columns
+
+    Rows other than the fixed rows get a slack for each finite bound. Column
+    bounds become rows with a slack, except that a column keeps
+    min(lower, 0) as a hard lower bound so that ingredient amounts stay
+    physical. The objective is the sum of the slacks, each divided by
+    max(|bound|, 1) so that a bound is weighted by how far it moves relative
+    to its size.
+
+    Args:
+        program (LinearProgram): program to relax
+        fixed_rows (list[int], optional): rows to keep hard.
+            Defaults to ().
+
+    Returns:
+        (elastic program, slack of each added column)
+    """
+    num_cols, num_rows = program.num_cols, program.num_rows
+    lower = np.minimum(program.lower, 0)
+    slacks = []
+    rows = [program.matrix.rows]
+    cols = [program.matrix.indices]
+    data = [program.matrix.data]
+    row_lower = program.row_lower.tolist()
+    row_upper = program.row_upper.tolist()
+
+    def add_slack(kind, index, side, limit, row):
+        rows.append(np.array([row]))
+        cols.append(np.array([num_cols + len(slacks)]))
+        data.append(np.array([1.0 if side == 'minimum' else -1.0]))
+        slacks.append((kind, index, side, float(limit)))
+
+    for i in range(num_rows):
+        if i in fixed_rows:
+            continue
+        if np.isfinite(program.row_lower[i]):
+            add_slack('row', i, 'minimum', program.row_lower[i], i)
+        if np.isfinite(program.row_upper[i]):
+            add_slack('row', i, 'maximum', program.row_upper[i], i)
+    for j in range(num_cols):
+        for side, limit in (('minimum', program.lower[j]),
+                            ('maximum', program.upper[j])):
+            if not np.isfinite(limit) or \
+                    (side == 'minimum' and limit <= lower[j]):
+                continue
+            row = len(row_lower)
+            rows.append(np.array([row]))
+            cols.append(np.array([j]))
+            data.append(np.array([1.0]))
+            row_lower.append(limit if side == 'minimum' else -np.inf)
+            row_upper.append(limit if side == 'maximum' else np.inf)
+            add_slack('column', j, side, limit, row)
+
+    limits = np.array([limit for _, _, _, limit in slacks])
+    elastic = LinearProgram(
+        f'{program.name}_elastic',
+        costs=np.concatenate([np.zeros(num_cols),
+                              1 / np.maximum(np.abs(limits), 1)]),
+        lower=np.concatenate([lower, np.zeros(len(slacks))]),
+        upper=np.full(num_cols + len(slacks), np.inf),
+        matrix=SparseMatrix(np.concatenate(rows), np.concatenate(cols),
+                            np.concatenate(data),
+                            shape=(len(row_lower), num_cols + len(slacks))),
+        row_lower=row_lower,
+        row_upper=row_upper,
+        col_names=program.col_names + [f'slack{k}'
+                                       for k in range(len(slacks))],
+        row_names=program.row_names + [f'bound{k}' for k in
+                                       range(len(row_lower) - num_rows)])
+    return elastic, slacks
+
+
+def diagnose(program: LinearProgram, backend: SolverBackend,
+             rows: List[Any], cols: List[Any], fixed_rows: Sequence[int] = (),
+             tolerance: float = 1e-7) -> Diagnosis:
+    """Find the bounds of a program to move, and by how much, to make it
+    feasible, in one solve of its elastic program
+
+    Args:
+        program (LinearProgram): infeasible program
+        backend (SolverBackend): backend to solve with
+        rows (list): (item type, name, code, bound) of each program row,
+            bound is None to use the side of the slack
+        cols (list): (item type, name, code) of each program column
+        fixed_rows (list[int], optional): rows to keep hard.
+            Defaults to ().
+        tolerance (float, optional): smallest relative violation to report.
+            Defaults to 1e-7.
+
+    Returns:
+        Diagnosis
+    """
+    elastic, slacks = elastic_program(program, fixed_rows)
+    result = backend.solve(backend.build(elastic))
+    conflicts = []
+    if result.status == 'Optimal':
+        values = result.values[program.num_cols:]
+        weights = elastic.costs[program.num_cols:]
+        order = np.argsort(-values * weights, kind='stable')
+        for k in order.tolist():
+            if values[k] * weights[k] <= tolerance:
+                break
+            kind, index, side, limit = slacks[k]
+            if kind == 'row':
+                item_type, name, code, bound = rows[index]
+            else:
+                (item_type, name, code), bound = cols[index], None
+            moved = limit - values[k] if side == 'minimum' \
+                else limit + values[k]
+            conflicts.append(BoundConflict(item_type, name, code,
+                                           bound or side, limit,
+                                           float(moved)))
+    return Diagnosis(result.status, conflicts, result.objective)
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import csv
+import os
+from typing import IO, Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+# columns of a result row, one row per formula ingredient and nutrient
+RESULT_COLUMNS = ('library_name', 'formula_name', 'formula_code',
+                  'formula_cost', 'formula_status', 'item_type', 'item_name',
+                  'item_code', 'item_amount', 'item_minimum', 'item_maximum')
+NUMERIC_COLUMNS = ('formula_cost', 'item_amount', 'item_minimum',
+                   'item_maximum')
+
+
+def formula_rows(formula: Any, library_name: str = None) -> Iterator[Tuple]:
+    """Generate the result rows of a formula
+
+    Args:
+        formula (Formula): formula to get the rows of
+        library_name (str, optional): value of the library_name column.
+            Defaults to None.
+
+    Yields:
+        tuple of the RESULT_COLUMNS values of each ingredient then each
+        nutrient
+    """
+    head = (library_name, formula.name, formula.code, formula.cost,
+            formula.status)
+    for item in formula.items:
+        yield head + (item.item_type, item.name, item.code, item.amount,
+                      item.minimum, item.maximum)
+
+
+class ResultWriter:
+    """Base class of the writers of result rows
+
+    A writer is given formulas one at a time, for example as the on_result
+    callback of FormulaLibrary.optimize, and writes their rows out without
+    holding the rows of the formulas written before.
+    """
+
+    def __init__(self, library_name: str = None):
+        """Create a ResultWriter
+
+        Args:
+            library_name (str, optional): value of the library_name column.
+                Defaults to None.
+        """
+        self.library_name = library_name
+        self.rows = 0
+
+    def __enter__(self) -> 'ResultWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, formula: Any):
+        """Write the result rows of a formula
+
+        Args:
+            formula (Formula): formula to write
+        """
+        self.write_rows(formula_rows(formula, self.library_name))
+
+    def write_rows(self, rows: Iterable[Tuple]):
+        """Write result rows
+
+        Args:
+            rows (iterable[tuple]): rows in RESULT_COLUMNS order
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Flush and close the output
+        """
+
+
+class CsvResultWriter(ResultWriter):
+    def __init__(self, file: Union[str, IO[str]], library_name: str = None):
+        """Write result rows as CSV with a header of the RESULT_COLUMNS,
+        missing values are empty
+
+        Args:
+            file (str or file): path or text file to write to, a path is
+                opened (and closed on close), a file is left open
+            library_name (str, optional): value of the library_name column.
+                Defaults to None.
+        """
+        super().__init__(library_name)
+        self._owned = isinstance(file, (str, os.PathLike))
+        self.file = open(file, 'w', newline='') if self._owned else file
+        self._writer = csv.writer(self.file)
+        self._writer.writerow(RESULT_COLUMNS)
+
+    def write_rows(self, rows: Iterable[Tuple]):
+        for row in rows:
+            self._writer.writerow(row)
+            self.rows += 1
+
+    def close(self):
+        if self._owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class _ColumnWriter(ResultWriter):
+    """Writer buffering rows as columns and flushing them in batches
+    """
+
+    def __init__(self, library_name: str = None, batch_rows: int = 65536):
+        super().__init__(library_name)
+        self.batch_rows = batch_rows
+        self._buffer = []
+
+    def write_rows(self, rows: Iterable[Tuple]):
+        for row in rows:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_rows:
+                self.flush()
+
+    def flush(self):
+        """Write out the buffered rows
+        """
+        if self._buffer:
+            columns = dict(zip(RESULT_COLUMNS, zip(*self._buffer)))
+            self.rows += len(self._buffer)
+            self._buffer = []
+            self.write_columns(columns)
+
+    def write_columns(self, columns: Dict[str, Tuple]):
+        """Write a batch of columns
+
+        Args:
+            columns (dict): {column: values} of every RESULT_COLUMNS column
+        """
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class ArrowResultWriter(_ColumnWriter):
+    def __init__(self, path: str, library_name: str = None,
+                 batch_rows: int = 65536):
+        """Write result rows to a Parquet file, or an Arrow IPC file if
+        the path ends in .arrow or .feather, one row group or record batch
+        per batch of rows
+
+        Args:
+            path (str): file to write
+            library_name (str, optional): value of the library_name column.
+                Defaults to None.
+            batch_rows (int, optional): rows to buffer before writing them.
+                Defaults to 65536.
+        """
+        import pyarrow
+        super().__init__(library_name, batch_rows)
+        self.schema = pyarrow.schema(
+            [(c, pyarrow.float64() if c in NUMERIC_COLUMNS
+              else pyarrow.string()) for c in RESULT_COLUMNS])
+        if os.path.splitext(str(path))[1] in ('.arrow', '.feather'):
+            import pyarrow.ipc
+            self._writer = pyarrow.ipc.new_file(str(path), self.schema)
+        else:
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(str(path),
+                                                         self.schema)
+
+    def write_columns(self, columns: Dict[str, Tuple]):
+        import pyarrow
+        self._writer.write_table(
+            pyarrow.table(columns, schema=self.schema))
+
+    def close(self):
+        super().close()
+        self._writer.close()
+
+
+class RecordResultWriter(_ColumnWriter):
+    def __init__(self, library_name: str = None, batch_rows: int = 65536):
+        """Collect result rows into a NumPy record array, with object text
+        columns and float numeric columns where missing values are nan
+
+        Args:
+            library_name (str, optional): value of the library_name column.
+                Defaults to None.
+            batch_rows (int, optional): rows to buffer before converting
+                them. Defaults to 65536.
+        """
+        super().__init__(library_name, batch_rows)
+        self.dtype = np.dtype([(c, float if c in NUMERIC_COLUMNS else object)
+                               for c in RESULT_COLUMNS])
+        self._chunks = []
+
+    def write_columns(self, columns: Dict[str, Tuple]):
+        chunk = np.empty(len(columns[RESULT_COLUMNS[0]]), dtype=self.dtype)
+        for column, values in columns.items():
+            if column in NUMERIC_COLUMNS:
+                values = [np.nan if v is None else v for v in values]
+            chunk[column] = values
+        self._chunks.append(chunk)
+
+    def to_records(self) -> np.recarray:
+        """Get the rows written so far
+
+        Returns:
+            np.recarray
+        """
+        self.flush()
+        chunks: List[np.ndarray] = self._chunks or \
+            [np.empty(0, dtype=self.dtype)]
+        return np.concatenate(chunks).view(np.recarray)
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .backends import LinearProgram, SolverResult
+from .matrix import SparseMatrix
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class JointResult:
+    def __init__(self, status: str, cost: float, usage: Dict[Any, float],
+                 shadow_prices: Dict[Any, float]):
+        """Solution of a joint solve of several formulas
+
+        Args:
+            status (str): solver status of the joint problem
+            cost (float): total cost of producing every formula demand
+            usage (dict): {Ingredient: amount} used over all formulas
+            shadow_prices (dict): {Ingredient: change in total cost per
+                unit of extra inventory} of each limited ingredient, None
+                if the solver does not report duals
+        """
+        self.status = status
+        self.cost = cost
+        self.usage = usage
+        self.shadow_prices = shadow_prices
+
+
+def combine_programs(name: str, programs: Sequence[LinearProgram],
+                     scales: Sequence[float], prefixes: Sequence[str],
+                     limits: List[Tuple[str, List[Tuple[int, int]], float]]
+                     ) -> LinearProgram:
+    """Combine programs into one block diagonal program coupled by limits
+    on sums of their columns
+
+    Columns keep the units of their program, costs and limit coefficients
+    are multiplied by the scale of the program.
+
+    Args:
+        name (str): name of the combined program
+        programs (list[LinearProgram]): programs of the blocks
+        scales (list[float]): scale of each program
+        prefixes (list[str]): prefix of the column and row names of each
+            program, to keep them unique
+        limits (list): (row name, [(program, column)...], upper bound)
+            of each coupling row
+
+    Returns:
+        LinearProgram, with the rows of the programs first, in order,
+        followed by one row per limit
+    """
+    col_offsets = np.cumsum([0] + [p.num_cols for p in programs])
+    row_offsets = np.cumsum([0] + [p.num_rows for p in programs])
+    rows = [p.matrix.rows + offset
+            for p, offset in zip(programs, row_offsets)]
+    cols = [p.matrix.indices + offset
+            for p, offset in zip(programs, col_offsets)]
+    data = [p.matrix.data for p in programs]
+    for row, (_, entries, _) in enumerate(limits, row_offsets[-1]):
+        rows.append(np.full(len(entries), row))
+        cols.append(np.array([col_offsets[b] + j for b, j in entries],
+                             dtype=np.int64))
+        data.append(np.array([scales[b] for b, _ in entries], dtype=float))
+    num_rows = row_offsets[-1] + len(limits)
+    return LinearProgram(
+        name,
+        costs=np.concatenate([p.costs * scale
+                              for p, scale in zip(programs, scales)]),
+        lower=np.concatenate([p.lower for p in programs]),
+        upper=np.concatenate([p.upper for p in programs]),
+        matrix=SparseMatrix(np.concatenate(rows), np.concatenate(cols),
+                            np.concatenate(data),
+                            shape=(num_rows, col_offsets[-1])),
+        row_lower=np.concatenate([p.row_lower for p in programs]
+                                 + [np.full(len(limits), -np.inf)]),
+        row_upper=np.concatenate([p.row_upper for p in programs]
+                                 + [[upper for _, _, upper in limits]]),
+        col_names=[f'{prefix}_{n}' for p, prefix in zip(programs, prefixes)
+                   for n in p.col_names],
+        row_names=[f'{prefix}_{n}' for p, prefix in zip(programs, prefixes)
+                   for n in p.row_names] + [n for n, _, _ in limits],
+        integrality=np.concatenate([p._integrality for p in programs])
+        if any(p.is_mip for p in programs) else None)
+
+
+def split_result(result: SolverResult,
+                 programs: Sequence[LinearProgram]) -> List[SolverResult]:
+    """Split the result of a combined program into the values of each
+    program, without duals
+
+    Args:
+        result (SolverResult): result of solving the combined program
+        programs (list[LinearProgram]): programs it combined
+
+    Returns:
+        list[SolverResult]
+    """
+    offsets = np.cumsum([0] + [p.num_cols for p in programs])
+    return [SolverResult(result.status, result.values[start:end])
+            for start, end in zip(offsets[:-1], offsets[1:])]
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from typing import Any, Sequence, Tuple
+
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class SparseMatrix:
+    """Sparse matrix in compressed sparse row form
+    """
+
+    def __init__(self, rows: Sequence[int], cols: Sequence[int],
+                 data: Sequence[float], shape: Tuple[int, int]):
+        """Compile the matrix from coordinate entries, summing duplicates
+
+        Args:
+            rows (list): row index of each entry
+            cols (list): column index of each entry
+            data (list): value of each entry
+            shape (tuple): (number of rows, number of columns)
+        """
+        self.shape = tuple(shape)
+        # sort by row then column, summing duplicate entries
+        keys, inverse = np.unique(
+            np.asarray(rows, dtype=np.int64) * self.shape[1]
+            + np.asarray(cols, dtype=np.int64), return_inverse=True)
+        self.data = np.bincount(inverse.ravel(),
+                                weights=np.asarray(data, dtype=float),
+                                minlength=len(keys))
+        self.rows = keys // max(self.shape[1], 1)
+        self.indices = keys - self.rows * self.shape[1]
+        self.indptr = np.zeros(self.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.rows, minlength=self.shape[0]),
+                  out=self.indptr[1:])
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+    def row_entries(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the nonzero entries of a row
+
+        Args:
+            row (int): index of the row
+
+        Returns:
+            (column indices, values)
+        """
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def dot(self, amounts: Sequence[float]) -> np.ndarray:
+        """Multiply the matrix by a vector, or by a matrix with one row per
+        column of this matrix
+
+        Args:
+            amounts (list): value of each column, or (columns, k) values
+
+        Returns:
+            total of each row (np.ndarray), (rows, k) for a matrix
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        products = self.data.reshape((-1,) + (1,) * (amounts.ndim - 1)) \
+            * amounts[self.indices]
+        totals = np.zeros((self.shape[0],) + products.shape[1:])
+        # empty rows would end the previous row early, leave them at zero
+        filled = self.indptr[:-1] < self.indptr[1:]
+        if filled.any():
+            totals[filled] = np.add.reduceat(
+                products, self.indptr[:-1][filled], axis=0)
+        return totals
+
+    def toarray(self) -> np.ndarray:
+        """Get the matrix as a dense array
+        """
+        dense = np.zeros(self.shape)
+        dense[self.rows, self.indices] = self.data
+        return dense
+
+
+class NutrientMatrix(SparseMatrix):
+    """Sparse nutrient by ingredient matrix
+
+    Rows are nutrients keyed by nutrient code and columns are ingredients
+    in the order they were given.
+    """
+
+    def __init__(self, ingredients: Sequence[Any], nutrients: Sequence[Any],
+                 attribute: str = 'amount'):
+        """Compile the matrix from the ingredient nutrient lists
+
+        Args:
+            ingredients (list): ingredients (or formula ingredients) to use
+                as columns
+            nutrients (list): nutrients (or formula nutrients) to use as rows
+            attribute (str, optional): ingredient nutrient attribute to use
+                as entries, 'sd' for their standard deviations.
+                Defaults to 'amount'.
+        """
+        self.codes = [n.code for n in nutrients]
+        self.index = {code: row for row, code in enumerate(self.codes)}
+        rows, cols, data = [], [], []
+        for col, ingredient in enumerate(ingredients):
+            for nutrient in ingredient.nutrients:
+                row = self.index.get(nutrient.code)
+                value = getattr(nutrient, attribute)
+                if row is not None and value:
+                    rows.append(row)
+                    cols.append(col)
+                    data.append(value)
+        super().__init__(rows, cols, data,
+                         shape=(len(self.codes), len(ingredients)))
+
+    def row(self, code: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the nonzero entries of a nutrient row
+
+        Args:
+            code (str): code of the nutrient
+
+        Returns:
+            (column indices, amounts)
+        """
+        return self.row_entries(self.index[code])
@@ -1,10 +1,39 @@
-from typing import List, Dict, Any, Tuple
+from __future__ import annotations
+
+import copy
+import io
+import os
+from typing import (TYPE_CHECKING, List, Dict, Any, Callable, Iterator,
+                    Sequence, Tuple, Union)
 
-import pulp
 from . import utils
+from .analysis import Analysis, analyze_amounts
+from .backends import LinearProgram, SolverBackend, SolverResult, get_backend
+from .cache import SolutionCache
+from .catalog import Catalog
+from .diagnosis import Diagnosis, diagnose
+from .export import (ArrowResultWriter, CsvResultWriter, RecordResultWriter,
+                     ResultWriter, formula_rows)
+from .joint import JointResult, combine_programs, split_result
+from .matrix import NutrientMatrix, SparseMatrix
+from .parametric import CostCurve, parametric_bound, sweep_bound
+from .presolve import Presolved, presolve
+from .profiling import Hook, SolveProfile, replay, summarize_profiles
+from .scenarios import ScenarioResults, solve_scenarios
+from .sensitivity import compute_ranging
+from .snapshot import load_snapshot, save_snapshot
+from .stochastic import (Compliance, MarginSolution, margin_program,
+                         sample_totals)
+from .store import BoundRow, BoundTable, FormulaStore
+
+np = utils.lazy_import('numpy')
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
 
 
 class Item:
+    __slots__ = ('name', 'code')
     item_type = None
 
     def __init__(self, name: str, code: str = None):
@@ -19,6 +48,7 @@ class Item:
 
 
 class Nutrient(Item):
+    __slots__ = ('unit',)
     item_type = 'nutrient'
 
     def __init__(self, name: str, code: str = None, unit: str = None):
@@ -34,16 +64,40 @@ class Nutrient(Item):
 
 
 class IngredientNutrient:
-    def __init__(self, nutrient: Nutrient, amount: float = None):
+    __slots__ = ('nutrient', '_amount', 'ingredient', 'sd')
+
+    def __init__(self, nutrient: Nutrient, amount: float = None,
+                 ingredient: Any = None, sd: float = None):
         """Nutrient with amount for use in an ingredient
         One-to-one relationship with Ingredient
 
         Args:
             nutrient (Nutrient): nutrient to link
             amount (float, optional): amount of the nutrient. Defaults to None.
+            ingredient (Ingredient, optional): ingredient whose version to
+                bump when the amount changes. Defaults to None.
+            sd (float, optional): standard deviation of the amount between
+                lots of the ingredient, see Formula.compliance.
+                Defaults to None.
         """
         self.nutrient = nutrient
+        self.ingredient = ingredient
         self.amount = amount
+        self.sd = sd
+
+    @property
+    def amount(self) -> float:
+        return self._amount
+
+    @amount.setter
+    def amount(self, amount: float):
+        self._amount = amount
+        if self.ingredient is not None:
+            self.ingredient.version += 1
+
+    @property
+    def item(self) -> Nutrient:
+        return self.nutrient
 
     @property
     def name(self) -> str:
@@ -58,6 +112,7 @@ class IngredientNutrient:
 
 
 class Ingredient(Item):
+    __slots__ = ('_cost', 'nutrients', 'nutrient_index', 'version')
     item_type = 'ingredient'
 
     def __init__(self, name: str, code: str = None, cost: float = 0,
@@ -72,22 +127,58 @@ class Ingredient(Item):
             cost (float, optional): cost of the ingredient. Defaults to None.
             nutrients (dict, optional): formatted {[Nutrient]: amount}. 
                 Defaults to None.
+
+        version counts the changes to the cost and nutrient amounts, so that
+        formulas using the ingredient can tell they are out of date.
         """
+        self.version = 0
         self.name = name
         self.code = code or utils.clean_name(name)
         self.cost = cost
-        self.nutrients = []
+        self.nutrients = utils.ItemList()
+        self.nutrient_index = utils.ItemIndex()
         if nutrients is not None:
             self.add_nutrients(nutrients)
 
-    def add_nutrient(self, nutrient: Nutrient, amount: float):
-        """Add a single nutrient
+    @property
+    def cost(self) -> float:
+        return self._cost
+
+    @cost.setter
+    def cost(self, cost: float):
+        self._cost = cost
+        self.version += 1
+
+    def get_nutrient(self, nutrient: Any) -> IngredientNutrient:
+        """Get the linked nutrient of a nutrient
+
+        Args:
+            nutrient: Nutrient, FormulaNutrient or nutrient code
+
+        Returns:
+            IngredientNutrient, or None if the ingredient does not have it
+        """
+        return self.nutrient_index.find(self.nutrients, nutrient)
+
+    def add_nutrient(self, nutrient: Nutrient, amount: float,
+                     sd: float = None):
+        """Add a single nutrient, update the amount if it exists
 
         Args:
             nutrient (Nutrient): nutrient to link
             amount (float): amount of the nutrient in the ingredient
+            sd (float, optional): standard deviation of the amount between
+                lots. Defaults to None.
         """
-        self.nutrients.append(IngredientNutrient(nutrient, amount))
+        inut = self.get_nutrient(nutrient)
+        if inut:
+            inut.amount = amount
+            inut.sd = sd
+        else:
+            inut = IngredientNutrient(nutrient, amount, ingredient=self,
+                                      sd=sd)
+            self.nutrients.append(inut)
+            self.nutrient_index.add(self.nutrients, inut)
 
     def add_nutrients(self, nutrients: Dict[Nutrient, float]):
         """Add a dict of nutrients
@@ -99,15 +190,76 @@ class Ingredient(Item):
             self.add_nutrient(nutrient, amount)
 
 
+def _bound_value(column: str) -> property:
+    """Property of a bound item value that is kept in the store table the
+    item is bound to, if any
+    """
+    attribute = '_' + column
+
+    def get(self) -> float:
+        if self.table is None:
+            return getattr(self, attribute)
+        return self.table.get(column, self.cell)
+
+    def set(self, value: float):
+        if self.table is None:
+            setattr(self, attribute, value)
+        else:
+            self.table.set(column, self.cell, value)
+    return property(get, set)
+
+
 class BoundItem:
+    __slots__ = ('item', 'formula', 'table', 'cell', '_amount', '_minimum',
+                 '_maximum')
+
+    amount = _bound_value('amount')
+    minimum = _bound_value('minimum')
+    maximum = _bound_value('maximum')
+
     def __init__(self, item: Item, amount: float = None, minimum: float = 0,
                  maximum: float = None, formula: Any = None):
+        self.table = None
+        self.cell = None
         self.item = item
         self.amount = amount
         self.minimum = minimum
         self.maximum = maximum
         self.formula = formula
 
+    def bind(self, table: BoundRow, cell: int):
+        """Make the amount, minimum and maximum views of the store table
+        row holding them, dropping the values of the item
+
+        Args:
+            table (BoundRow): formula row keeping the values
+            cell (int): position of the item in the row
+        """
+        self.table, self.cell = table, cell
+        for field in BoundTable.fields:
+            delattr(self, '_' + field)
+
+    def unbind(self):
+        """Move the amount, minimum and maximum back out of the store table
+        """
+        values = [getattr(self, f) for f in BoundTable.fields]
+        self.table = self.cell = None
+        for field, value in zip(BoundTable.fields, values):
+            setattr(self, field, value)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # pickle the values of a bound item, not the whole store
+        state = {a: getattr(self, a, None) for cls in type(self).__mro__
+                 for a in getattr(cls, '__slots__', ())}
+        for field in BoundTable.fields:
+            state['_' + field] = getattr(self, field)
+        state['table'] = state['cell'] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
+
     @property
     def name(self) -> str:
         return self.item.name
@@ -125,12 +277,21 @@ class BoundItem:
 
 
 class FormulaNutrient(BoundItem):
+    __slots__ = ('shadow_price', 'minimum_range', 'maximum_range')
+    result_attributes = ('amount', 'shadow_price', 'minimum_range',
+                         'maximum_range')
+
     def __init__(self, nutrient: Nutrient, amount: float = None,
                  minimum: float = 0,  maximum: float = None,
                  formula: Any = None):
         """Nutrient with constraints and amount
         One-to-one relationship with Nutrient
 
+        After an optimal solve, shadow_price is the change in formula cost
+        per unit increase of the binding bound, and minimum_range and
+        maximum_range are the (low, high) values each bound can move within
+        before the shadow price changes.
+
         Args:
             nutrient (Nutrient): nutrient
             amount (float, optional): amount of the nutrient. Defaults to None.
@@ -139,11 +300,16 @@ class FormulaNutrient(BoundItem):
             maximum (float, optional): maximum amount to use in the formula.
                 Defaults to None.
         """
+        self.table = None
+        self.cell = None
         self.item = nutrient
         self.amount = amount
         self.minimum = minimum
         self.maximum = maximum
         self.formula = formula
+        self.shadow_price = None
+        self.minimum_range = None
+        self.maximum_range = None
 
     @property
     def nutrient(self) -> Nutrient:
@@ -151,12 +317,21 @@ class FormulaNutrient(BoundItem):
 
 
 class FormulaIngredient(BoundItem):
+    __slots__ = ('reduced_cost', 'cost_range', 'inclusion', 'increment')
+    result_attributes = ('amount', 'reduced_cost', 'cost_range')
+
     def __init__(self, ingredient: Ingredient, amount: float = None,
                  minimum: float = 0, maximum: float = None,
-                 formula: Any = None):
+                 formula: Any = None, inclusion: float = None,
+                 increment: float = None):
         """Ingredient with constraints and amount
         One-to-one relationship with Ingredient
 
+        After an optimal solve, reduced_cost is how far the ingredient cost
+        has to drop before using more of it pays off (negative when it is
+        held at its maximum), and cost_range is the (low, high) ingredient
+        cost within which the solution stays optimal.
+
         Args:
             ingredient (Ingredient): ingredient
             amount (float, optional): amount of the ingredient.
@@ -165,12 +340,24 @@ class FormulaIngredient(BoundItem):
                 Defaults to 0.
             maximum (float, optional): maximum amount to use in the formula.
                 Defaults to None.
+            inclusion (float, optional): minimum amount if the ingredient is
+                used at all, making the formula an integer program.
+                Defaults to None.
+            increment (float, optional): step the amount has to be a
+                multiple of, making the formula an integer program.
+                Defaults to None.
         """
+        self.table = None
+        self.cell = None
         self.item = ingredient
         self.amount = amount
         self.minimum = minimum
         self.maximum = maximum
         self.formula = formula
+        self.inclusion = inclusion
+        self.increment = increment
+        self.reduced_cost = None
+        self.cost_range = None
 
     @property
     def ingredient(self) -> Ingredient:
@@ -213,8 +400,7 @@ class FormulaIngredient(BoundItem):
             contribution (float)
         """
         if self.percent:
-            nut = next((n for n in self.nutrients if n.nutrient == nutrient),
-                       None)
+            nut = self.ingredient.get_nutrient(nutrient)
             if nut:
                 return self.percent * nut.amount
             else:
@@ -229,7 +415,8 @@ class FormulaIngredient(BoundItem):
 class Formula:
     def __init__(self, name: str, code: str = None, batch_size: float = 1,
                  unit: str = None, nutrients: Dict[Nutrient, tuple] = None,
-                 ingredients: Dict[Ingredient, tuple] = None):
+                 ingredients: Dict[Ingredient, tuple] = None,
+                 max_ingredients: int = None):
         """Create a Formula
 
         Args:
@@ -241,6 +428,8 @@ class Formula:
             unit (str): unused
             nutrients (dict): nutrients to add
             ingredients (dict): ingredients to add
+            max_ingredients (int, optional): most ingredients the formula
+                may use, making it an integer program. Defaults to None.
 
         TODO:
             Write tests for overlapping ingredients/nutrients
@@ -249,24 +438,112 @@ class Formula:
         self.code = code or utils.clean_name(name)
         self.batch_size = batch_size
         self.unit = unit
+        self.max_ingredients = max_ingredients
         self.cost = 0
-        self.nutrients = []
-        self.ingredients = []
+        self.nutrients = utils.ItemList()
+        self.ingredients = utils.ItemList()
+        self.nutrient_index = utils.ItemIndex()
+        self.ingredient_index = utils.ItemIndex()
         if nutrients is not None:
             self.add_nutrients(nutrients)
         if ingredients is not None:
             self.add_ingredients(ingredients)
         self.variables = {}
+        self.matrix = None
+        self.program = None
+        self.presolved = None
         self.problem = None
         self.status = 'Unsolved'
+        self.solved_signature = None
+        self.error = None
+        self.profile = SolveProfile()
+        self.diagnosis = None
         self.solver = FormulaSolver(self)
 
+    result_attributes = ('status', 'cost', 'profile', 'diagnosis')
+
+    def get_results(self) -> Tuple:
+        """Get the solution of the formula as plain values
+
+        Returns:
+            (formula values, ingredient values, nutrient values) of the
+            result_attributes of the formula and its items
+        """
+        return ([getattr(self, a) for a in self.result_attributes],
+                [[getattr(i, a) for a in i.result_attributes]
+                 for i in self.ingredients],
+                [[getattr(n, a) for a in n.result_attributes]
+                 for n in self.nutrients])
+
+    def set_results(self, results: Tuple):
+        """Set the solution of the formula from get_results
+
+        Args:
+            results (tuple): results of an identical formula
+        """
+        values, ingredients, nutrients = results
+        for attribute, value in zip(self.result_attributes, values):
+            setattr(self, attribute, value)
+        for item, values in zip(self.items, ingredients + nutrients):
+            for attribute, value in zip(item.result_attributes, values):
+                setattr(item, attribute, value)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the solver problem is rebuilt on the next solve, don't pickle it
+        state = self.__dict__.copy()
+        state['variables'] = {}
+        state['matrix'] = None
+        state['program'] = None
+        state['presolved'] = None
+        state['problem'] = None
+        # the signature holds object ids that don't survive pickling
+        state['solved_signature'] = None
+        return state
+
     @property
     def items(self) -> List[BoundItem]:
         return self.ingredients + self.nutrients
 
+    def get_ingredient(self, ingredient: Any) -> FormulaIngredient:
+        """Get the formula ingredient of an ingredient
+
+        Args:
+            ingredient: Ingredient or ingredient code
+
+        Returns:
+            FormulaIngredient, or None if the formula does not have it
+        """
+        return self.ingredient_index.find(self.ingredients, ingredient)
+
+    def get_nutrient(self, nutrient: Any) -> FormulaNutrient:
+        """Get the formula nutrient of a nutrient
+
+        Args:
+            nutrient: Nutrient or nutrient code
+
+        Returns:
+            FormulaNutrient, or None if the formula does not have it
+        """
+        return self.nutrient_index.find(self.nutrients, nutrient)
+
+    def get_contributions(self) -> np.ndarray:
+        """Get the nutrient contribution of every ingredient to the formula
+
+        Returns:
+            (ingredients, nutrients) contributions in the order of
+            self.ingredients and self.nutrients, 0 where an ingredient has
+            no amount or does not have the nutrient
+        """
+        matrix = NutrientMatrix(self.ingredients, self.nutrients)
+        percents = np.array([i.percent or 0.0 for i in self.ingredients])
+        contributions = np.zeros((len(self.ingredients), len(self.nutrients)))
+        contributions[matrix.indices, matrix.rows] = \
+            matrix.data * percents[matrix.indices]
+        return contributions
+
     def add_ingredient(self, ingredient: Ingredient, amount: float = None,
-                       minimum: float = 0, maximum: float = None):
+                       minimum: float = 0, maximum: float = None,
+                       inclusion: float = None, increment: float = None):
         """Add an ingredient with bounds to the formula, update if it exists
 
         Args:
@@ -277,20 +554,27 @@ class Formula:
                 Defaults to 0.
             maximum (float, optional): maximum amount to use in the formula.
                 Defaults to None.
+            inclusion (float, optional): minimum amount if the ingredient is
+                used at all. Defaults to None.
+            increment (float, optional): step the amount has to be a
+                multiple of. Defaults to None.
         """
-        bi = next((i for i in self.ingredients if i.ingredient == ingredient),
-                  None)
+        bi = self.get_ingredient(ingredient)
         # update the nutrient if it already exists
         if bi:
             bi.amount = amount
             bi.minimum = minimum
             bi.maximum = maximum
             bi.formula = self
+            bi.inclusion = inclusion
+            bi.increment = increment
         # add a new nutrient if it does not exist
         else:
-            self.ingredients.append(FormulaIngredient(
-                ingredient, amount, minimum, maximum or self.batch_size,
-                formula=self))
+            bi = FormulaIngredient(ingredient, amount, minimum,
+                                   maximum or self.batch_size, formula=self,
+                                   inclusion=inclusion, increment=increment)
+            self.ingredients.append(bi)
+            self.ingredient_index.add(self.ingredients, bi)
 
     def add_ingredients(self, ingredient_dict: Dict[Ingredient, Tuple]):
         """Add a dict of ingredients
@@ -315,7 +599,7 @@ class Formula:
                 Defaults to None.
         """
         # check if the nutrient exists for updating
-        bn = next((n for n in self.nutrients if n.nutrient == nutrient), None)
+        bn = self.get_nutrient(nutrient)
         # update the nutrient if it already exists
         if bn:
             bn.amount = amount
@@ -324,8 +608,10 @@ class Formula:
             bn.formula = self
         # add a new nutrient if it does not exist
         else:
-            self.nutrients.append(FormulaNutrient(
-                nutrient, amount, minimum, maximum, formula=self))
+            bn = FormulaNutrient(nutrient, amount, minimum, maximum,
+                                 formula=self)
+            self.nutrients.append(bn)
+            self.nutrient_index.add(self.nutrients, bn)
 
     def add_nutrients(self, nutrient_dict: Dict[Nutrient, Tuple]):
         """Add a dict of nutrient
@@ -350,58 +636,369 @@ class Formula:
             self.add_nutrient(nutrient=nut.nutrient, amount=nut.amount,
                               minimum=nut.minimum, maximum=nut.maximum)
 
+    def signature(self) -> Tuple:
+        """Get a snapshot of what the formula solution depends on
+
+        The snapshot holds the batch size, the bounds of the formula items
+        and the version of each ingredient, so it changes with any formula
+        bound, ingredient cost or ingredient nutrient amount.
+        """
+        return (self.batch_size, self.max_ingredients,
+                tuple((id(i.item), i.item.version, i.minimum, i.maximum,
+                       i.inclusion, i.increment) for i in self.ingredients),
+                tuple((n.code, n.minimum, n.maximum) for n in self.nutrients))
+
+    @property
+    def dirty(self) -> bool:
+        """True if the formula was never solved, failed or changed since it
+        was last optimized
+        """
+        return self.status in ('Unsolved', 'Error') or \
+            self.solved_signature != self.signature()
+
     def optimize(self):
         """Optimize the formula by creating and solving the formula problem
         """
         self.solver.optimize()
 
+    async def optimize_async(self, timeout: float = None,
+                             executor: Executor = None):
+        """Optimize the formula without blocking the event loop,
+        see FormulaSolver.optimize_async
+        """
+        await self.solver.optimize_async(self, timeout, executor)
+
+    def solve_scenarios(self, prices: Sequence[Sequence[float]],
+                        workers: int = None) -> ScenarioResults:
+        """Solve the formula under a batch of ingredient price scenarios
+        without changing it
+
+        Args:
+            prices (list): (scenarios, ingredients) ingredient costs in the
+                order of self.ingredients
+            workers (int, optional): number of worker processes to spread
+                the scenarios over. Defaults to None.
+
+        Returns:
+            ScenarioResults
+        """
+        return self.solver.solve_scenarios(prices, self, workers=workers)
+
+    def sweep(self, nutrient: Any, values: Sequence[float],
+              bound: str = 'minimum', exact: bool = False) -> CostCurve:
+        """Solve the formula at a range of values of a nutrient bound
+        without changing it, see FormulaSolver.sweep
+
+        Args:
+            nutrient: FormulaNutrient, Nutrient or code of the nutrient
+            values (list[float]): values of the bound to solve at, or with
+                exact the lowest and highest value to sweep
+            bound (str, optional): 'minimum' or 'maximum'.
+                Defaults to 'minimum'.
+            exact (bool, optional): solve at every breakpoint of the cost
+                instead of at the values. Defaults to False.
+
+        Returns:
+            CostCurve
+        """
+        return self.solver.sweep(nutrient, values, bound, exact, self)
+
+    def analyze(self, amounts: Sequence[Sequence[float]] = None
+                ) -> Analysis:
+        """Get the nutrient levels, cost and bound violations of mixes of
+        the formula ingredients without solving, see FormulaSolver.analyze
+        """
+        return self.solver.analyze(amounts, self)
+
+    def compliance(self, samples: int = 10000,
+                   seed: int = None) -> Compliance:
+        """Check the current solution against sampled nutrient amounts,
+        see FormulaSolver.compliance
+        """
+        return self.solver.compliance(samples, seed, self)
+
+    def optimize_margin(self, probability: float = 0.95,
+                        samples: int = 10000,
+                        seed: int = None) -> MarginSolution:
+        """Solve the formula so each nutrient bound holds with a probability
+        without changing it, see FormulaSolver.optimize_margin
+        """
+        return self.solver.optimize_margin(probability, samples, seed, self)
+
 
 class FormulaSolver:
-    def __init__(self, formula: Formula = None):
+    def __init__(self, formula: Formula = None,
+                 backend: Union[str, SolverBackend] = 'pulp',
+                 sensitivity: bool = True, cache: SolutionCache = None,
+                 diagnose: bool = False, presolve: bool = False,
+                 warm_start: bool = False):
+        """Create a FormulaSolver
+
+        Args:
+            formula (Formula, optional): default formula to solve.
+                Defaults to None.
+            backend (str or SolverBackend, optional): solver backend,
+                'pulp' writes the problem for PuLP's solver command and
+                'highs' solves in process with highspy. Defaults to 'pulp'.
+            sensitivity (bool, optional): read shadow prices, reduced costs
+                and ranging after each optimal solve. Defaults to True.
+            cache (SolutionCache, optional): cache of solver results that
+                optimize checks before solving, keyed by the program and
+                the backend settings. Defaults to None.
+            diagnose (bool, optional): diagnose infeasible formulas with
+                one extra solve, see diagnose_infeasible. Defaults to False.
+            presolve (bool, optional): reduce the program before building
+                the problem, dropping fixed and dominated ingredients and
+                redundant nutrient rows, see presolve.presolve. The
+                reductions are in formula.presolved. Defaults to False.
+            warm_start (bool, optional): start the solve of an integer
+                formula from its last ingredient amounts, like those of
+                an optimize without the integer constraints, see
+                mip_start. Defaults to False.
+        """
         self.formula = formula
+        self.backend = backend
+        self.sensitivity = sensitivity
+        self.cache = cache
+        self.diagnose = diagnose
+        self.presolve = presolve
+        self.warm_start = warm_start
+        self.hooks = []
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # hooks are often closures that can't be pickled, the library calls
+        # them for the profiles that come back from workers instead
+        state = self.__dict__.copy()
+        state['hooks'] = []
+        return state
+
+    @property
+    def backend(self) -> SolverBackend:
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend: Union[str, SolverBackend]):
+        self._backend = get_backend(backend)
+
+    def add_hook(self, hook: Hook):
+        """Add a callable to call with (formula, phase, seconds) after each
+        phase the solver times into formula.profile
+
+        Args:
+            hook (callable): hook to add
+        """
+        self.hooks.append(hook)
+
+    def _phase(self, formula: Formula, name: str):
+        return formula.profile.phase(name, formula, self.hooks)
+
+    def _start_profile(self, formula: Formula) -> SolveProfile:
+        formula.profile = SolveProfile()
+        formula.profile.backend = self.backend.name
+        return formula.profile
+
+    def create_program(self, formula: Formula = None,
+                       matrix: NutrientMatrix = None,
+                       integer: bool = True) -> LinearProgram:
+        """Create the LinearProgram of a formula
+
+        Columns are the formula ingredients, the first row is the batch
+        total and the remaining rows are the bounded nutrients.
+
+        Ingredients with an inclusion, and every ingredient when the
+        formula has max_ingredients, get a binary use column after the
+        ingredient columns, and ingredients with an increment an integer
+        column of steps after those, see integer_columns. Their rows come
+        after the nutrient rows.
+
+        Args:
+            formula (Formula, optional): formula to use.
+                Defaults to the solver formula.
+            matrix (NutrientMatrix, optional): nutrient matrix of the formula.
+                Defaults to a newly compiled one.
+            integer (bool, optional): add the integer columns and rows, or
+                leave them out for the linear relaxation.
+                Defaults to True.
+
+        Returns:
+            LinearProgram
+        """
+        if formula is None:
+            formula = self.formula
+        if matrix is None:
+            matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+        num_cols = len(formula.ingredients)
+        # total function (uses ingredient bounds from the columns)
+        rows = [np.zeros(num_cols, dtype=np.int64)]
+        cols = [np.arange(num_cols)]
+        data = [np.ones(num_cols)]
+        row_names = ['total']
+        row_lower = [formula.batch_size]
+        row_upper = [formula.batch_size]
+        # nutrient bounds from the compiled nutrient matrix
+        for nutrient in self.bounded_nutrients(formula):
+            indices, amounts = matrix.row(nutrient.code)
+            rows.append(np.full(len(indices), len(row_names)))
+            cols.append(indices)
+            data.append(amounts / formula.batch_size)
+            row_names.append(nutrient.name)
+            row_lower.append(nutrient.minimum or -np.inf)
+            row_upper.append(nutrient.maximum or np.inf)
+        costs = [i.cost or 0 for i in formula.ingredients]
+        lower = [-np.inf if i.minimum is None else i.minimum
+                 for i in formula.ingredients]
+        upper = [np.inf if i.maximum is None else i.maximum
+                 for i in formula.ingredients]
+        col_names = [i.name for i in formula.ingredients]
+        integrality = None
+        used, stepped = self.integer_columns(formula) if integer else ([], [])
+        if used or stepped:
+            integrality = [0] * num_cols
+
+        def add_row(name, entries, lower_bound, upper_bound):
+            rows.append(np.full(len(entries), len(row_names)))
+            cols.append(np.array([j for j, _ in entries], dtype=np.int64))
+            data.append(np.array([v for _, v in entries], dtype=float))
+            row_names.append(name)
+            row_lower.append(lower_bound)
+            row_upper.append(upper_bound)
+
+        def add_column(name, column_upper):
+            costs.append(0)
+            lower.append(0)
+            upper.append(column_upper)
+            col_names.append(name)
+            integrality.append(1)
+            return len(col_names) - 1
+
+        # binary use columns, an unused ingredient is held at 0 and a used
+        # one at least at its inclusion
+        for j in used:
+            ingredient = formula.ingredients[j]
+            use = add_column(f'use_{ingredient.name}', 1)
+            most = min(upper[j], formula.batch_size)
+            add_row(f'use_max_{ingredient.name}', [(j, 1), (use, -most)],
+                    -np.inf, 0)
+            if ingredient.inclusion:
+                add_row(f'use_min_{ingredient.name}',
+                        [(j, 1), (use, -ingredient.inclusion)], 0, np.inf)
+        if formula.max_ingredients is not None and used:
+            add_row('ingredient_count',
+                    [(j, 1) for j in range(num_cols, num_cols + len(used))],
+                    -np.inf, formula.max_ingredients)
+        # integer step columns, the amount is a whole number of steps
+        for j in stepped:
+            ingredient = formula.ingredients[j]
+            steps = add_column(
+                f'steps_{ingredient.name}',
+                np.floor(min(upper[j], formula.batch_size)
+                         / ingredient.increment + 1e-9))
+            add_row(f'steps_{ingredient.name}',
+                    [(j, 1), (steps, -ingredient.increment)], 0, 0)
+        return LinearProgram(
+            formula.name,
+            costs=costs,
+            lower=lower,
+            upper=upper,
+            matrix=SparseMatrix(np.concatenate(rows), np.concatenate(cols),
+                                np.concatenate(data),
+                                shape=(len(row_names), len(col_names))),
+            row_lower=row_lower,
+            row_upper=row_upper,
+            col_names=col_names,
+            row_names=row_names,
+            integrality=integrality)
+
+    @staticmethod
+    def integer_columns(formula: Formula) -> Tuple[List[int], List[int]]:
+        """Get the formula ingredients that have integer columns in the
+        problem
+
+        Returns:
+            (ingredients with a binary use column, ingredients with an
+            integer step column), as positions in formula.ingredients in
+            the order of their columns
+        """
+        every = formula.max_ingredients is not None
+        used = [j for j, i in enumerate(formula.ingredients)
+                if every or i.inclusion]
+        stepped = [j for j, i in enumerate(formula.ingredients)
+                   if i.increment]
+        return used, stepped
+
+    def mip_start(self, formula: Formula = None) -> List[float]:
+        """Get a starting solution of the integer program of a formula from
+        its ingredient amounts
+
+        Use columns are 1 for the ingredients in use and step columns the
+        amount rounded to whole steps. The solver drops a start that turns
+        out infeasible.
+
+        Args:
+            formula (Formula, optional): formula to start.
+                Defaults to the solver formula.
+
+        Returns:
+            value of each column, or None if an amount is missing
+        """
+        if formula is None:
+            formula = self.formula
+        amounts = [i.amount for i in formula.ingredients]
+        if None in amounts:
+            return None
+        used, stepped = self.integer_columns(formula)
+        return (amounts
+                + [1.0 if amounts[j] > 1e-9 else 0.0 for j in used]
+                + [float(round(amounts[j] / formula.ingredients[j].increment))
+                   for j in stepped])
+
+    @staticmethod
+    def bounded_nutrients(formula: Formula) -> List[FormulaNutrient]:
+        """Get the formula nutrients that have a row in the problem,
+        in row order after the total row
+        """
+        return [n for n in formula.nutrients if n.minimum or n.maximum]
 
     def create_problem(self, formula: Formula = None):
-        """Create the PuLP problem to be solved
+        """Create the solver problem to be solved
         """
         if formula is None:
             formula = self.formula
-        # create problem variables with bounds associated to ingredients
-        variables = {i: pulp.LpVariable(name=i.name,
-                                        lowBound=i.minimum,
-                                        upBound=i.maximum)
-                     for i in formula.ingredients}
-
-        prob = pulp.LpProblem(formula.name, pulp.LpMinimize)
-
-        # minimize cost objective function
-        prob += pulp.lpSum([variables[i] * i.cost
-                            for i in formula.ingredients
-                            if i.cost])
-        # total function (uses ingredient bounds from variables)
-        prob += pulp.lpSum([variables[i]
-                            for i in formula.ingredients]) \
-            == formula.batch_size, 'total'
-
-        # nutrient bounds
-        for nutrient in formula.nutrients:
-            # minimum
-            if nutrient.minimum:
-                minimum = pulp.lpSum([n.amount * variables[i]
-                                      for i in formula.ingredients
-                                      for n in i.nutrients
-                                      if n.name == nutrient.name])
-                prob += minimum / formula.batch_size \
-                    >= nutrient.minimum, f'min_{nutrient.name}'
-            # maximum
-            if nutrient.maximum:
-                maximum = pulp.lpSum([n.amount * variables[i]
-                                      for i in formula.ingredients
-                                      for n in i.nutrients
-                                      if n.name == nutrient.name])
-                prob += maximum / formula.batch_size \
-                    <= nutrient.maximum, f'max_{nutrient.name}'
-        formula.variables = variables
-        formula.problem = prob
+        with self._phase(formula, 'program'):
+            matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+            program = self.create_program(formula, matrix)
+        formula.profile.count(program)
+        with self._phase(formula, 'build'):
+            self._build_problem(formula, matrix, program)
+
+    def _build_problem(self, formula: Formula, matrix: NutrientMatrix,
+                       program: LinearProgram):
+        presolved = self._presolve(formula, program)
+        problem = self.backend.build(
+            program if presolved is None else presolved.program)
+        formula.matrix = matrix
+        formula.program = program
+        formula.presolved = presolved
+        formula.problem = problem
+        ingredients = formula.ingredients if presolved is None else \
+            [formula.ingredients[j] for j in presolved.columns.tolist()]
+        formula.variables = dict(zip(ingredients,
+                                     self.backend.variables(problem)))
+
+    def _presolve(self, formula: Formula,
+                  program: LinearProgram) -> Presolved:
+        # fixing and dominance don't hold for integer columns
+        if not self.presolve or program.is_mip:
+            return None
+        presolved = presolve(program)
+        formula.profile.count(presolved.program)
+        return presolved
+
+    def _solve(self, formula: Formula) -> SolverResult:
+        result = self.backend.solve(formula.problem)
+        if formula.presolved is not None:
+            result = formula.presolved.restore(result)
+        return result
 
     def solve_problem(self, formula: Formula = None):
         """Solve the problem
@@ -410,30 +1007,539 @@ class FormulaSolver:
             formula = self.formula
         if formula.problem is None:
             self.create_problem(formula)
-        formula.problem.solve()
-        formula.status = pulp.LpStatus[formula.problem.status]
+        with self._phase(formula, 'solve'):
+            result = self._solve(formula)
+        self.read_result(formula, result)
+
+    def read_result(self, formula: Formula, result: SolverResult):
+        """Set the formula status and amounts from a solver result
+
+        Args:
+            formula (Formula): formula that was solved
+            result (SolverResult): result of solving the formula problem
+        """
+        formula.status = result.status
+        formula.profile.status = result.status
+        formula.profile.iterations = result.iterations
+        formula.profile.mip_gap = result.mip_gap
+
+        with self._phase(formula, 'readback'):
+            # set ingredient amounts from problem output
+            formula.cost = 0
+            for ingredient, value in zip(formula.ingredients,
+                                         result.values.tolist()):
+                if np.isnan(value):
+                    # no solution, like an infeasible HiGHS solve
+                    ingredient.amount = None
+                    continue
+                ingredient.amount = value
+                formula.cost += ingredient.cost * \
+                    (ingredient.amount / formula.batch_size)
+
+            # set nutrient amounts from problem output
+            totals = formula.matrix.dot(result.values) / formula.batch_size
+            for nutrient, total in zip(formula.nutrients, totals.tolist()):
+                nutrient.amount = total
+
+        with self._phase(formula, 'sensitivity'):
+            self.read_sensitivity(formula, result)
+
+        formula.diagnosis = None
+        if self.diagnose and result.status == 'Infeasible':
+            with self._phase(formula, 'diagnosis'):
+                formula.diagnosis = self.diagnose_infeasible(formula)
+
+    def diagnose_infeasible(self, formula: Formula = None) -> Diagnosis:
+        """Find the formula bounds that conflict, and how far each has to
+        move to make the formula feasible
+
+        Every nutrient and ingredient bound is made elastic and the sum of
+        how far they move, relative to their size, is minimized in one
+        solve. The batch total stays fixed, as nutrient amounts are
+        fractions of it, and ingredient amounts stay at least 0.
 
-        # set ingredient amounts from problem output
-        for ingredient, variable in formula.variables.items():
-            ingredient.amount = variable.varValue
-            formula.cost += ingredient.cost * \
-                (ingredient.amount / formula.batch_size)
+        Args:
+            formula (Formula, optional): formula to diagnose.
+                Defaults to the solver formula.
 
-        # set nutrient amounts from problem output
+        Returns:
+            Diagnosis, with a BoundConflict for each bound to move
+        """
+        if formula is None:
+            formula = self.formula
+        program = formula.program
+        if program is None or program.is_mip:
+            # only the bounds of the linear relaxation are made elastic
+            program = self.create_program(formula, integer=False)
+        rows = [('formula', formula.name, formula.code, 'batch_size')]
+        rows += [(n.item_type, n.name, n.code, None)
+                 for n in self.bounded_nutrients(formula)]
+        cols = [(i.item_type, i.name, i.code) for i in formula.ingredients]
+        return diagnose(program, self.backend, rows, cols, fixed_rows=(0,))
+
+    def read_sensitivity(self, formula: Formula, result: SolverResult):
+        """Set the shadow prices, reduced costs and ranging of the formula
+        items from an optimal solver result
+
+        Args:
+            formula (Formula): formula that was solved
+            result (SolverResult): result of solving the formula problem
+        """
+        for ingredient in formula.ingredients:
+            ingredient.reduced_cost = ingredient.cost_range = None
         for nutrient in formula.nutrients:
-            nutrient.amount = sum([i.amount * n.amount
-                                   for i in formula.ingredients
-                                   for n in i.nutrients
-                                   if n.name == nutrient.name]) \
-                / formula.batch_size
+            nutrient.shadow_price = None
+            nutrient.minimum_range = nutrient.maximum_range = None
+        # the duals of an integer program are those of its last node
+        if not self.sensitivity or result.status != 'Optimal' \
+                or result.row_duals is None or formula.program.is_mip:
+            return
+        ranging = compute_ranging(formula.program, result.values,
+                                  result.row_duals)
+        for j, ingredient in enumerate(formula.ingredients):
+            if result.reduced_costs is not None:
+                ingredient.reduced_cost = float(result.reduced_costs[j])
+            if ranging is not None:
+                ingredient.cost_range = (float(ranging.cost_lower[j]),
+                                         float(ranging.cost_upper[j]))
+        for row, nutrient in enumerate(self.bounded_nutrients(formula), 1):
+            nutrient.shadow_price = \
+                float(result.row_duals[row]) / formula.batch_size
+            if ranging is None:
+                continue
+            if np.isfinite(formula.program.row_lower[row]):
+                nutrient.minimum_range = \
+                    tuple(ranging.row_lower_range[row].tolist())
+            if np.isfinite(formula.program.row_upper[row]):
+                nutrient.maximum_range = \
+                    tuple(ranging.row_upper_range[row].tolist())
+
+    def update_problem(self, formula: Formula = None) -> bool:
+        """Patch the built problem with the current costs and bounds
+
+        Args:
+            formula (Formula, optional): formula to update.
+                Defaults to the solver formula.
+
+        Returns:
+            False if there is no problem to patch or the ingredients,
+            nutrients or nutrient matrix changed and it has to be rebuilt
+        """
+        if formula is None:
+            formula = self.formula
+        if formula.problem is None or formula.program is None:
+            return False
+        matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+        return self._patch_problem(formula, matrix,
+                                   self.create_program(formula, matrix))
+
+    def _patch_problem(self, formula: Formula, matrix: NutrientMatrix,
+                       program: LinearProgram) -> bool:
+        if formula.problem is None or formula.program is None or \
+                not formula.program.same_structure(program):
+            return False
+        presolved = self._presolve(formula, program)
+        if presolved is None and formula.presolved is None:
+            patched = self.backend.update(formula.problem, formula.program,
+                                          program)
+        else:
+            # the presolved problems have to keep the same columns and rows
+            patched = presolved is not None and \
+                formula.presolved is not None and \
+                formula.presolved.same_reductions(presolved) and \
+                self.backend.update(formula.problem,
+                                    formula.presolved.program,
+                                    presolved.program)
+        if not patched:
+            return False
+        formula.matrix = matrix
+        formula.program = program
+        formula.presolved = presolved
+        return True
+
+    def restore_cached(self, formula: Formula = None) -> bool:
+        """Restore the solution of the formula from the solver cache
+        without solving
+
+        Args:
+            formula (Formula, optional): formula to restore.
+                Defaults to the solver formula.
+
+        Returns:
+            False if there is no cache or it has no solution for the formula
+        """
+        if formula is None:
+            formula = self.formula
+        if self.cache is None:
+            return False
+        profile = self._start_profile(formula)
+        with self._phase(formula, 'program'):
+            matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+            program = self.create_program(formula, matrix)
+        profile.count(program)
+        with self._phase(formula, 'cache'):
+            result = self.cache.get(program.digest(self.backend.settings()))
+        if result is None:
+            return False
+        profile.cached = True
+        signature = formula.signature()
+        self._restore(formula, matrix, program, result)
+        formula.solved_signature = signature
+        return True
+
+    def _restore(self, formula: Formula, matrix: NutrientMatrix,
+                 program: LinearProgram, result: SolverResult):
+        # keep a built problem in step with the program or drop it,
+        # the next solve builds it again
+        if not self._patch_problem(formula, matrix, program):
+            formula.matrix = matrix
+            formula.program = program
+            formula.presolved = None
+            formula.problem = None
+            formula.variables = {}
+        self.read_result(formula, result)
+
+    def solve_scenarios(self, prices: Sequence[Sequence[float]],
+                        formula: Formula = None, workers: int = None,
+                        executor: Executor = None) -> ScenarioResults:
+        """Solve the formula under a batch of ingredient price scenarios
+
+        The formula itself is left untouched. One problem is built and
+        re-priced for each scenario, with workers or an executor the
+        scenarios are split into one contiguous chunk per worker.
+
+        Args:
+            prices (list): (scenarios, ingredients) ingredient costs in the
+                order of formula.ingredients
+            formula (Formula, optional): formula to solve.
+                Defaults to the solver formula.
+            workers (int, optional): number of worker processes to solve in.
+                Defaults to None.
+            executor (Executor, optional): executor to submit the chunks to
+                instead of a new process pool. Defaults to None.
+
+        Returns:
+            ScenarioResults
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        if formula is None:
+            formula = self.formula
+        prices = np.atleast_2d(np.asarray(prices, dtype=float))
+        if prices.shape[1] != len(formula.ingredients):
+            raise ValueError(f'expected {len(formula.ingredients)} prices '
+                             f'per scenario, got {prices.shape[1]}')
+        matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+        program = self.create_program(formula, matrix)
+        # the integer columns of the program cost nothing
+        costs = np.pad(prices, ((0, 0), (0, program.num_cols
+                                         - prices.shape[1])))
+        if workers is None and executor is None:
+            results = [solve_scenarios(self.backend, program, costs)]
+        else:
+            chunks = [c for c in np.array_split(
+                costs, workers or os.cpu_count() or 1) if len(c)]
+            if executor is None:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(solve_scenarios, self.backend,
+                                           program, c) for c in chunks]
+                    results = [f.result() for f in futures]
+            else:
+                futures = [executor.submit(solve_scenarios, self.backend,
+                                           program, c) for c in chunks]
+                results = [f.result() for f in futures]
+        amounts = np.concatenate([values for values, _ in results]
+                                 )[:, :len(formula.ingredients)]
+        statuses = [status for _, chunk in results for status in chunk]
+        return ScenarioResults(
+            amounts,
+            costs=(prices * amounts).sum(axis=1) / formula.batch_size,
+            statuses=statuses,
+            nutrients=matrix.dot(amounts.T).T / formula.batch_size)
+
+    def sweep(self, nutrient: Any, values: Sequence[float],
+              bound: str = 'minimum', exact: bool = False,
+              formula: Formula = None) -> CostCurve:
+        """Solve the formula at a range of values of a nutrient bound
+
+        The formula itself is left untouched. One problem is built and only
+        the bound is patched between points.
+
+        Args:
+            nutrient: FormulaNutrient, Nutrient or code of the nutrient
+            values (list[float]): values of the bound to solve at, or with
+                exact the lowest and highest value to sweep
+            bound (str, optional): 'minimum' or 'maximum'.
+                Defaults to 'minimum'.
+            exact (bool, optional): instead of solving at the values, solve
+                at the ends of their range and at every breakpoint of the
+                cost in between, found by ranging. Defaults to False.
+            formula (Formula, optional): formula to sweep.
+                Defaults to the solver formula.
+
+        Returns:
+            CostCurve
+        """
+        if formula is None:
+            formula = self.formula
+        if bound not in ('minimum', 'maximum'):
+            raise ValueError(
+                f'bound must be minimum or maximum, not {bound!r}')
+        item = formula.get_nutrient(nutrient)
+        if item is None:
+            raise ValueError(f'{nutrient} is not a nutrient of {formula.name}')
+        # give the nutrient a row in the program for the sweep
+        previous = getattr(item, bound)
+        setattr(item, bound, float(values[0]))
+        try:
+            matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+            program = self.create_program(formula, matrix)
+            bounded = self.bounded_nutrients(formula)
+        finally:
+            setattr(item, bound, previous)
+        if item not in bounded:
+            raise ValueError(f'cannot sweep {item.name} from 0')
+        row = bounded.index(item) + 1
+        if exact:
+            points, results = parametric_bound(self.backend, program, row,
+                                               bound, min(values),
+                                               max(values))
+        else:
+            points, results = sweep_bound(self.backend, program, row, bound,
+                                          values)
+        amounts = np.array([r.values[:len(formula.ingredients)]
+                            for r in results])
+        optimal = np.array([r.status == 'Optimal' for r in results])
+        return CostCurve(
+            points,
+            costs=np.where(optimal, amounts
+                           @ program.costs[:len(formula.ingredients)],
+                           np.nan)
+            / formula.batch_size,
+            slopes=np.array([r.row_duals[row] if o and r.row_duals is not None
+                             else np.nan for r, o in zip(results, optimal)])
+            / formula.batch_size,
+            amounts=amounts,
+            nutrients=matrix.dot(amounts.T).T / formula.batch_size,
+            statuses=[r.status for r in results])
+
+    def analyze(self, amounts: Sequence[Sequence[float]] = None,
+                formula: Formula = None) -> Analysis:
+        """Get the nutrient levels, cost and bound violations of a batch
+        of mixes of the formula ingredients without solving
+
+        All mixes are analyzed with one product of the nutrient matrix.
+        Levels and costs are per unit of each mix, like the nutrient
+        amounts and cost of a solved formula. Ingredient bounds are
+        checked on the amounts scaled to the formula batch size. Nutrient
+        bounds of 0 are unbounded, as in the formula problem.
+
+        Args:
+            amounts (list, optional): (mixes, ingredients) ingredient
+                amounts in the order of formula.ingredients, or the amounts
+                of one mix. Defaults to the current ingredient amounts.
+            formula (Formula, optional): formula whose ingredients,
+                nutrients and bounds to use. Defaults to the solver formula.
+
+        Returns:
+            Analysis
+        """
+        if formula is None:
+            formula = self.formula
+        if amounts is None:
+            amounts = [[np.nan if i.amount is None else i.amount
+                        for i in formula.ingredients]]
+        matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+        return analyze_amounts(
+            matrix, [i.cost or 0 for i in formula.ingredients], amounts,
+            [(n.minimum or -np.inf, n.maximum or np.inf)
+             for n in formula.nutrients],
+            [(-np.inf if i.minimum is None else i.minimum,
+              np.inf if i.maximum is None else i.maximum)
+             for i in formula.ingredients],
+            matrix.codes, [i.code for i in formula.ingredients],
+            formula.batch_size)
+
+    def compliance(self, samples: int = 10000, seed: int = None,
+                   formula: Formula = None) -> Compliance:
+        """Check how often the current ingredient amounts of a formula meet
+        its nutrient bounds when the ingredient nutrient amounts vary
+
+        Each ingredient nutrient with an sd is drawn from a normal
+        distribution around its amount, cut off at 0, once per sample. All
+        samples are evaluated with a few matrix products.
+
+        Args:
+            samples (int, optional): number of nutrient matrices to sample.
+                Defaults to 10000.
+            seed (int, optional): seed of the random generator.
+                Defaults to None.
+            formula (Formula, optional): formula to check.
+                Defaults to the solver formula.
+
+        Returns:
+            Compliance of the formula nutrients
+        """
+        if formula is None:
+            formula = self.formula
+        if any(i.amount is None for i in formula.ingredients):
+            raise ValueError(f'{formula.name} has no solution to check')
+        matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+        return self._sample_compliance(
+            formula, matrix, [i.amount for i in formula.ingredients],
+            samples, seed)
+
+    @staticmethod
+    def _sample_compliance(formula: Formula, matrix: NutrientMatrix,
+                           amounts: Sequence[float], samples: int,
+                           seed: int) -> Compliance:
+        deviations = NutrientMatrix(formula.ingredients, formula.nutrients,
+                                    attribute='sd')
+        totals = sample_totals(matrix, deviations, amounts, samples, seed)
+        return Compliance(
+            matrix.codes,
+            np.array([n.minimum or -np.inf for n in formula.nutrients]),
+            np.array([n.maximum or np.inf for n in formula.nutrients]),
+            totals / formula.batch_size)
+
+    def optimize_margin(self, probability: float = 0.95,
+                        samples: int = 10000, seed: int = None,
+                        formula: Formula = None) -> MarginSolution:
+        """Solve a formula with safety margins on its nutrient bounds, so
+        that each bound holds with at least a probability when the
+        ingredient nutrient amounts vary, see stochastic.margin_program
+
+        The formula itself is left untouched.
+
+        Args:
+            probability (float, optional): probability each nutrient bound
+                has to hold with. Defaults to 0.95.
+            samples (int, optional): number of nutrient matrices to check
+                the solution against, 0 to skip the check.
+                Defaults to 10000.
+            seed (int, optional): seed of the random generator.
+                Defaults to None.
+            formula (Formula, optional): formula to solve.
+                Defaults to the solver formula.
+
+        Returns:
+            MarginSolution
+        """
+        from statistics import NormalDist
+        if formula is None:
+            formula = self.formula
+        if not 0 < probability < 1:
+            raise ValueError(f'probability must be between 0 and 1, '
+                             f'not {probability}')
+        bounded = self.bounded_nutrients(formula)
+        matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+        program = self.create_program(formula, matrix)
+        deviations = NutrientMatrix(formula.ingredients, bounded,
+                                    attribute='sd')
+        # shift the nutrient rows down one for the total row
+        deviations = SparseMatrix(
+            deviations.rows + 1, deviations.indices,
+            deviations.data / formula.batch_size, shape=program.matrix.shape)
+        margins, _ = margin_program(program, deviations,
+                                    NormalDist().inv_cdf(probability))
+        result = self.backend.solve(self.backend.build(margins))
+        if result.status != 'Optimal':
+            return MarginSolution(probability, result.status, None,
+                                  result.values, None)
+        values = np.asarray(result.values, dtype=float)
+        amounts = values[:len(formula.ingredients)]
+        solution = MarginSolution(
+            probability, result.status,
+            float(values @ program.costs) / formula.batch_size, amounts,
+            matrix.dot(amounts) / formula.batch_size)
+        if samples:
+            solution.compliance = self._sample_compliance(
+                formula, matrix, amounts, samples, seed)
+        return solution
 
     def optimize(self, formula: Formula = None):
         """Optimize the formula by creating and solving the formula problem
+
+        A problem built by an earlier optimize is patched and re-solved
+        instead when only ingredient costs or bounds changed. With a cache,
+        a formula whose problem was solved before is restored from it
+        without solving.
+
+        The time spent in each phase and the problem size are recorded in
+        formula.profile.
         """
         if formula is None:
             formula = self.formula
-        self.create_problem(formula)
-        self.solve_problem(formula)
+        profile = self._start_profile(formula)
+        # a formula whose solve raises stays dirty
+        signature = formula.signature()
+        formula.solved_signature = None
+        with self._phase(formula, 'program'):
+            matrix = NutrientMatrix(formula.ingredients, formula.nutrients)
+            program = self.create_program(formula, matrix)
+        profile.count(program)
+        key = None
+        if self.cache is not None:
+            with self._phase(formula, 'cache'):
+                key = program.digest(self.backend.settings())
+                result = self.cache.get(key)
+            if result is not None:
+                profile.cached = True
+                self._restore(formula, matrix, program, result)
+                formula.solved_signature = signature
+                return
+        with self._phase(formula, 'update'):
+            patched = self._patch_problem(formula, matrix, program)
+        if not patched:
+            with self._phase(formula, 'build'):
+                self._build_problem(formula, matrix, program)
+        if self.warm_start and program.is_mip:
+            start = self.mip_start(formula)
+            if start is not None:
+                self.backend.set_start(formula.problem, start)
+        with self._phase(formula, 'solve'):
+            result = self._solve(formula)
+        if key is not None:
+            self.cache.put(key, result)
+        self.read_result(formula, result)
+        formula.solved_signature = signature
+
+    async def optimize_async(self, formula: Formula = None,
+                             timeout: float = None,
+                             executor: Executor = None):
+        """Optimize the formula in an executor without blocking the
+        event loop
+
+        The formula is solved as a copy and the results are written back
+        once the solve finishes, so a cancelled or timed out optimize
+        leaves the formula as it was. A solve already running in a thread
+        or process is not interrupted, its result is discarded.
+
+        Args:
+            formula (Formula, optional): formula to optimize.
+                Defaults to the solver formula.
+            timeout (float, optional): seconds to wait for the solve before
+                raising asyncio.TimeoutError. Defaults to None.
+            executor (Executor, optional): executor to solve in.
+                Defaults to the event loop's default thread pool.
+        """
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+        if formula is None:
+            formula = self.formula
+        if self.restore_cached(formula):
+            return
+        signature = formula.signature()
+        # a process pool copies the formula when pickling it
+        if not isinstance(executor, ProcessPoolExecutor):
+            remote = copy.deepcopy(formula)
+        else:
+            remote = formula
+        loop = asyncio.get_running_loop()
+        results, cached = await asyncio.wait_for(
+            loop.run_in_executor(executor, _optimize_remote, remote),
+            timeout)
+        _merge_results(formula, results, cached)
+        formula.solved_signature = signature
 
 
 class FormulaLibrary:
@@ -443,7 +1549,8 @@ class FormulaLibrary:
     def __init__(self, name: str, formula_unit: str = None,
                  nutrients: List[Nutrient] = None,
                  ingredients: List[Ingredient] = None,
-                 formulas: List[Formula] = None):
+                 formulas: List[Formula] = None,
+                 cache: SolutionCache = None):
         """[summary]
 
         Args:
@@ -452,12 +1559,17 @@ class FormulaLibrary:
             nutrients (list[nutrient], optional):  Defaults to None.
             ingredients (list[ingredient], optional): Defaults to None.
             formulas (list[formula], optional): Defaults to None.
+            cache (SolutionCache, optional): solution cache shared by the
+                formulas when the library optimizes them. Defaults to None.
         """
         self.name = name
         self.formula_unit = formula_unit
         self.nutrients = nutrients or []
         self.ingredients = ingredients or []
         self.formulas = formulas or []
+        self.cache = cache
+        self.store = None
+        self.catalog = None
 
     def add_nutrients(self, nutrients: List[Nutrient]):
         self.nutrients += nutrients
@@ -468,6 +1580,386 @@ class FormulaLibrary:
     def add_formulas(self, formulas: List[Formula]):
         self.formulas += formulas
 
-    def optimize(self):
+    def load_catalog(self, path: str, mmap: bool = True) -> Catalog:
+        """Load a catalog of ingredients and nutrients in one read
+
+        The nutrient amounts stay in one (ingredients, nutrients) array and
+        the Ingredients and Nutrients are only created when first asked for
+        with catalog.get_ingredient and catalog.get_nutrient. The created
+        objects are not added to the library ingredients and nutrients.
+
+        Args:
+            path (str): wide or long CSV, Parquet or NPZ file, see
+                Catalog.load
+            mmap (bool, optional): memory map the amounts of binary files.
+                Defaults to True.
+
+        Returns:
+            Catalog, also kept as the library catalog
+        """
+        self.catalog = Catalog.load(path, mmap=mmap)
+        return self.catalog
+
+    def save(self, path: str):
+        """Save the library to a binary snapshot, see snapshot.save_snapshot
+
+        Args:
+            path (str): file to write, an npz file
+        """
+        save_snapshot(self, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> FormulaLibrary:
+        """Load a library saved by save, see snapshot.load_snapshot
+
+        Args:
+            path (str): file to read
+            mmap (bool, optional): memory map the numeric arrays.
+                Defaults to True.
+
+        Returns:
+            FormulaLibrary
+        """
+        return load_snapshot(path, mmap=mmap)
+
+    def compact(self) -> FormulaStore:
+        """Move the bounds and amounts of the formula items into a columnar
+        FormulaStore, leaving the items as views of its arrays
+
+        Formulas added after compacting keep their own values until the
+        library is compacted again.
+
+        Returns:
+            FormulaStore of the library formulas
+        """
+        if self.store is not None:
+            self.store.unbind()
+        self.store = FormulaStore(self.formulas)
+        self.store.bind()
+        return self.store
+
+    def optimize_joint(self, demand: Dict[Formula, float] = None,
+                       inventory: Dict[Ingredient, float] = None,
+                       backend: Union[str, SolverBackend] = None
+                       ) -> JointResult:
+        """Optimize formulas together in one problem, sharing a limited
+        inventory of ingredients
+
+        Each formula keeps its own ingredient and nutrient bounds and is
+        produced in the amount of its demand. The total cost of producing
+        every demand is minimized subject to the ingredients used by all
+        formulas staying within the inventory. Formula amounts are per
+        batch as usual. Shadow prices, reduced costs and ranging of the
+        formula items are not set by a joint solve.
+
+        Args:
+            demand (dict, optional): {Formula: amount to produce}, in the
+                unit of the formula batch size. Defaults to one batch of
+                every library formula.
+            inventory (dict, optional): {Ingredient: available amount}.
+                Defaults to no limits.
+            backend (str or SolverBackend, optional): solver backend.
+                Defaults to the backend of the first formula.
+
+        Returns:
+            JointResult
+        """
+        if demand is None:
+            demand = {f: f.batch_size for f in self.formulas}
+        inventory = inventory or {}
+        formulas = list(demand)
+        if backend is None:
+            backend = formulas[0].solver.backend
+        solver = FormulaSolver(backend=backend)
+        matrices = [NutrientMatrix(f.ingredients, f.nutrients)
+                    for f in formulas]
+        programs = [solver.create_program(f, m)
+                    for f, m in zip(formulas, matrices)]
+        for formula in formulas:
+            if not formula.batch_size:
+                raise ValueError(
+                    f'Formula {formula.code} needs a batch size to be '
+                    f'optimized jointly')
+        scales = [demand[f] / f.batch_size for f in formulas]
+        entries = {ingredient: [] for ingredient in inventory}
+        for block, formula in enumerate(formulas):
+            for col, ingredient in enumerate(formula.ingredients):
+                if ingredient.ingredient in entries:
+                    entries[ingredient.ingredient].append((block, col))
+        # names by position, codes of formulas or ingredients may repeat
+        limits = [(f'stock_{k}', entries[ingredient], amount)
+                  for k, (ingredient, amount) in enumerate(inventory.items())]
+        program = combine_programs(self.name, programs, scales,
+                                   [f'f{k}' for k in range(len(formulas))],
+                                   limits)
+        result = solver.backend.solve(solver.backend.build(program))
+
+        for formula, matrix, block, block_result in zip(
+                formulas, matrices, programs,
+                split_result(result, programs)):
+            # the formula problem no longer matches its program, the next
+            # optimize builds it again
+            formula.matrix = matrix
+            formula.program = block
+            formula.presolved = None
+            formula.problem = None
+            formula.variables = {}
+            formula.profile = SolveProfile()
+            # solved together with others, not on its own
+            formula.solved_signature = None
+            solver.read_result(formula, block_result)
+
+        usage = {}
+        for formula, scale in zip(formulas, scales):
+            for ingredient in formula.ingredients:
+                usage[ingredient.ingredient] = \
+                    usage.get(ingredient.ingredient, 0.0) + \
+                    scale * (ingredient.amount or 0.0)
+        shadow_prices = dict.fromkeys(inventory)
+        if result.row_duals is not None:
+            duals = result.row_duals[program.num_rows - len(limits):]
+            shadow_prices = dict(zip(inventory, duals.tolist()))
+        return JointResult(result.status, result.objective, usage,
+                           shadow_prices)
+
+    async def optimize_async(self, concurrency: int = None,
+                             timeout: float = None,
+                             executor: Executor = None):
+        """Optimize all formulas in the library without blocking the
+        event loop, see FormulaSolver.optimize_async
+
+        A formula that raises or times out gets the status 'Error' and the
+        exception in formula.error instead of aborting the rest of the
+        library. Cancelling cancels every formula still pending.
+
+        Args:
+            concurrency (int, optional): number of formulas to solve at
+                once. Defaults to the number of CPUs.
+            timeout (float, optional): seconds to wait for each formula.
+                Defaults to None.
+            executor (Executor, optional): executor to solve in.
+                Defaults to the event loop's default thread pool.
+        """
+        import asyncio
+        if self.cache is not None:
+            for formula in self.formulas:
+                formula.solver.cache = self.cache
+        semaphore = asyncio.Semaphore(concurrency or os.cpu_count() or 1)
+
+        async def optimize(formula: Formula):
+            async with semaphore:
+                try:
+                    await formula.solver.optimize_async(formula, timeout,
+                                                        executor)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    formula.status = 'Error'
+                    formula.error = e
+
+        await asyncio.gather(*[optimize(f) for f in self.formulas])
+
+    def add_hook(self, hook: Hook):
+        """Add a profiling hook to the solvers of the library formulas,
+        see FormulaSolver.add_hook
+
+        Args:
+            hook (callable): hook to add
+        """
+        for formula in self.formulas:
+            formula.solver.add_hook(hook)
+
+    def profile_records(self) -> List[Dict[str, Any]]:
+        """Get the profile of the last optimize of each formula
+
+        Returns:
+            list[dict]: SolveProfile records with the formula name and code
+        """
+        return [dict(name=f.name, code=f.code, **f.profile.to_record())
+                for f in self.formulas]
+
+    def profile_summary(self) -> Dict[str, Any]:
+        """Get the profiles of the formulas aggregated,
+        see summarize_profiles
+        """
+        return summarize_profiles([f.profile for f in self.formulas])
+
+    def optimize(self, workers: int = None, executor: Executor = None,
+                 on_result: Callable[[Formula], None] = None,
+                 force: bool = False):
+        """Optimize the formulas in the library that are dirty, see
+        Formula.dirty
+
+        Without workers or an executor the formulas are solved one after
+        another. Otherwise each formula is solved in a worker and the results
+        are merged back in library order. A formula that raises in its worker
+        gets the status 'Error' and the exception in formula.error instead of
+        aborting the rest of the library.
+
+        Args:
+            workers (int, optional): number of worker processes to solve in.
+                Defaults to None.
+            executor (Executor, optional): executor to submit the formulas to
+                instead of a new process pool. Defaults to None.
+            on_result (callable, optional): called with each formula as soon
+                as its results are in, like the write method of a
+                ResultWriter. Clean formulas are passed too.
+                Defaults to None.
+            force (bool, optional): optimize every formula, dirty or not.
+                Defaults to False.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        if self.cache is not None:
+            for formula in self.formulas:
+                formula.solver.cache = self.cache
+        if workers is None and executor is None:
+            for formula in self.formulas:
+                if force or formula.dirty:
+                    formula.optimize()
+                if on_result is not None:
+                    on_result(formula)
+            return
+        # only send the formulas that are dirty and not cached to the workers
+        formulas = []
         for formula in self.formulas:
-            formula.optimize()
+            if not force and not formula.dirty:
+                if on_result is not None:
+                    on_result(formula)
+            elif not formula.solver.restore_cached(formula):
+                formulas.append(formula)
+            elif on_result is not None:
+                on_result(formula)
+        if executor is not None:
+            _optimize_formulas(executor, formulas, on_result)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                crashed = _optimize_formulas(pool, formulas, on_result)
+            # a dead worker breaks the pool for every pending formula,
+            # retry those one at a time so only the culprit keeps the error
+            for formula in crashed:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    _optimize_formulas(pool, [formula], on_result)
+
+    def iter_results(self, formulas: Sequence[Formula] = None
+                     ) -> Iterator[Tuple]:
+        """Generate result rows, one per formula ingredient and nutrient,
+        see export.RESULT_COLUMNS
+
+        Args:
+            formulas (list[Formula], optional): formulas to get the rows of.
+                Defaults to the library formulas.
+
+        Yields:
+            tuple of the values of a row
+        """
+        for formula in self.formulas if formulas is None else formulas:
+            yield from formula_rows(formula, self.name)
+
+    def write_results(self, writer: ResultWriter):
+        """Write the result rows of every formula and close the writer
+
+        Args:
+            writer (ResultWriter): writer to write to
+        """
+        with writer:
+            for formula in self.formulas:
+                writer.write(formula)
+
+    def to_csv(self) -> str:
+        """Get the results as CSV text
+        """
+        text = io.StringIO()
+        self.write_results(CsvResultWriter(text, self.name))
+        return text.getvalue()
+
+    def save_csv(self, path: str):
+        """Write the results to a CSV file
+
+        Args:
+            path (str): file to write
+        """
+        self.write_results(CsvResultWriter(path, self.name))
+
+    def save_parquet(self, path: str):
+        """Write the results to a Parquet file, or an Arrow IPC file if the
+        path ends in .arrow or .feather
+
+        Args:
+            path (str): file to write
+        """
+        self.write_results(ArrowResultWriter(path, self.name))
+
+    def to_records(self) -> np.recarray:
+        """Get the results as a NumPy record array
+        """
+        writer = RecordResultWriter(self.name)
+        self.write_results(writer)
+        return writer.to_records()
+
+
+def _optimize_remote(formula: Formula) -> Tuple:
+    """Optimize a formula in a worker and return its results along with
+    the results the worker added to its copy of the solver cache
+    """
+    formula.optimize()
+    cache = formula.solver.cache
+    return formula.get_results(), cache.items() if cache is not None else []
+
+
+def _optimize_formulas(executor: Executor, formulas: List[Formula],
+                       on_result: Callable[[Formula], None] = None
+                       ) -> List[Formula]:
+    """Optimize formulas in an executor and merge the results into them
+
+    Args:
+        executor (Executor): executor to submit the formulas to
+        formulas (list[Formula]): formulas to optimize
+        on_result (callable, optional): called with each formula that is
+            not lost to a broken process pool once it is merged.
+            Defaults to None.
+
+    Returns:
+        formulas lost to a broken process pool (list[Formula])
+    """
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+    futures = []
+    signatures = []
+    for formula in formulas:
+        signatures.append(formula.signature())
+        try:
+            future = executor.submit(_optimize_remote, formula)
+        except BrokenProcessPool:
+            future = Future()
+            future.set_exception(BrokenProcessPool())
+        futures.append(future)
+    crashed = []
+    for formula, future, signature in zip(formulas, futures, signatures):
+        try:
+            results, cached = future.result()
+        except Exception as e:
+            formula.status = 'Error'
+            formula.error = e
+            if isinstance(e, BrokenProcessPool):
+                crashed.append(formula)
+                continue
+        else:
+            _merge_results(formula, results, cached)
+            formula.solved_signature = signature
+        if on_result is not None:
+            on_result(formula)
+    return crashed
+
+
+def _merge_results(formula: Formula, results: Tuple,
+                   cached: List[Tuple[str, SolverResult]]):
+    """Merge the return value of _optimize_remote into a formula
+    """
+    profile = formula.profile
+    formula.set_results(results)
+    formula.error = None
+    # the hooks ran in the worker unless the formula was sent there
+    if formula.profile is not profile:
+        replay(formula.profile, formula, formula.solver.hooks)
+    if formula.solver.cache is not None:
+        formula.solver.cache.update(cached)
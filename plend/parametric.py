@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import copy
+from typing import List, Sequence, Tuple
+
+from .backends import LinearProgram, SolverBackend, SolverResult
+from .sensitivity import compute_ranging
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class CostCurve:
+    def __init__(self, values: np.ndarray, costs: np.ndarray,
+                 slopes: np.ndarray, amounts: np.ndarray,
+                 nutrients: np.ndarray, statuses: List[str]):
+        """Formula cost as a bound of a nutrient moves
+
+        Between two points the cost is linear when the points come from an
+        exact sweep, which has a point at every breakpoint.
+
+        Args:
+            values (np.ndarray): value of the bound at each point
+            costs (np.ndarray): formula cost at each point, nan if the
+                formula is not optimal there
+            slopes (np.ndarray): change in formula cost per unit of the
+                bound at each point, nan if unknown
+            amounts (np.ndarray): (points, ingredients) ingredient amounts
+            nutrients (np.ndarray): (points, nutrients) nutrient amounts
+            statuses (list[str]): solver status at each point
+        """
+        self.values = values
+        self.costs = costs
+        self.slopes = slopes
+        self.amounts = amounts
+        self.nutrients = nutrients
+        self.statuses = statuses
+
+    def __len__(self) -> int:
+        return len(self.statuses)
+
+    def cost_at(self, value: float) -> float:
+        """Interpolate the cost at a value of the bound between the points
+        that are optimal
+
+        Args:
+            value (float): value of the bound
+
+        Returns:
+            cost, nan outside the optimal points
+        """
+        optimal = np.isfinite(self.costs)
+        return float(np.interp(value, self.values[optimal],
+                               self.costs[optimal], np.nan, np.nan))
+
+
+def with_row_bound(program: LinearProgram, row: int, side: str,
+                   value: float) -> LinearProgram:
+    """Copy a program with one row bound changed
+
+    Args:
+        program (LinearProgram): program to copy
+        row (int): row of the bound
+        side (str): 'minimum' for the lower bound, 'maximum' for the upper
+        value (float): new value of the bound
+
+    Returns:
+        LinearProgram sharing everything else with program
+    """
+    program = copy.copy(program)
+    attribute = 'row_lower' if side == 'minimum' else 'row_upper'
+    bounds = getattr(program, attribute).copy()
+    bounds[row] = value
+    setattr(program, attribute, bounds)
+    return program
+
+
+def sweep_bound(backend: SolverBackend, program: LinearProgram, row: int,
+                side: str, values: Sequence[float]
+                ) -> Tuple[np.ndarray, List[SolverResult]]:
+    """Solve a program at each value of a row bound
+
+    The problem is built once and only the bound is patched between values,
+    so backends that keep their basis warm start every solve from the
+    previous value.
+
+    Args:
+        backend (SolverBackend): backend to solve with
+        program (LinearProgram): program to solve
+        row (int): row of the bound
+        side (str): 'minimum' for the lower bound, 'maximum' for the upper
+        values (list[float]): values of the bound
+
+    Returns:
+        (values, result at each value)
+    """
+    solver = _Resolver(backend, program)
+    values = np.asarray(values, dtype=float)
+    return values, [solver.solve(row, side, v) for v in values.tolist()]
+
+
+def parametric_bound(backend: SolverBackend, program: LinearProgram,
+                     row: int, side: str, low: float, high: float,
+                     max_points: int = 1000, steps: int = 50
+                     ) -> Tuple[np.ndarray, List[SolverResult]]:
+    """Solve a program at both ends of a range of a row bound and at every
+    breakpoint of the optimal cost in between
+
+    Ranging of each optimal solution tells how far the bound can move before
+    the basis changes, which is the next breakpoint. The cost is linear
+    between consecutive points. Where a solution has no ranging, because
+    the backend does not report row duals, the bound moves by an even step
+    instead and the cost is only sampled there.
+
+    Args:
+        backend (SolverBackend): backend to solve with
+        program (LinearProgram): program to solve, not an integer program
+        row (int): row of the bound
+        side (str): 'minimum' for the lower bound, 'maximum' for the upper
+        low (float): lowest value of the bound
+        high (float): highest value of the bound
+        max_points (int, optional): most points to solve.
+            Defaults to 1000.
+        steps (int, optional): number of even steps through the range
+            when there is no ranging. Defaults to 50.
+
+    Returns:
+        (values, result at each value)
+
+    Raises:
+        ValueError: program is an integer program, which has no ranging
+            to find breakpoints with
+    """
+    if program.is_mip:
+        raise ValueError('cannot find the breakpoints of an integer '
+                         'program, sweep it at given values instead')
+    solver = _Resolver(backend, program)
+    values, results = [], []
+    value = low
+    while len(values) < max_points:
+        result = solver.solve(row, side, value)
+        values.append(value)
+        results.append(result)
+        if value >= high or result.status != 'Optimal':
+            break
+        step = 1e-6 * max(1.0, abs(value))
+        end = _range_end(solver.program, result, row, side)
+        if -np.inf < end <= value + step:
+            # degenerate at a breakpoint, step just past it to get the
+            # basis of the next piece
+            end = _range_end(solver.program,
+                             solver.solve(row, side, value + step), row, side)
+        if end <= value + step:
+            # no ranging to find the next breakpoint with
+            end = value + (high - low) / steps
+        value = min(end, high)
+    return np.array(values), results
+
+
+class _Resolver:
+    """Patch and re-solve one problem at other values of a row bound
+    """
+
+    def __init__(self, backend: SolverBackend, program: LinearProgram):
+        self.backend = backend
+        self.program = program
+        self.problem = backend.build(program)
+
+    def solve(self, row: int, side: str, value: float) -> SolverResult:
+        program = with_row_bound(self.program, row, side, value)
+        if not self.backend.update(self.problem, self.program, program):
+            self.problem = self.backend.build(program)
+        self.program = program
+        return self.backend.solve(self.problem)
+
+
+def _range_end(program: LinearProgram, result: SolverResult, row: int,
+               side: str) -> float:
+    """Highest value of a row bound that keeps the basis of a result
+    """
+    if result.status != 'Optimal' or result.row_duals is None:
+        return -np.inf
+    ranging = compute_ranging(program, result.values, result.row_duals)
+    if ranging is None:
+        return -np.inf
+    ranges = ranging.row_lower_range if side == 'minimum' \
+        else ranging.row_upper_range
+    return float(ranges[row][1])
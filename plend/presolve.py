@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+from typing import Dict, List
+
+from .backends import LinearProgram, SolverResult
+from .matrix import SparseMatrix
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class Presolved:
+    def __init__(self, original: LinearProgram, program: LinearProgram,
+                 columns: np.ndarray, rows: np.ndarray, fixed: np.ndarray,
+                 reductions: Dict[str, List]):
+        """A LinearProgram reduced by presolve and how to map its solutions
+        back to the original program
+
+        Args:
+            original (LinearProgram): program that was presolved
+            program (LinearProgram): reduced program
+            columns (np.ndarray): original column of each reduced column
+            rows (np.ndarray): original row of each reduced row
+            fixed (np.ndarray): value of each original column that was
+                removed, nan for the columns that were kept
+            reductions (dict): original columns and rows removed or changed
+                by each reduction, see presolve
+        """
+        self.original = original
+        self.program = program
+        self.columns = columns
+        self.rows = rows
+        self.fixed = fixed
+        self.reductions = reductions
+
+    def same_reductions(self, other: 'Presolved') -> bool:
+        """Check if another presolve kept the same columns and rows into a
+        program of the same structure, so that a problem built from one can
+        be patched into the other
+        """
+        return (np.array_equal(self.columns, other.columns)
+                and np.array_equal(self.rows, other.rows)
+                and self.program.same_structure(other.program))
+
+    def restore(self, result: SolverResult) -> SolverResult:
+        """Map a result of the reduced program onto the original program
+
+        Removed columns get their fixed value, removed rows a dual of 0 and
+        every column the reduced cost of the original program.
+
+        Args:
+            result (SolverResult): result of solving the reduced program
+
+        Returns:
+            SolverResult of the original program
+        """
+        values = self.fixed.copy()
+        values[self.columns] = result.values
+        row_duals = reduced_costs = None
+        if result.row_duals is not None:
+            row_duals = np.zeros(self.original.num_rows)
+            row_duals[self.rows] = result.row_duals
+            reduced_costs = self.original.costs - \
+                self.original.matrix.toarray().T @ row_duals
+        objective = result.objective
+        if objective is not None:
+            removed = ~np.isnan(self.fixed)
+            objective += float(self.original.costs[removed]
+                               @ self.fixed[removed])
+        return SolverResult(result.status, values, objective, row_duals,
+                            reduced_costs, result.iterations)
+
+    def report(self) -> Dict[str, List]:
+        """Get the reductions with the column and row names of the original
+        program
+
+        Returns:
+            dict: {reduction: [names]}, dominated columns as
+            (name, dominating name)
+        """
+        cols, rows = self.original.col_names, self.original.row_names
+        return {
+            'fixed': [cols[j] for j in self.reductions['fixed']],
+            'dominated': [(cols[j], cols[k])
+                          for j, k in self.reductions['dominated']],
+            'empty_rows': [rows[i] for i in self.reductions['empty_rows']],
+            'redundant_rows': [rows[i]
+                               for i in self.reductions['redundant_rows']],
+            'tightened': [cols[j] for j in self.reductions['tightened']],
+        }
+
+
+def presolve(program: LinearProgram, tolerance: float = 1e-9) -> Presolved:
+    """Reduce a program before it is built
+
+    In order, presolve
+        - fixes columns whose lower and upper bounds are equal, like
+          ingredients with a maximum of 0, moving them into the row bounds
+        - fixes dominated columns at 0, a column is dominated by another
+          that costs no more, is no worse in every bounded row and can take
+          its whole amount
+        - removes rows without entries that any solution satisfies
+        - removes rows whose bounds no solution can reach past, from the
+          column bounds or from a convexity row (all ones, fixed total,
+          non-negative columns) like the formula batch total
+        - tightens infinite upper bounds implied by rows with positive
+          entries
+
+    Args:
+        program (LinearProgram): program to reduce
+        tolerance (float, optional): tolerance of the comparisons.
+            Defaults to 1e-9.
+
+    Returns:
+        Presolved
+    """
+    dense = program.matrix.toarray()
+    costs = program.costs
+    lower, upper = program.lower.copy(), program.upper.copy()
+    row_lower, row_upper = program.row_lower.copy(), program.row_upper.copy()
+    num_rows, num_cols = dense.shape
+    fixed = np.full(num_cols, np.nan)
+    reductions = {'fixed': [], 'dominated': [], 'empty_rows': [],
+                  'redundant_rows': [], 'tightened': []}
+
+    # columns fixed by their bounds
+    for j in np.flatnonzero(upper - lower <= tolerance).tolist():
+        fixed[j] = lower[j]
+        reductions['fixed'].append(j)
+    kept = np.isnan(fixed)
+    # move the fixed columns into the row bounds, the dominated columns
+    # found next are fixed at 0 and leave them as they are
+    shift = dense[:, ~kept] @ fixed[~kept]
+    row_lower -= shift
+    row_upper -= shift
+
+    total = _convexity_row(dense, lower, row_lower, row_upper, kept,
+                           tolerance)
+
+    # dominated columns
+    has_lower = np.isfinite(row_lower)
+    has_upper = np.isfinite(row_upper)
+    for j in np.flatnonzero(kept & (lower <= 0) & (upper >= 0)).tolist():
+        candidates = kept & (costs <= costs[j] + tolerance)
+        candidates[j] = False
+        if total is None:
+            candidates &= np.isinf(upper)
+        else:
+            candidates &= upper >= row_upper[total] - tolerance
+        if not candidates.any():
+            continue
+        difference = dense[:, candidates] - dense[:, [j]]
+        no_worse = np.all(((difference >= -tolerance) | ~has_lower[:, None])
+                          & ((difference <= tolerance) | ~has_upper[:, None]),
+                          axis=0)
+        # of identical columns keep the first
+        equal = np.all(np.abs(difference) <= tolerance, axis=0) & \
+            (np.abs(costs[candidates] - costs[j]) <= tolerance)
+        dominating = np.flatnonzero(candidates)[
+            no_worse & ~(equal & (np.flatnonzero(candidates) > j))]
+        if len(dominating):
+            fixed[j] = 0.0
+            kept[j] = False
+            reductions['dominated'].append((j, int(dominating[0])))
+
+    # empty and redundant rows
+    rows = np.ones(num_rows, dtype=bool)
+    entries = np.abs(dense[:, kept]) > tolerance
+    with np.errstate(invalid='ignore'):
+        low = np.where(dense[:, kept] > 0, dense[:, kept] * lower[kept],
+                       dense[:, kept] * upper[kept])
+        high = np.where(dense[:, kept] > 0, dense[:, kept] * upper[kept],
+                        dense[:, kept] * lower[kept])
+    low = np.where(entries, low, 0).sum(axis=1)
+    high = np.where(entries, high, 0).sum(axis=1)
+    if total is not None and kept.any():
+        size = row_upper[total]
+        low = np.maximum(low, size * dense[:, kept].min(axis=1))
+        high = np.minimum(high, size * dense[:, kept].max(axis=1))
+    for i in range(num_rows):
+        if i == total:
+            continue
+        if not entries[i].any():
+            if row_lower[i] <= tolerance and row_upper[i] >= -tolerance:
+                rows[i] = False
+                reductions['empty_rows'].append(i)
+        elif low[i] >= row_lower[i] - tolerance and \
+                high[i] <= row_upper[i] + tolerance:
+            rows[i] = False
+            reductions['redundant_rows'].append(i)
+
+    # implied upper bounds
+    for i in np.flatnonzero(rows & np.isfinite(row_upper)).tolist():
+        coefficients = dense[i]
+        if np.any(kept & (coefficients < 0)):
+            continue
+        positive = kept & (coefficients > 0)
+        rest = float(coefficients[positive] @ lower[positive])
+        if not np.isfinite(rest):
+            continue
+        for j in np.flatnonzero(positive & np.isinf(upper)).tolist():
+            upper[j] = lower[j] + (row_upper[i] - rest) / coefficients[j]
+            reductions['tightened'].append(j)
+
+    columns = np.flatnonzero(kept)
+    rows = np.flatnonzero(rows)
+    reduced = dense[np.ix_(rows, columns)]
+    entry_rows, entry_cols = np.nonzero(reduced)
+    return Presolved(
+        program,
+        LinearProgram(
+            program.name,
+            costs=costs[columns],
+            lower=lower[columns],
+            upper=upper[columns],
+            matrix=SparseMatrix(entry_rows, entry_cols,
+                                reduced[entry_rows, entry_cols],
+                                shape=reduced.shape),
+            row_lower=row_lower[rows],
+            row_upper=row_upper[rows],
+            col_names=[program.col_names[j] for j in columns.tolist()],
+            row_names=[program.row_names[i] for i in rows.tolist()]),
+        columns, rows, fixed, reductions)
+
+
+def _convexity_row(dense: np.ndarray, lower: np.ndarray,
+                   row_lower: np.ndarray, row_upper: np.ndarray,
+                   kept: np.ndarray, tolerance: float) -> int:
+    """Find a row that fixes the sum of the kept columns, which are all
+    non-negative, like the formula batch total
+
+    Returns:
+        row, or None
+    """
+    if not np.all(lower[kept] >= -tolerance):
+        return None
+    for i in range(len(dense)):
+        if abs(row_upper[i] - row_lower[i]) <= tolerance and \
+                np.all(np.abs(dense[i, kept] - 1) <= tolerance):
+            return i
+    return None
@@ -0,0 +1,114 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+
+# called with (formula, phase, seconds) after each timed phase
+Hook = Callable[[Any, str, float], None]
+
+
+class SolveProfile:
+    """Timings and problem size of the last optimize of a formula
+
+    Phases are 'program' (compiling the nutrient matrix and LinearProgram),
+    'cache' (hashing the program and looking it up), 'build' or 'update'
+    (creating or patching the solver problem), 'solve' (the backend solve,
+    including writing files and running the solver command for PuLP),
+    'readback' (reading amounts and totals), 'sensitivity' and
+    'diagnosis' (the elastic solve of an infeasible formula).
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.backend = None
+        self.status = None
+        self.cached = False
+        self.variables = 0
+        self.constraints = 0
+        self.nonzeros = 0
+        self.iterations = None
+        self.mip_gap = None
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    @contextmanager
+    def phase(self, name: str, formula: Any = None,
+              hooks: Sequence[Hook] = ()) -> Iterator[None]:
+        """Time a phase, adding to the time of earlier runs of it
+
+        Args:
+            name (str): name of the phase
+            formula (Formula, optional): formula passed to the hooks.
+                Defaults to None.
+            hooks (list, optional): callables to call with
+                (formula, name, seconds) afterwards. Defaults to ().
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            for hook in hooks:
+                hook(formula, name, seconds)
+
+    def count(self, program: Any):
+        """Record the size of a LinearProgram
+
+        Args:
+            program (LinearProgram): program being solved
+        """
+        self.variables = program.num_cols
+        self.constraints = program.num_rows
+        self.nonzeros = program.matrix.nnz
+
+    def to_record(self) -> Dict[str, Any]:
+        """Get the profile as a flat dict of plain values
+        """
+        record = {'backend': self.backend, 'status': self.status,
+                  'cached': self.cached, 'variables': self.variables,
+                  'constraints': self.constraints,
+                  'nonzeros': self.nonzeros, 'iterations': self.iterations,
+                  'mip_gap': self.mip_gap,
+                  'total': self.total}
+        for name, seconds in self.phases.items():
+            record[f'{name}_seconds'] = seconds
+        return record
+
+
+def summarize_profiles(profiles: Sequence[SolveProfile]) -> Dict[str, Any]:
+    """Aggregate the profiles of many formulas
+
+    Args:
+        profiles (list[SolveProfile]): profiles to aggregate
+
+    Returns:
+        dict: number of formulas, cached formulas and formulas by status,
+        summed phase seconds, problem sizes and iterations
+    """
+    summary = {'formulas': len(profiles), 'cached': 0, 'statuses': {},
+               'phases': {}, 'total': 0.0, 'variables': 0, 'constraints': 0,
+               'nonzeros': 0, 'iterations': 0}
+    for profile in profiles:
+        summary['cached'] += profile.cached
+        summary['statuses'][profile.status] = \
+            summary['statuses'].get(profile.status, 0) + 1
+        for name, seconds in profile.phases.items():
+            summary['phases'][name] = \
+                summary['phases'].get(name, 0.0) + seconds
+        summary['total'] += profile.total
+        summary['variables'] += profile.variables
+        summary['constraints'] += profile.constraints
+        summary['nonzeros'] += profile.nonzeros
+        summary['iterations'] += profile.iterations or 0
+    return summary
+
+
+def replay(profile: SolveProfile, formula: Any, hooks: List[Hook]):
+    """Call hooks with the phases of a profile recorded elsewhere, like in a
+    worker process that the hooks were not sent to
+    """
+    for name, seconds in profile.phases.items():
+        for hook in hooks:
+            hook(formula, name, seconds)
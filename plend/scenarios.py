@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+
+from .backends import LinearProgram, SolverBackend
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class ScenarioResults:
+    def __init__(self, amounts: np.ndarray, costs: np.ndarray,
+                 statuses: List[str], nutrients: np.ndarray):
+        """Solutions of a formula under a batch of ingredient price scenarios
+
+        Args:
+            amounts (np.ndarray): (scenarios, ingredients) ingredient amounts
+            costs (np.ndarray): formula cost of each scenario
+            statuses (list[str]): solver status of each scenario
+            nutrients (np.ndarray): (scenarios, nutrients) nutrient amounts
+        """
+        self.amounts = amounts
+        self.costs = costs
+        self.statuses = statuses
+        self.nutrients = nutrients
+
+    def __len__(self) -> int:
+        return len(self.statuses)
+
+
+def solve_scenarios(backend: SolverBackend, program: LinearProgram,
+                    prices: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+    """Solve a program once per row of prices
+
+    The problem is built once and only its costs are patched between
+    scenarios, so backends that keep their basis warm start every solve
+    from the previous scenario.
+
+    Args:
+        backend (SolverBackend): backend to solve with
+        program (LinearProgram): program to solve
+        prices (np.ndarray): (scenarios, columns) objective coefficients
+
+    Returns:
+        ((scenarios, columns) values, status of each scenario)
+    """
+    values = np.full(prices.shape, np.nan)
+    statuses = []
+    problem = backend.build(program)
+    for scenario, costs in enumerate(prices):
+        scenario_program = program.with_costs(costs)
+        if not backend.update(problem, program, scenario_program):
+            problem = backend.build(scenario_program)
+        program = scenario_program
+        result = backend.solve(problem)
+        values[scenario] = result.values
+        statuses.append(result.status)
+    return values, statuses
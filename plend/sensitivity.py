@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+from .backends import LinearProgram
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class Ranging:
+    def __init__(self, cost_lower: np.ndarray, cost_upper: np.ndarray,
+                 row_lower_range: np.ndarray, row_upper_range: np.ndarray):
+        """Ranges over which an optimal basis stays optimal
+
+        Args:
+            cost_lower (np.ndarray): lowest cost of each column
+            cost_upper (np.ndarray): highest cost of each column
+            row_lower_range (np.ndarray): (low, high) range of the lower
+                bound of each row, nan if the row has no lower bound
+            row_upper_range (np.ndarray): (low, high) range of the upper
+                bound of each row, nan if the row has no upper bound
+        """
+        self.cost_lower = cost_lower
+        self.cost_upper = cost_upper
+        self.row_lower_range = row_lower_range
+        self.row_upper_range = row_upper_range
+
+
+def compute_ranging(program: LinearProgram, values: Sequence[float],
+                    row_duals: Sequence[float],
+                    tolerance: float = 1e-7) -> Ranging:
+    """Compute cost and row bound ranging of an optimal basic solution
+
+    The rows are written as program.matrix @ x - r = 0 with the row
+    activities r bounded by the row bounds, so that every basis is a set of
+    num_rows columns of [matrix, -I]. Variables strictly between their
+    bounds are basic, degenerate variables with the smallest reduced costs
+    complete the basis.
+
+    Args:
+        program (LinearProgram): program that was solved
+        values (list): optimal value of each column
+        row_duals (list): dual value of each row, used to pick degenerate
+            basic variables
+        tolerance (float, optional): tolerance of the bound and pivot checks.
+            Defaults to 1e-7.
+
+    Returns:
+        Ranging, or None if the solution is not basic
+    """
+    num_cols, num_rows = program.num_cols, program.num_rows
+    x = np.asarray(values, dtype=float)
+    augmented = np.hstack([program.matrix.toarray(), -np.eye(num_rows)])
+    z = np.concatenate([x, program.matrix.dot(x)])
+    lower = np.concatenate([program.lower, program.row_lower])
+    upper = np.concatenate([program.upper, program.row_upper])
+    with np.errstate(invalid='ignore'):
+        at_lower = np.isfinite(lower) & \
+            (np.abs(z - lower) <= tolerance * (1 + np.abs(lower)))
+        at_upper = np.isfinite(upper) & \
+            (np.abs(z - upper) <= tolerance * (1 + np.abs(upper)))
+    duals = np.asarray(row_duals, dtype=float)
+    reduced_costs = np.concatenate([program.costs - augmented[:, :num_cols].T
+                                    @ duals, duals])
+
+    # complete the basis with the degenerate variables closest to entering
+    basis = np.flatnonzero(~(at_lower | at_upper)).tolist()
+    if len(basis) > num_rows:
+        return None
+    span = _orthonormal(augmented[:, basis], tolerance)
+    degenerate = np.flatnonzero(at_lower | at_upper)
+    fixed = at_lower & at_upper
+    for k in degenerate[np.lexsort((np.abs(reduced_costs[degenerate]),
+                                    fixed[degenerate]))]:
+        if len(basis) == num_rows:
+            break
+        column = augmented[:, k] - span @ (span.T @ augmented[:, k])
+        norm = np.linalg.norm(column)
+        if norm > tolerance:
+            basis.append(k)
+            span = np.column_stack([span, column / norm])
+    if len(basis) < num_rows:
+        return None
+    basis = np.array(basis)
+    nonbasic = np.setdiff1d(np.arange(num_cols + num_rows), basis)
+    inverse = np.linalg.inv(augmented[:, basis])
+
+    # reduced costs of the chosen basis
+    costs = np.concatenate([program.costs, np.zeros(num_rows)])
+    duals = inverse.T @ costs[basis]
+    reduced_costs = costs - augmented.T @ duals
+
+    # cost ranging
+    sign = np.where(at_lower, 1.0, -1.0)[nonbasic]
+    movable = ~fixed[nonbasic]
+    gaps = (sign * reduced_costs[nonbasic])[movable]
+    tableau = (inverse @ augmented[:, nonbasic[movable]]) \
+        * sign[movable]
+    cost_lower = np.full(num_cols, -np.inf)
+    cost_upper = np.full(num_cols, np.inf)
+    for position, j in enumerate(basis.tolist()):
+        if j >= num_cols:
+            continue
+        down, up = _ratio_range(gaps, tableau[position], tolerance)
+        cost_lower[j] = program.costs[j] + down
+        cost_upper[j] = program.costs[j] + up
+    for j in nonbasic[nonbasic < num_cols].tolist():
+        if fixed[j]:
+            continue
+        if at_lower[j]:
+            cost_lower[j] = program.costs[j] - reduced_costs[j]
+        else:
+            cost_upper[j] = program.costs[j] - reduced_costs[j]
+
+    # row bound ranging
+    row_lower_range = np.full((num_rows, 2), np.nan)
+    row_upper_range = np.full((num_rows, 2), np.nan)
+    basic_values = z[basis]
+    basic_lower, basic_upper = lower[basis], upper[basis]
+    basic = set(basis.tolist())
+    for i in range(num_rows):
+        k = num_cols + i
+        activity = z[k]
+        if k in basic or not (at_lower[k] or at_upper[k]):
+            row_lower_range[i] = -np.inf, activity
+            row_upper_range[i] = activity, np.inf
+        else:
+            # moving a binding bound moves the basic variables along B^-1 e_i
+            direction = inverse[:, i]
+            down, up = _step_range(basic_values, basic_lower, basic_upper,
+                                   direction, tolerance)
+            if at_lower[k] and not fixed[k]:
+                up = min(up, upper[k] - lower[k])
+                row_lower_range[i] = lower[k] + down, lower[k] + up
+                row_upper_range[i] = activity, np.inf
+            elif at_upper[k] and not fixed[k]:
+                down = max(down, lower[k] - upper[k])
+                row_upper_range[i] = upper[k] + down, upper[k] + up
+                row_lower_range[i] = -np.inf, activity
+            else:
+                row_lower_range[i] = row_upper_range[i] = \
+                    activity + down, activity + up
+        if not np.isfinite(program.row_lower[i]):
+            row_lower_range[i] = np.nan
+        if not np.isfinite(program.row_upper[i]):
+            row_upper_range[i] = np.nan
+    return Ranging(cost_lower, cost_upper, row_lower_range, row_upper_range)
+
+
+def _orthonormal(columns: np.ndarray, tolerance: float) -> np.ndarray:
+    """Orthonormal basis of the span of some columns
+    """
+    if not columns.shape[1]:
+        return np.zeros((columns.shape[0], 0))
+    q, r = np.linalg.qr(columns)
+    return q[:, np.abs(np.diag(r)) > tolerance]
+
+
+def _ratio_range(gaps: np.ndarray, steps: np.ndarray, tolerance: float):
+    """Range of t keeping every gap - t * step nonnegative
+    """
+    rising = steps > tolerance
+    falling = steps < -tolerance
+    up = gaps[rising] / steps[rising]
+    down = gaps[falling] / steps[falling]
+    return (min(down.max(initial=-np.inf), 0.0),
+            max(up.min(initial=np.inf), 0.0))
+
+
+def _step_range(values: np.ndarray, lower: np.ndarray, upper: np.ndarray,
+                direction: np.ndarray, tolerance: float):
+    """Range of t keeping values + t * direction within their bounds
+    """
+    rising = direction > tolerance
+    falling = direction < -tolerance
+    up = np.concatenate([
+        (upper[rising] - values[rising]) / direction[rising],
+        (lower[falling] - values[falling]) / direction[falling]])
+    down = np.concatenate([
+        (lower[rising] - values[rising]) / direction[rising],
+        (upper[falling] - values[falling]) / direction[falling]])
+    return (min(down.max(initial=-np.inf), 0.0),
+            max(up.min(initial=np.inf), 0.0))
@@ -0,0 +1,530 @@
+"""Formulation service keeping a library loaded and a pool of solvers warm
+
+Run it with
+
+    python -m plend.server --catalog ingredients.npz --workers 4
+
+and POST formulas as JSON to /optimize, see FormulaService.formula_from_dict.
+GET /metrics returns queue depth, batch and latency figures.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+from .backends import SolverBackend
+from .models import Formula, FormulaLibrary, Ingredient, Nutrient
+
+
+class ServiceMetrics:
+    def __init__(self, window: int = 10000):
+        """Counters and recent latencies of a FormulaService, safe to update
+        from several threads
+
+        Args:
+            window (int, optional): number of recent request latencies to
+                keep for the percentiles. Defaults to 10000.
+        """
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def batch_started(self, size: int):
+        with self._lock:
+            self.batches += 1
+            self.batched += size
+            self.in_flight += size
+
+    def request_done(self, seconds: float, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.in_flight -= 1
+            self.latencies.append(seconds)
+
+    def snapshot(self, queue_depth: int = 0) -> Dict[str, Any]:
+        """Get the metrics as plain values
+
+        Args:
+            queue_depth (int, optional): requests waiting to be batched.
+                Defaults to 0.
+
+        Returns:
+            dict of the counters, the mean batch size and the mean and
+            percentile latencies in seconds
+        """
+        with self._lock:
+            latencies = sorted(self.latencies)
+            record = {
+                'uptime': time.time() - self.started,
+                'queue_depth': queue_depth,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'errors': self.errors,
+                'batches': self.batches,
+                'mean_batch_size': (self.batched / self.batches
+                                    if self.batches else None),
+            }
+        record['latency_mean'] = (sum(latencies) / len(latencies)
+                                  if latencies else None)
+        for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            record[f'latency_{name}'] = (
+                latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+                if latencies else None)
+        return record
+
+
+class FormulaService:
+    def __init__(self, library: FormulaLibrary = None, workers: int = 1,
+                 executor: Executor = None,
+                 backend: Union[str, SolverBackend] = 'pulp',
+                 max_batch: int = 32, batch_wait: float = 0.002):
+        """Solve formula requests against a library kept in memory
+
+        Requests are collected into micro-batches, up to max_batch formulas
+        or whatever arrived within batch_wait seconds of the first, and
+        each batch is solved in one task of a pool of workers that imported
+        plend and ran a solve when they started.
+
+        Args:
+            library (FormulaLibrary, optional): library whose ingredients,
+                nutrients and catalog the requests refer to by code.
+                Defaults to an empty library.
+            workers (int, optional): number of worker processes.
+                Defaults to 1.
+            executor (Executor, optional): executor to solve the batches in
+                instead of a new process pool. Defaults to None.
+            backend (str or SolverBackend, optional): solver backend of the
+                formulas. Defaults to 'pulp'.
+            max_batch (int, optional): most formulas in a batch.
+                Defaults to 32.
+            batch_wait (float, optional): seconds to wait for more formulas
+                after the first of a batch. Defaults to 0.002.
+        """
+        self.library = library or FormulaLibrary('service')
+        self.workers = workers
+        self.backend = backend
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.metrics = ServiceMetrics()
+        self.executor = executor
+        self._owned = executor is None
+        self._broken = False
+        self._queue = queue.Queue()
+        self._thread = None
+        self._ingredients = {i.code: i for i in self.library.ingredients}
+        self._nutrients = {n.code: n for n in self.library.nutrients}
+
+    def __enter__(self) -> 'FormulaService':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start the worker pool and the batching thread
+        """
+        if self._thread is not None:
+            return
+        if self.executor is None:
+            self._start_pool()
+        self._thread = threading.Thread(target=self._dispatch, daemon=True,
+                                        name='plend-batcher')
+        self._thread.start()
+
+    def close(self):
+        """Solve the queued requests and stop the service
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._owned and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _start_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_warm_worker,
+            initargs=(self.backend,))
+        # start every worker now instead of on the first requests
+        for future in [self.executor.submit(time.sleep, 0)
+                       for _ in range(self.workers)]:
+            future.result()
+
+    def _restart_pool(self):
+        """Replace an owned process pool that lost a worker
+        """
+        self.executor.shutdown(wait=False)
+        self._start_pool()
+        self._broken = False
+
+    def get_ingredient(self, code: str) -> Ingredient:
+        """Get a library ingredient, or catalog ingredient, by code
+        """
+        if not isinstance(code, str):
+            # the catalog would take an int as a row
+            raise ValueError(f'ingredient code must be a string, not {code!r}')
+        ingredient = self._ingredients.get(code)
+        if ingredient is None and self.library.catalog is not None:
+            try:
+                ingredient = self.library.catalog.get_ingredient(code)
+            except KeyError:
+                pass
+        if ingredient is None:
+            raise ValueError(f'unknown ingredient {code!r}')
+        return ingredient
+
+    def get_nutrient(self, code: str) -> Nutrient:
+        """Get a library nutrient, or catalog nutrient, by code
+        """
+        if not isinstance(code, str):
+            # the catalog would take an int as a row
+            raise ValueError(f'nutrient code must be a string, not {code!r}')
+        nutrient = self._nutrients.get(code)
+        if nutrient is None and self.library.catalog is not None:
+            try:
+                nutrient = self.library.catalog.get_nutrient(code)
+            except KeyError:
+                pass
+        if nutrient is None:
+            raise ValueError(f'unknown nutrient {code!r}')
+        return nutrient
+
+    def formula_from_dict(self, data: Dict[str, Any]) -> Formula:
+        """Create a formula from a request
+
+        A request looks like
+
+            {"name": "Starter", "batch_size": 100,
+             "ingredients": ["corn", {"code": "oil", "maximum": 10}],
+             "nutrients": [{"code": "protein", "minimum": 22}]}
+
+        where ingredients and nutrients are codes, or objects with a code
+        and optional minimum and maximum.
+
+        Args:
+            data (dict): request
+
+        Returns:
+            Formula
+        """
+        if not isinstance(data, dict) or 'name' not in data:
+            raise ValueError('a formula needs a name')
+        formula = Formula(data['name'], code=data.get('code'),
+                          batch_size=data.get('batch_size', 1))
+        formula.solver.backend = self.backend
+        for entry in data.get('ingredients', []):
+            code, minimum, maximum = _bounds(entry)
+            formula.add_ingredient(self.get_ingredient(code),
+                                   minimum=minimum, maximum=maximum)
+        for entry in data.get('nutrients', []):
+            code, minimum, maximum = _bounds(entry)
+            formula.add_nutrient(self.get_nutrient(code),
+                                 minimum=minimum, maximum=maximum)
+        return formula
+
+    def submit(self, formula: Formula) -> Future:
+        """Queue a formula to be solved in the next batch
+
+        Args:
+            formula (Formula): formula to solve
+
+        Returns:
+            Future of the formula with its results set, or of the exception
+            its solve raised
+        """
+        if self._thread is None:
+            raise RuntimeError('the service is not started')
+        future = Future()
+        self._queue.put((formula, future, time.perf_counter()))
+        return future
+
+    def optimize(self, formulas: Sequence[Formula],
+                 timeout: float = None) -> List[Formula]:
+        """Solve formulas and wait for them
+
+        Args:
+            formulas (list[Formula]): formulas to solve
+            timeout (float, optional): seconds to wait for each formula.
+                Defaults to None.
+
+        Returns:
+            the formulas with their results set
+        """
+        futures = [self.submit(formula) for formula in formulas]
+        return [future.result(timeout) for future in futures]
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the service metrics, see ServiceMetrics.snapshot
+        """
+        return self.metrics.snapshot(self._queue.qsize())
+
+    def _dispatch(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.max_batch:
+                try:
+                    request = self._queue.get(
+                        timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    # let the loop above see the end after this batch
+                    self._queue.put(None)
+                    break
+                batch.append(request)
+            self.metrics.batch_started(len(batch))
+            # a failed submit fails its batch instead of stopping the thread
+            try:
+                if self._broken and self._owned:
+                    self._restart_pool()
+                future = self.executor.submit(_optimize_batch,
+                                              [r[0] for r in batch])
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+            future.add_done_callback(
+                lambda done, batch=batch: self._finish(batch, done))
+
+    def _finish(self, batch: List[Tuple[Formula, Future, float]],
+                done: Future):
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            outcomes = done.result()
+        except Exception as e:
+            # the batcher replaces the pool before the next batch
+            self._broken |= isinstance(e, BrokenProcessPool)
+            outcomes = [(None, e)] * len(batch)
+        for (formula, future, start), (results, error) in zip(batch,
+                                                              outcomes):
+            if error is None:
+                formula.set_results(results)
+                future.set_result(formula)
+            else:
+                formula.status = 'Error'
+                formula.error = error
+                future.set_exception(error)
+            self.metrics.request_done(time.perf_counter() - start,
+                                      error is not None)
+
+
+def formula_to_dict(formula: Formula) -> Dict[str, Any]:
+    """Get the solution of a formula as a JSON response
+
+    Args:
+        formula (Formula): solved formula
+
+    Returns:
+        dict with the formula status and cost and the amount and bounds of
+        each ingredient and nutrient, nan and infinite values are None
+    """
+    def items(entries, extra):
+        return [dict({'code': i.code, 'name': i.name, 'amount': i.amount,
+                      'minimum': i.minimum, 'maximum': i.maximum},
+                     **{a: getattr(i, a) for a in extra})
+                for i in entries]
+    return _finite({
+        'name': formula.name,
+        'code': formula.code,
+        'status': formula.status,
+        'cost': formula.cost,
+        'batch_size': formula.batch_size,
+        'ingredients': items(formula.ingredients, ('reduced_cost',)),
+        'nutrients': items(formula.nutrients, ('shadow_price',)),
+    })
+
+
+def make_server(service: FormulaService, host: str = '127.0.0.1',
+                port: int = 8750,
+                timeout: float = None) -> ThreadingHTTPServer:
+    """Create an HTTP server for a started service
+
+    POST /optimize takes a formula request, or {"formulas": [requests]},
+    and answers with formula_to_dict of each. GET /metrics answers with
+    the service stats and GET /health with {"status": "ok"}.
+
+    Args:
+        service (FormulaService): service to solve the requests with
+        host (str, optional): address to listen on.
+            Defaults to '127.0.0.1'.
+        port (int, optional): port to listen on, 0 for any free port.
+            Defaults to 8750.
+        timeout (float, optional): seconds to wait for a formula before
+            answering 504. Defaults to None.
+
+    Returns:
+        ThreadingHTTPServer, call serve_forever to serve
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                self.reply(200, service.stats())
+            elif self.path == '/health':
+                self.reply(200, {'status': 'ok'})
+            else:
+                self.reply(404, {'error': f'no route {self.path}'})
+
+        def do_POST(self):
+            from concurrent.futures import TimeoutError
+            if self.path != '/optimize':
+                self.reply(404, {'error': f'no route {self.path}'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                data = json.loads(self.rfile.read(length) or b'null')
+                many = isinstance(data, dict) and 'formulas' in data
+                formulas = [service.formula_from_dict(d) for d in
+                            (data['formulas'] if many else [data])]
+            except (ValueError, TypeError) as e:
+                self.reply(400, {'error': str(e)})
+                return
+            futures = [service.submit(formula) for formula in formulas]
+            try:
+                for future in futures:
+                    future.exception(timeout)
+            except TimeoutError:
+                self.reply(504, {'error': 'timed out'})
+                return
+            answers = [formula_to_dict(formula) for formula in formulas]
+            for answer, future in zip(answers, futures):
+                if future.exception() is not None:
+                    answer['error'] = repr(future.exception())
+            self.reply(200, {'formulas': answers} if many else answers[0])
+
+        def reply(self, code: int, body: Dict[str, Any]):
+            text = json.dumps(body, default=_jsonable,
+                              allow_nan=False).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(text)))
+            self.end_headers()
+            self.wfile.write(text)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main(argv: Sequence[str] = None):
+    """Serve a library from the command line
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m plend.server',
+        description='Serve least cost formulation over HTTP')
+    parser.add_argument('--catalog', help='ingredient catalog to load, '
+                        'see Catalog.load')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8750)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--backend', default='pulp')
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--batch-wait', type=float, default=0.002,
+                        help='seconds to wait to fill a batch')
+    parser.add_argument('--timeout', type=float,
+                        help='seconds to wait for a formula')
+    args = parser.parse_args(argv)
+    library = FormulaLibrary('service')
+    if args.catalog:
+        library.load_catalog(args.catalog)
+    service = FormulaService(library, workers=args.workers,
+                             backend=args.backend, max_batch=args.max_batch,
+                             batch_wait=args.batch_wait)
+    with service:
+        server = make_server(service, args.host, args.port, args.timeout)
+        print(f'serving on http://{args.host}:{server.server_port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def _bounds(entry: Any) -> Tuple[str, float, float]:
+    """Get the code, minimum and maximum of a request ingredient or nutrient
+    """
+    if isinstance(entry, str):
+        return entry, 0, None
+    if not isinstance(entry, dict) or 'code' not in entry:
+        raise ValueError(f'expected a code or an object with a code, '
+                         f'got {entry!r}')
+    return entry['code'], entry.get('minimum', 0), entry.get('maximum')
+
+
+def _optimize_batch(formulas: List[Formula]) -> List[Tuple[Any, Exception]]:
+    """Optimize a batch of formulas in a worker
+
+    Returns:
+        (results, None) of each formula that solved, see
+        Formula.get_results, and (None, exception) of each that raised
+    """
+    outcomes = []
+    for formula in formulas:
+        try:
+            formula.optimize()
+        except Exception as e:
+            outcomes.append((None, e))
+        else:
+            outcomes.append((formula.get_results(), None))
+    return outcomes
+
+
+def _warm_worker(backend: Union[str, SolverBackend]):
+    """Import the solver and run a first solve when a worker starts
+    """
+    nutrient = Nutrient('warm')
+    ingredient = Ingredient('warm', nutrients={nutrient: 1})
+    formula = Formula('warm', ingredients={ingredient: (0, None)},
+                      nutrients={nutrient: (0.5, None)})
+    formula.solver.backend = backend
+    formula.optimize()
+
+
+def _finite(value: Any) -> Any:
+    """Replace nan and infinite numbers, which JSON has no values for,
+    with None
+    """
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    if hasattr(value, 'tolist'):
+        value = value.tolist()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _jsonable(value: Any) -> Any:
+    # numpy scalars and tuples like the ranging of a bound
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, tuple):
+        return list(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence
+
+from .catalog import Catalog, _load_npz
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+# version of the snapshot layout, bumped on every change to it
+FORMAT_VERSION = 4
+
+# (low, high) ranging of the formula items, saved as _low and _high arrays
+INGREDIENT_RANGES = ('cost_range',)
+NUTRIENT_RANGES = ('minimum_range', 'maximum_range')
+
+
+class StringTable:
+    """Interned strings, each stored once and referred to by index
+    """
+
+    def __init__(self, strings: Sequence[str] = ()):
+        self.strings = list(strings)
+        self.index = {s: i for i, s in enumerate(self.strings)}
+
+    def add(self, value: str) -> int:
+        """Get the index of a string, adding it if it is new
+
+        Args:
+            value (str): string to add, or None
+
+        Returns:
+            index (int), -1 for None
+        """
+        if value is None:
+            return -1
+        index = self.index.get(value)
+        if index is None:
+            index = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def get(self, index: int) -> str:
+        return None if index < 0 else self.strings[index]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Get the strings as one UTF-8 buffer and the offset of each
+        """
+        encoded = [s.encode() for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return {'string_data': np.frombuffer(b''.join(encoded) or b'\0',
+                                             dtype=np.uint8),
+                'string_offsets': offsets}
+
+    @classmethod
+    def from_arrays(cls, data: np.ndarray,
+                    offsets: np.ndarray) -> 'StringTable':
+        data = np.asarray(data).tobytes()
+        offsets = np.asarray(offsets).tolist()
+        return cls([data[start:end].decode()
+                    for start, end in zip(offsets, offsets[1:])])
+
+
+def save_snapshot(library: Any, path: str):
+    """Save a library to an uncompressed npz file that load_snapshot can
+    memory map
+
+    The file holds the format version, one table of every name, code,
+    unit and status string, and numeric arrays of indices into it and of
+    the ingredient nutrient amounts, formula bounds and last solutions.
+    The library catalog, if any, is saved with its arrays prefixed by
+    'catalog_'.
+
+    Args:
+        library (FormulaLibrary): library to save
+        path (str): file to write
+    """
+    strings = StringTable()
+    nutrients, nutrient_index = _collect(
+        library.nutrients,
+        [n.nutrient for i in library.ingredients for n in i.nutrients],
+        [n.nutrient for f in library.formulas for i in f.ingredients
+         for n in i.ingredient.nutrients],
+        [n.nutrient for f in library.formulas for n in f.nutrients])
+    ingredients, ingredient_index = _collect(
+        library.ingredients,
+        [i.ingredient for f in library.formulas for i in f.ingredients])
+    entries = [(row, nutrient_index[id(n.nutrient)], n.amount, n.sd)
+               for row, ingredient in enumerate(ingredients)
+               for n in ingredient.nutrients]
+    formulas = library.formulas
+
+    def ids(values):
+        return np.array([strings.add(v) for v in values], dtype=np.int32)
+
+    def floats(values):
+        return np.array([np.nan if v is None else v for v in values],
+                        dtype=float)
+
+    def items(prefix, attribute, index, extra, ranges):
+        lists = [getattr(f, attribute) for f in formulas]
+        entries = [i for items in lists for i in items]
+        arrays = {
+            f'{prefix}_ptr': np.cumsum([0] + [len(i) for i in lists]),
+            f'{prefix}_item': np.array([index[id(i.item)] for i in entries],
+                                       dtype=np.int64),
+        }
+        for name in ('minimum', 'maximum', 'amount') + extra:
+            arrays[f'{prefix}_{name}'] = floats(
+                [getattr(i, name) for i in entries])
+        for name in ranges:
+            values = [getattr(i, name) or (None, None) for i in entries]
+            arrays[f'{prefix}_{name}_low'] = floats([v[0] for v in values])
+            arrays[f'{prefix}_{name}_high'] = floats([v[1] for v in values])
+        return arrays
+
+    arrays = {
+        'format_version': np.array([FORMAT_VERSION]),
+        'library': ids([library.name, library.formula_unit]),
+        'nutrient_name': ids([n.name for n in nutrients]),
+        'nutrient_code': ids([n.code for n in nutrients]),
+        'nutrient_unit': ids([n.unit for n in nutrients]),
+        'library_nutrients': np.array(
+            [nutrient_index[id(n)] for n in library.nutrients],
+            dtype=np.int64),
+        'ingredient_name': ids([i.name for i in ingredients]),
+        'ingredient_code': ids([i.code for i in ingredients]),
+        'ingredient_cost': floats([i.cost for i in ingredients]),
+        'library_ingredients': np.array(
+            [ingredient_index[id(i)] for i in library.ingredients],
+            dtype=np.int64),
+        'amount_ingredient': np.array([e[0] for e in entries],
+                                      dtype=np.int64),
+        'amount_nutrient': np.array([e[1] for e in entries], dtype=np.int64),
+        'amount_value': floats([e[2] for e in entries]),
+        'amount_sd': floats([e[3] for e in entries]),
+        'formula_name': ids([f.name for f in formulas]),
+        'formula_code': ids([f.code for f in formulas]),
+        'formula_unit': ids([f.unit for f in formulas]),
+        'formula_status': ids([f.status for f in formulas]),
+        'formula_batch_size': floats([f.batch_size for f in formulas]),
+        'formula_cost': floats([f.cost for f in formulas]),
+        'formula_max_ingredients': floats(
+            [f.max_ingredients for f in formulas]),
+        'formula_dirty': np.array([f.dirty for f in formulas], dtype=bool),
+    }
+    arrays.update(items('formula_ingredient', 'ingredients',
+                        ingredient_index,
+                        ('reduced_cost', 'inclusion', 'increment'),
+                        INGREDIENT_RANGES))
+    arrays.update(items('formula_nutrient', 'nutrients', nutrient_index,
+                        ('shadow_price',), NUTRIENT_RANGES))
+    if library.catalog is not None:
+        arrays.update((f'catalog_{name}', value) for name, value in
+                      library.catalog.to_arrays().items())
+    arrays.update(strings.to_arrays())
+    np.savez(path, **arrays)
+
+
+def load_snapshot(path: str, mmap: bool = True) -> Any:
+    """Load a library saved by save_snapshot
+
+    Formulas get their last solution back without solving, those that
+    were not dirty when saved are not dirty either.
+
+    Args:
+        path (str): file to read
+        mmap (bool, optional): memory map the numeric arrays instead of
+            reading them. Defaults to True.
+
+    Returns:
+        FormulaLibrary
+    """
+    from .models import (Formula, FormulaIngredient, FormulaLibrary,
+                         FormulaNutrient, Ingredient, IngredientNutrient,
+                         Nutrient)
+    arrays = _upgrade(_load_npz(path, mmap))
+    strings = StringTable.from_arrays(arrays['string_data'],
+                                      arrays['string_offsets'])
+
+    def texts(name):
+        return [strings.get(i) for i in arrays[name].tolist()]
+
+    def values(name):
+        return [None if v != v else v for v in arrays[name].tolist()]
+
+    nutrients = [Nutrient(name, code, unit) for name, code, unit in zip(
+        texts('nutrient_name'), texts('nutrient_code'),
+        texts('nutrient_unit'))]
+    ingredients = [Ingredient(name, code, cost) for name, code, cost in zip(
+        texts('ingredient_name'), texts('ingredient_code'),
+        values('ingredient_cost'))]
+    for row, column, amount, sd in zip(
+            arrays['amount_ingredient'].tolist(),
+            arrays['amount_nutrient'].tolist(), values('amount_value'),
+            values('amount_sd')):
+        ingredient = ingredients[row]
+        ingredient.nutrients.append(
+            IngredientNutrient(nutrients[column], amount, ingredient, sd))
+    # the item indexes are built on their first lookup
+    for ingredient in ingredients:
+        ingredient.version = 0
+
+    name, unit = texts('library')
+    library = FormulaLibrary(
+        name, unit,
+        nutrients=[nutrients[i]
+                   for i in arrays['library_nutrients'].tolist()],
+        ingredients=[ingredients[i]
+                     for i in arrays['library_ingredients'].tolist()])
+    ingredient_items = _items(arrays, 'formula_ingredient', ingredients,
+                              values,
+                              ('reduced_cost', 'inclusion', 'increment'),
+                              INGREDIENT_RANGES)
+    nutrient_items = _items(arrays, 'formula_nutrient', nutrients, values,
+                            ('shadow_price',), NUTRIENT_RANGES)
+    for k, (name, code, unit, status, batch_size, cost, max_ingredients,
+            dirty) in enumerate(zip(
+            texts('formula_name'), texts('formula_code'),
+            texts('formula_unit'), texts('formula_status'),
+            values('formula_batch_size'), values('formula_cost'),
+            values('formula_max_ingredients'),
+            arrays['formula_dirty'].tolist())):
+        formula = Formula(name, code, batch_size, unit,
+                          max_ingredients=None if max_ingredients is None
+                          else int(max_ingredients))
+        for cls, items, entries in (
+                (FormulaIngredient, formula.ingredients, ingredient_items[k]),
+                (FormulaNutrient, formula.nutrients, nutrient_items[k])):
+            for item, minimum, maximum, amount, *results in entries:
+                entry = cls(item, amount, minimum, maximum, formula=formula)
+                for result in results:
+                    setattr(entry, *result)
+                items.append(entry)
+        formula.status = status
+        formula.cost = cost
+        if not dirty:
+            formula.solved_signature = formula.signature()
+        library.formulas.append(formula)
+
+    catalog = {name[len('catalog_'):]: value for name, value in arrays.items()
+               if name.startswith('catalog_')}
+    if catalog:
+        library.catalog = Catalog._from_arrays(catalog)
+    return library
+
+
+def _collect(*groups: Sequence[Any]):
+    """Unique objects of several lists in the order they first appear and
+    the position of each by id
+    """
+    unique, index = [], {}
+    for group in groups:
+        for value in group:
+            if id(value) not in index:
+                index[id(value)] = len(unique)
+                unique.append(value)
+    return unique, index
+
+
+def _items(arrays: Dict[str, np.ndarray], prefix: str, items: List[Any],
+           values: Any, extra: Sequence[str],
+           ranges: Sequence[str] = ()) -> List[List[tuple]]:
+    """(item, minimum, maximum, amount, *(attribute, value)) of the formula
+    items of each formula
+    """
+    columns = zip([items[i] for i in arrays[f'{prefix}_item'].tolist()],
+                  values(f'{prefix}_minimum'), values(f'{prefix}_maximum'),
+                  values(f'{prefix}_amount'),
+                  *[[(name, v) for v in values(f'{prefix}_{name}')]
+                    for name in extra],
+                  *[[(name, None if low is None else (low, high))
+                     for low, high in zip(values(f'{prefix}_{name}_low'),
+                                          values(f'{prefix}_{name}_high'))]
+                    for name in ranges])
+    columns = list(columns)
+    ptr = arrays[f'{prefix}_ptr'].tolist()
+    return [columns[start:end] for start, end in zip(ptr, ptr[1:])]
+
+
+def _upgrade_1(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Add the integer constraints of formulas and their ingredients
+    """
+    arrays = dict(arrays)
+    arrays['formula_max_ingredients'] = np.full(
+        len(arrays['formula_name']), np.nan)
+    for name in ('inclusion', 'increment'):
+        arrays[f'formula_ingredient_{name}'] = np.full(
+            len(arrays['formula_ingredient_item']), np.nan)
+    return arrays
+
+
+def _upgrade_2(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Add whether formulas were dirty, taking unsolved ones as dirty
+    """
+    arrays = dict(arrays)
+    strings = StringTable.from_arrays(arrays['string_data'],
+                                      arrays['string_offsets'])
+    arrays['formula_dirty'] = np.array(
+        [strings.get(i) in ('Unsolved', 'Error')
+         for i in arrays['formula_status'].tolist()], dtype=bool)
+    return arrays
+
+
+def _upgrade_3(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Add the ranging of the formula items, taking every formula as dirty
+    so that it is solved again for its ranging
+    """
+    arrays = dict(arrays)
+    for prefix, ranges in (('formula_ingredient', INGREDIENT_RANGES),
+                           ('formula_nutrient', NUTRIENT_RANGES)):
+        for name in ranges:
+            for end in ('low', 'high'):
+                arrays[f'{prefix}_{name}_{end}'] = np.full(
+                    len(arrays[f'{prefix}_item']), np.nan)
+    arrays['formula_dirty'] = np.ones(len(arrays['formula_name']),
+                                      dtype=bool)
+    return arrays
+
+
+# upgrades of the arrays of older versions, {version: upgrade to version + 1}
+UPGRADES = {1: _upgrade_1, 2: _upgrade_2, 3: _upgrade_3}
+
+
+def _upgrade(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Check the format version of snapshot arrays, upgrading older ones
+    """
+    if 'format_version' not in arrays:
+        raise ValueError('not a plend library snapshot')
+    version = int(arrays['format_version'][0])
+    if version > FORMAT_VERSION:
+        raise ValueError(f'snapshot format version {version} is newer than '
+                         f'the supported version {FORMAT_VERSION}')
+    while version < FORMAT_VERSION:
+        arrays = UPGRADES[version](arrays)
+        version += 1
+    return arrays
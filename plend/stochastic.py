@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+from typing import List, Sequence, Tuple
+
+from .backends import LinearProgram
+from .matrix import SparseMatrix
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class Compliance:
+    def __init__(self, codes: List[str], minimum: np.ndarray,
+                 maximum: np.ndarray, totals: np.ndarray,
+                 tolerance: float = 1e-9):
+        """Nutrient amounts of a formula solution over sampled nutrient
+        matrices and how often they meet the nutrient bounds
+
+        Args:
+            codes (list[str]): code of each nutrient
+            minimum (np.ndarray): minimum of each nutrient, -inf if unbounded
+            maximum (np.ndarray): maximum of each nutrient, inf if unbounded
+            totals (np.ndarray): (samples, nutrients) nutrient amounts
+            tolerance (float, optional): relative tolerance of the bounds.
+                Defaults to 1e-9.
+        """
+        self.codes = codes
+        self.minimum = minimum
+        self.maximum = maximum
+        self.totals = totals
+        slack = tolerance * np.maximum(
+            1, np.abs(np.where(np.isfinite(minimum), minimum, maximum)))
+        self.met = (totals >= minimum - slack) & (totals <= maximum + slack)
+
+    def __len__(self) -> int:
+        return len(self.totals)
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        """Share of the samples meeting the bounds of each nutrient
+        """
+        return self.met.mean(axis=0)
+
+    @property
+    def joint(self) -> float:
+        """Share of the samples meeting the bounds of every nutrient
+        """
+        return float(self.met.all(axis=1).mean())
+
+    def probability(self, code: str) -> float:
+        """Get the share of the samples meeting the bounds of a nutrient
+
+        Args:
+            code (str): code of the nutrient
+
+        Returns:
+            probability (float)
+        """
+        return float(self.met[:, self.codes.index(code)].mean())
+
+    def quantile(self, q: float) -> np.ndarray:
+        """Get a quantile of the amount of each nutrient
+
+        Args:
+            q (float): quantile between 0 and 1, 0.05 is the amount 95% of
+                the samples reach
+
+        Returns:
+            amount of each nutrient (np.ndarray)
+        """
+        return np.quantile(self.totals, q, axis=0)
+
+
+class MarginSolution:
+    def __init__(self, probability: float, status: str, cost: float,
+                 amounts: np.ndarray, nutrients: np.ndarray,
+                 compliance: Compliance = None):
+        """Solution of a formula whose nutrient bounds hold with a
+        probability, see margin_program
+
+        Args:
+            probability (float): probability each bound was solved for
+            status (str): solver status
+            cost (float): formula cost, None if not optimal
+            amounts (np.ndarray): amount of each formula ingredient
+            nutrients (np.ndarray): average amount of each formula nutrient
+            compliance (Compliance, optional): compliance of the solution
+                over sampled nutrient matrices. Defaults to None.
+        """
+        self.probability = probability
+        self.status = status
+        self.cost = cost
+        self.amounts = amounts
+        self.nutrients = nutrients
+        self.compliance = compliance
+
+
+def sample_totals(amounts: SparseMatrix, deviations: SparseMatrix,
+                  values: Sequence[float], samples: int, seed: int = None,
+                  chunk: int = 4096) -> np.ndarray:
+    """Sample the row totals of a solution over nutrient matrices whose
+    entries vary independently
+
+    Each entry with a deviation is drawn from a normal distribution around
+    its amount and cut off at 0, entries without one stay at their amount.
+    Samples are drawn in chunks, each chunk is one matrix product.
+
+    Args:
+        amounts (SparseMatrix): average nutrient matrix
+        deviations (SparseMatrix): standard deviation of each entry, with
+            the same shape
+        values (list[float]): value of each column
+        samples (int): number of samples
+        seed (int, optional): seed of the random generator.
+            Defaults to None.
+        chunk (int, optional): samples to draw at a time. Defaults to 4096.
+
+    Returns:
+        (samples, rows) totals (np.ndarray)
+    """
+    values = np.asarray(values, dtype=float)
+    base = amounts.dot(values)
+    dense = amounts.toarray()
+    rows, cols = deviations.rows, deviations.indices
+    means = dense[rows, cols]
+    scales = deviations.data
+    # sums the change of each varying entry into its row
+    entry_rows = np.zeros((len(rows), amounts.shape[0]))
+    entry_rows[np.arange(len(rows)), rows] = values[cols]
+    generator = np.random.default_rng(seed)
+    totals = np.empty((samples, amounts.shape[0]))
+    for start in range(0, samples, chunk):
+        size = min(chunk, samples - start)
+        drawn = np.maximum(means + scales
+                           * generator.standard_normal((size, len(rows))), 0)
+        totals[start:start + size] = base + (drawn - means) @ entry_rows
+    return totals
+
+
+def margin_program(program: LinearProgram, deviations: SparseMatrix,
+                   z: float) -> Tuple[LinearProgram, np.ndarray]:
+    """Add safety margins to the rows of a program
+
+    A row with a finite lower bound gets its entries lowered by z standard
+    deviations and a row with a finite upper bound gets them raised by as
+    much, a row with both and any deviation is split in two. Since the
+    standard deviation of a sum of independent entries is at most the sum
+    of their standard deviations, each bound then holds with at least the
+    normal probability of z for normally distributed entries.
+
+    Args:
+        program (LinearProgram): program to add the margins to
+        deviations (SparseMatrix): standard deviation of each entry of the
+            program matrix
+        z (float): margin in standard deviations
+
+    Returns:
+        (program with margins, original row of each row)
+    """
+    dense = program.matrix.toarray()
+    margin = z * deviations.toarray()
+    varies = np.any(margin != 0, axis=1)
+    has_lower = np.isfinite(program.row_lower)
+    has_upper = np.isfinite(program.row_upper)
+    # the lower side of every row, then the upper side of the split rows
+    split = np.flatnonzero(varies & has_lower & has_upper)
+    rows = np.concatenate([np.arange(program.num_rows), split])
+    upper_side = np.concatenate([~has_lower,
+                                 np.ones(len(split), dtype=bool)])
+    matrix = dense[rows] + np.where(upper_side[:, None], margin[rows],
+                                    -margin[rows])
+    row_lower = np.where(upper_side & varies[rows], -np.inf,
+                         program.row_lower[rows])
+    row_upper = program.row_upper[rows].copy()
+    row_upper[split] = np.inf
+    entry_rows, entry_cols = np.nonzero(matrix)
+    return LinearProgram(
+        program.name,
+        costs=program.costs,
+        lower=program.lower,
+        upper=program.upper,
+        matrix=SparseMatrix(entry_rows, entry_cols,
+                            matrix[entry_rows, entry_cols],
+                            shape=matrix.shape),
+        row_lower=row_lower,
+        row_upper=row_upper,
+        col_names=program.col_names,
+        row_names=[program.row_names[i] for i in rows.tolist()],
+        integrality=program.integrality), rows
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .utils import lazy_import
+
+np = lazy_import('numpy')
+
+
+class BoundTable:
+    """Columnar amount, minimum and maximum of the bound items of many
+    formulas, stored sparsely like a SparseMatrix in CSR layout
+
+    The entries of row r, the items of formula r in formula order, are
+    ptr[r]:ptr[r + 1] of the value arrays and columns[ptr[r]:ptr[r + 1]]
+    are their columns in items. Missing values (None) are nan.
+    """
+    fields = ('amount', 'minimum', 'maximum')
+
+    def __init__(self, items: Sequence[Any], rows: Sequence[Sequence[Any]]):
+        """Create a BoundTable holding the current values of bound items
+
+        Args:
+            items (list): items (Ingredient or Nutrient) of the columns
+            rows (list): bound items (FormulaIngredient or FormulaNutrient)
+                of each row
+        """
+        self.items = list(items)
+        self.index = {item: col for col, item in enumerate(self.items)}
+        self.ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in rows], out=self.ptr[1:])
+        entries = [entry for row in rows for entry in row]
+        self.columns = np.array([self.index[e.item] for e in entries],
+                                dtype=np.int32)
+        for name in self.fields:
+            setattr(self, name, np.array(
+                [getattr(e, name) for e in entries], dtype=float))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.ptr) - 1, len(self.items)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.columns)
+
+    def get(self, column: str, entry: int) -> float:
+        """Get a value
+
+        Args:
+            column (str): 'amount', 'minimum' or 'maximum'
+            entry (int): position of the value
+
+        Returns:
+            value, or None if it is missing
+        """
+        value = getattr(self, column).item(entry)
+        return None if value != value else value
+
+    def set(self, column: str, entry: int, value: float):
+        """Set a value
+
+        Args:
+            column (str): 'amount', 'minimum' or 'maximum'
+            entry (int): position of the value
+            value (float): value to set, None if it is missing
+        """
+        getattr(self, column)[entry] = np.nan if value is None else value
+
+    def row(self, row: int) -> slice:
+        """Get the entries of a formula, in the order of its items
+
+        Args:
+            row (int): row of the formula
+
+        Returns:
+            slice of the value arrays
+        """
+        return slice(int(self.ptr[row]), int(self.ptr[row + 1]))
+
+    def entry(self, row: int, item: Any) -> int:
+        """Get the position of the value of an item in a formula
+
+        Args:
+            row (int): row of the formula
+            item (Item): item of the column
+
+        Returns:
+            entry (int)
+
+        Raises:
+            KeyError: the formula does not have the item
+        """
+        entries = self.row(row)
+        found = np.flatnonzero(self.columns[entries] == self.index[item])
+        if not len(found):
+            raise KeyError(item)
+        return entries.start + int(found[0])
+
+    def column(self, column: str, item: Any) -> np.ndarray:
+        """Get the values of an item in every formula
+
+        Args:
+            column (str): 'amount', 'minimum' or 'maximum'
+            item (Item): item of the column
+
+        Returns:
+            value in each row, nan if the formula does not have the item
+            (np.ndarray)
+        """
+        return self.toarray(column)[:, self.index[item]]
+
+    def toarray(self, column: str) -> np.ndarray:
+        """Get the values as a dense (formulas, items) array, nan if a
+        formula does not have an item
+        """
+        dense = np.full(self.shape, np.nan)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.ptr))
+        dense[rows, self.columns] = getattr(self, column)
+        return dense
+
+
+class BoundRow:
+    """The entries of one formula in a BoundTable, shared by the bound
+    items of the formula so that each only keeps its small position
+    """
+    __slots__ = ('table', 'start')
+
+    def __init__(self, table: BoundTable, start: int):
+        self.table = table
+        self.start = start
+
+    def get(self, column: str, position: int) -> float:
+        value = getattr(self.table, column).item(self.start + position)
+        return None if value != value else value
+
+    def set(self, column: str, position: int, value: float):
+        self.table.set(column, self.start + position, value)
+
+
+class FormulaStore:
+    """Columnar store of the formula ingredient and formula nutrient bounds
+    and amounts of many formulas
+
+    Binding the formulas turns their FormulaIngredients and FormulaNutrients
+    into views that read and write the store arrays, so that the values of
+    every formula can be read or changed at once, for example
+    store.ingredients.amount[store.ingredients.row(0)]. Memory grows with
+    the number of formula items, not formulas times items.
+    """
+
+    def __init__(self, formulas: Sequence[Any]):
+        """Create a FormulaStore holding the current values of the formulas
+
+        Args:
+            formulas (list[Formula]): formulas of the rows
+        """
+        self.formulas = list(formulas)
+        self.ingredients = BoundTable(
+            _unique(i.item for f in self.formulas for i in f.ingredients),
+            [f.ingredients for f in self.formulas])
+        self.nutrients = BoundTable(
+            _unique(n.item for f in self.formulas for n in f.nutrients),
+            [f.nutrients for f in self.formulas])
+
+    @property
+    def tables(self) -> Dict[str, BoundTable]:
+        return {'ingredients': self.ingredients, 'nutrients': self.nutrients}
+
+    def bind(self):
+        """Make the formula items views of the store, dropping their own
+        copies of the values
+        """
+        for table, attribute in ((self.ingredients, 'ingredients'),
+                                 (self.nutrients, 'nutrients')):
+            for formula, start in zip(self.formulas, table.ptr.tolist()):
+                row = BoundRow(table, start)
+                for position, item in enumerate(getattr(formula, attribute)):
+                    item.bind(row, position)
+
+    def unbind(self):
+        """Copy the values of the store back into the formula items and
+        stop them being views of it
+        """
+        for formula in self.formulas:
+            for item in formula.items:
+                if item.table is not None and (
+                        item.table.table is self.ingredients
+                        or item.table.table is self.nutrients):
+                    item.unbind()
+
+
+def _unique(items: Sequence[Any]) -> List[Any]:
+    """Unique items in the order they first appear
+    """
+    return list(dict.fromkeys(items))
@@ -1,3 +1,8 @@
+import importlib
+import importlib.util
+import sys
+import threading
+from types import ModuleType
 from typing import List, Dict, Any
 
 
@@ -17,3 +22,130 @@ def clean_name(name, replacement: str = '_') -> str:
     if not cleaned_name.isidentifier():
         raise ValueError()
     return cleaned_name
+
+
+class ItemList(list):
+    """List of linked items that counts its changes, so that an ItemIndex
+    of it can tell when to index it again
+    """
+    version = 0
+
+
+def _counted(name: str):
+    method = getattr(list, name)
+
+    def counted(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+    counted.__name__ = name
+    return counted
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append',
+              'extend', 'insert', 'pop', 'remove', 'clear', 'sort',
+              'reverse'):
+    setattr(ItemList, _name, _counted(_name))
+
+
+class ItemIndex:
+    """Index of a list of linked items (IngredientNutrient, BoundItem...)
+    by the item they link and by its code
+
+    The index follows every change of an ItemList, a plain list is indexed
+    again on each lookup.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.codes = {}
+        self.entries = None
+        self.version = None
+
+    def _current(self, entries: List[Any]) -> bool:
+        return entries is self.entries and isinstance(entries, ItemList) \
+            and entries.version == self.version
+
+    def add(self, entries: List[Any], entry: Any):
+        """Index an entry just appended to a list
+
+        Args:
+            entries (list): indexed list
+            entry: entry with an item attribute
+        """
+        if entries is not self.entries or not isinstance(entries, ItemList) \
+                or entries.version != self.version + 1:
+            self.entries = None
+            return
+        self.version = entries.version
+        # the first entry of an item wins, like a scan of the list would
+        self.items.setdefault(entry.item, entry)
+        self.codes.setdefault(entry.item.code, entry)
+
+    def find(self, entries: List[Any], key: Any) -> Any:
+        """Find the entry of an item
+
+        Args:
+            entries (list): indexed list
+            key: item, entry linking the item or code of the item
+
+        Returns:
+            entry, or None if the list has no entry for the item
+        """
+        if not self._current(entries):
+            self.items, self.codes = {}, {}
+            for entry in entries:
+                self.items.setdefault(entry.item, entry)
+                self.codes.setdefault(entry.item.code, entry)
+            self.entries = entries
+            self.version = getattr(entries, 'version', None)
+        if isinstance(key, str):
+            return self.codes.get(key)
+        return self.items.get(getattr(key, 'item', key))
+
+
+class LazyModule(ModuleType):
+    """Stand-in for a module that imports it when one of its attributes
+    is first used
+
+    Only the stand-in is lazy, sys.modules is left to the import system
+    so other users of the module are not affected. Attributes are kept on
+    the stand-in once read.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lock = threading.Lock()
+        self._module = None
+
+    def _load(self) -> ModuleType:
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, name: str) -> Any:
+        value = getattr(self._module or self._load(), name)
+        setattr(self, name, value)
+        return value
+
+
+def lazy_import(name: str, optional: bool = False) -> ModuleType:
+    """Import a module that is only loaded when an attribute of it is
+    first used
+
+    Args:
+        name (str): name of the module
+        optional (bool, optional): return None instead of raising
+            ImportError if the module is not installed. Defaults to False.
+
+    Returns:
+        module, or a LazyModule standing in for it until it is used
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        if optional:
+            return None
+        raise ImportError(f'No module named {name!r}', name=name)
+    return LazyModule(name)
@@ -23,5 +23,12 @@ setuptools.setup(
         'Operating System :: OS Independent',
     ],
     install_requires=requirements,
-    python_requires='>=3.6',
+    extras_require={
+        'highs': ['highspy'],
+        'parquet': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': ['plend-server=plend.server:main'],
+    },
+    python_requires='>=3.7',
 )
@@ -1,5 +1,23 @@
-from plend import Item, Formula, FormulaLibrary, Ingredient, Nutrient
+import asyncio
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from plend import (Item, Formula, FormulaIngredient, FormulaLibrary,
+                   FormulaSolver, Ingredient, Nutrient)
 from plend.presets.poultry import *
+from plend.backends import HighsBackend, PulpBackend
+from plend.cache import SolutionCache
+from plend.catalog import Catalog
+from plend.export import ArrowResultWriter, CsvResultWriter
+from plend.matrix import NutrientMatrix
 from plend.utils import clean_name
 
 
@@ -92,3 +110,1058 @@ def test_solve_formula():
                               if n.name == nutrient.name])
         assert total_nutrient >= nutrient.minimum
         assert total_nutrient <= (nutrient.maximum or total_nutrient)
+
+
+def test_NutrientMatrix():
+    ingredients = [corn, wheat, soybean_meal, meat_meal, oil, limestone]
+    nutrients = [energy, protein, fiber, calcium, lysine]
+    matrix = NutrientMatrix(ingredients, nutrients)
+    assert matrix.shape == (5, 6)
+
+    indices, amounts = matrix.row(calcium.code)
+    assert indices.tolist() == [0, 1, 2, 3, 5]
+    assert amounts.tolist() == [0.01, 0.05, 0.2, 8, 38]
+
+    amounts = [10, 20, 30, 15, 5, 20]
+    for nutrient, total in zip(nutrients, matrix.dot(amounts)):
+        expected = sum([amount * n.amount
+                        for amount, i in zip(amounts, ingredients)
+                        for n in i.nutrients
+                        if n.name == nutrient.name])
+        assert abs(total - expected) < 1e-9
+
+
+class CrashingFormula(Formula):
+    def optimize(self):
+        os._exit(1)
+
+
+def test_FormulaLibrary_optimize_workers():
+    formulas = []
+    for i, energy_minimum in enumerate([3000, 3100, 3200]):
+        formula = Formula(f'Broiler {i}', batch_size=100)
+        formula.add_ingredient(corn)
+        formula.add_ingredient(soybean_meal)
+        formula.add_ingredient(oil, maximum=10)
+        formula.add_ingredient(limestone)
+        formula.add_nutrient(energy, minimum=energy_minimum)
+        formula.add_nutrient(protein, minimum=20)
+        formula.add_nutrient(calcium, minimum=1)
+        formulas.append(formula)
+    formulas.insert(1, Formula('Zero Batch', batch_size=0,
+                               nutrients={energy: (1, None)},
+                               ingredients={corn: (0, None)}))
+    formulas.insert(2, CrashingFormula('Crash', ingredients={corn: (0, None)}))
+
+    library = FormulaLibrary('Broiler', formulas=formulas)
+    library.optimize(workers=2)
+    results = [(f.status, f.cost, [i.amount for i in f.ingredients])
+               for f in library.formulas]
+    assert [f.status for f in library.formulas] == \
+        ['Optimal', 'Error', 'Error', 'Optimal', 'Optimal']
+    assert formulas[1].error is not None
+
+    for formula in library.formulas:
+        formula.cost = 0
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        FormulaLibrary('Broiler', formulas=formulas[3:]).optimize(
+            executor=executor, force=True)
+    assert [(f.status, f.cost, [i.amount for i in f.ingredients])
+            for f in formulas[3:]] == results[3:]
+    formulas[0].cost = 0
+    formulas[0].optimize()
+    assert (formulas[0].status, formulas[0].cost,
+            [i.amount for i in formulas[0].ingredients]) == results[0]
+
+
+def make_starter():
+    starter = Formula(name='Starter', code='B1', batch_size=100)
+    starter.add_ingredient(corn)
+    starter.add_ingredient(soybean_meal)
+    starter.add_ingredient(oil, maximum=10)
+    starter.add_ingredient(limestone)
+    starter.add_ingredient(meat_meal, maximum=10)
+    starter.add_nutrient(energy, minimum=3010)
+    starter.add_nutrient(protein, minimum=24)
+    starter.add_nutrient(fiber)
+    starter.add_nutrient(calcium, minimum=1)
+    return starter
+
+
+def test_FormulaSolver_backends():
+    pytest.importorskip('highspy')
+    starter = make_starter()
+    starter.optimize()
+    highs_starter = make_starter()
+    highs_starter.solver = FormulaSolver(highs_starter, backend='highs')
+    highs_starter.optimize()
+
+    assert highs_starter.status == starter.status == 'Optimal'
+    assert highs_starter.cost == pytest.approx(starter.cost)
+    for a, b in zip(highs_starter.items, starter.items):
+        assert a.amount == pytest.approx(b.amount, rel=1e-6)
+
+    with pytest.raises(ValueError):
+        FormulaSolver(backend='simplex by hand')
+
+
+@pytest.mark.parametrize('backend', ['pulp', 'highs'])
+def test_FormulaSolver_update_problem(backend):
+    if backend == 'highs':
+        pytest.importorskip('highspy')
+    starter = make_starter()
+    starter.solver.backend = backend
+    starter.optimize()
+    problem = starter.problem
+
+    corn_cost = corn.cost
+    corn.cost = corn_cost + 10
+    try:
+        starter.add_ingredient(oil, maximum=5)
+        starter.add_nutrient(energy, minimum=3050)
+        starter.optimize()
+        assert starter.problem is problem
+
+        fresh = make_starter()
+        fresh.solver.backend = backend
+        fresh.add_ingredient(oil, maximum=5)
+        fresh.add_nutrient(energy, minimum=3050)
+        fresh.optimize()
+        assert starter.cost == pytest.approx(fresh.cost)
+        for a, b in zip(starter.items, fresh.items):
+            assert a.amount == pytest.approx(b.amount, rel=1e-6)
+    finally:
+        corn.cost = corn_cost
+
+    # a newly bounded nutrient changes the structure of the problem
+    starter.add_nutrient(fiber, maximum=3)
+    starter.optimize()
+    assert starter.problem is not problem
+
+
+def test_FormulaSolver_sensitivity():
+    starter = make_starter()
+    starter.optimize()
+    starter_energy, starter_fiber = starter.nutrients[0], starter.nutrients[2]
+    starter_corn, starter_meat_meal = \
+        starter.ingredients[0], starter.ingredients[4]
+    assert starter_fiber.shadow_price is None
+    assert starter_meat_meal.reduced_cost < 0
+    low, high = starter_energy.minimum_range
+    assert low < 3010 < high
+
+    # the shadow price holds within the range of the bound
+    richer = make_starter()
+    richer.add_nutrient(energy, minimum=3035)
+    richer.optimize()
+    assert richer.cost == pytest.approx(
+        starter.cost + 25 * starter_energy.shadow_price)
+
+    # the solution holds within the cost range
+    corn_cost = corn.cost
+    try:
+        for cost, same in [(starter_corn.cost_range[1] - 0.01, True),
+                           (starter_corn.cost_range[1] + 0.01, False)]:
+            corn.cost = cost
+            repriced = make_starter()
+            repriced.optimize()
+            assert same == all(
+                a.amount == pytest.approx(b.amount, rel=1e-6)
+                for a, b in zip(repriced.ingredients, starter.ingredients))
+    finally:
+        corn.cost = corn_cost
+
+
+def test_Formula_solve_scenarios():
+    starter = make_starter()
+    base = [i.cost for i in starter.ingredients]
+    prices = [base,
+              [60] + base[1:],
+              [90] + base[1:],
+              [50, 120, 150, 40, 60]]
+    results = starter.solve_scenarios(prices)
+    assert starter.status == 'Unsolved'
+    assert results.amounts.shape == (4, 5)
+    assert results.nutrients.shape == (4, 4)
+    assert results.statuses == ['Optimal'] * 4
+
+    corn_cost, soybean_meal_cost, meat_meal_cost = \
+        corn.cost, soybean_meal.cost, meat_meal.cost
+    try:
+        for scenario, costs in enumerate(prices):
+            corn.cost, soybean_meal.cost, _, _, meat_meal.cost = costs
+            formula = make_starter()
+            formula.optimize()
+            assert results.costs[scenario] == pytest.approx(formula.cost)
+            assert results.amounts[scenario] == pytest.approx(
+                [i.amount for i in formula.ingredients], rel=1e-6)
+            assert results.nutrients[scenario] == pytest.approx(
+                [n.amount for n in formula.nutrients], rel=1e-6)
+    finally:
+        corn.cost, soybean_meal.cost, meat_meal.cost = \
+            corn_cost, soybean_meal_cost, meat_meal_cost
+
+    parallel = starter.solve_scenarios(prices, workers=2)
+    assert parallel.statuses == results.statuses
+    assert parallel.amounts == pytest.approx(results.amounts)
+
+    with pytest.raises(ValueError):
+        starter.solve_scenarios([[1, 2, 3]])
+
+
+def test_SolutionCache(tmp_path):
+    path = str(tmp_path / 'cache')
+    cache = SolutionCache(path=path)
+    starter = make_starter()
+    starter.solver.cache = cache
+    starter.optimize()
+    assert cache.stats['misses'] == 1 and len(cache) == 1
+    amounts = [i.amount for i in starter.ingredients]
+    prices = [n.shadow_price for n in starter.nutrients]
+
+    # a new formula with the same problem is restored without solving
+    other = make_starter()
+    other.solver.cache = SolutionCache(path=path)
+    other.solver.backend.solve = None
+    other.optimize()
+    assert other.solver.cache.stats['hits'] == 1
+    assert other.problem is None
+    assert other.cost == pytest.approx(starter.cost)
+    assert [i.amount for i in other.ingredients] == pytest.approx(amounts)
+    assert [n.shadow_price for n in other.nutrients] == pytest.approx(prices)
+
+    # changing a bound changes the problem
+    starter.ingredients[0].maximum = 40
+    starter.optimize()
+    assert cache.stats == {'hits': 0, 'misses': 2, 'size': 2,
+                           'hit_rate': 0.0}
+    starter.ingredients[0].maximum = 100
+    starter.optimize()
+    assert cache.hits == 1
+    assert [i.amount for i in starter.ingredients] == pytest.approx(amounts)
+
+    library = FormulaLibrary('library', formulas=[make_starter()],
+                             cache=SolutionCache())
+    library.optimize(executor=ThreadPoolExecutor(2))
+    library.formulas[0].solver.backend.solve = None
+    library.optimize(executor=ThreadPoolExecutor(2), force=True)
+    assert library.cache.stats['hits'] == 1
+    assert library.formulas[0].cost == pytest.approx(starter.cost)
+
+
+def test_Formula_lookups():
+    starter = make_starter()
+    assert starter.get_ingredient(corn).ingredient is corn
+    assert starter.get_ingredient('soybean_meal').ingredient is soybean_meal
+    assert starter.get_nutrient(protein).minimum == 24
+    assert starter.get_nutrient(Nutrient('Protein')) is None
+
+    starter.add_nutrient(protein, minimum=22)
+    assert len(starter.nutrients) == 4
+    assert starter.get_nutrient('protein').minimum == 22
+
+    # lists changed directly are indexed again
+    starter.ingredients.pop()
+    assert starter.get_ingredient(meat_meal) is None
+    starter.add_ingredient(meat_meal, maximum=10)
+    replaced = starter.ingredients[-1]
+    starter.ingredients[-1] = FormulaIngredient(wheat, maximum=5)
+    assert starter.get_ingredient(meat_meal) is None
+    assert starter.get_ingredient('wheat').maximum == 5
+    starter.ingredients[-1] = replaced
+    assert starter.get_ingredient(meat_meal) is replaced
+    starter.nutrients = list(starter.nutrients)
+    starter.nutrients.reverse()
+    assert starter.get_nutrient(protein) is starter.nutrients[2]
+
+    salt = Ingredient('Salt', nutrients={calcium: 0.1})
+    salt.add_nutrient(calcium, 0.2)
+    assert len(salt.nutrients) == 1
+    assert salt.get_nutrient('calcium').amount == 0.2
+
+    starter.optimize()
+    contributions = starter.get_contributions()
+    assert contributions.shape == (5, 4)
+    for i, ingredient in enumerate(starter.ingredients):
+        for n, nutrient in enumerate(starter.nutrients):
+            assert contributions[i, n] == pytest.approx(
+                ingredient.get_contribution(nutrient) or 0)
+    assert contributions.sum(axis=0) == pytest.approx(
+        [n.amount for n in starter.nutrients])
+
+
+def test_FormulaLibrary_compact():
+    starter, grower = make_starter(), make_starter()
+    grower.add_nutrient(protein, minimum=20)
+    grower.add_ingredient(meat_meal, maximum=5)
+    library = FormulaLibrary('library', formulas=[starter, grower])
+    with pytest.raises(AttributeError):
+        starter.ingredients[0].color = 'yellow'
+
+    store = library.compact()
+    assert store.ingredients.shape == (2, 5)
+    assert store.nutrients.shape == (2, 4)
+    assert store.ingredients.nnz == 10 and store.nutrients.nnz == 8
+    assert store.ingredients.column('maximum', meat_meal).tolist() == [10, 5]
+    assert store.ingredients.toarray('maximum')[1].tolist() == \
+        [i.maximum for i in grower.ingredients]
+    assert starter.get_nutrient(fiber).maximum is None
+
+    # the items are views of the store
+    entry = store.ingredients.entry(1, meat_meal)
+    store.ingredients.maximum[entry] = 8
+    assert grower.get_ingredient(meat_meal).maximum == 8
+    library.optimize(workers=2)
+    amounts = store.ingredients.amount[store.ingredients.row(1)]
+    assert amounts.tolist() == [i.amount for i in grower.ingredients]
+    assert amounts[-1] == pytest.approx(8)
+    assert store.nutrients.column('amount', protein) == pytest.approx(
+        [24, 20])
+
+    store.unbind()
+    store.ingredients.maximum[entry] = 1
+    assert grower.get_ingredient(meat_meal).maximum == 8
+
+
+def test_benchmarks():
+    from benchmarks.catalog import make_library
+    from benchmarks.suite import compare, run_benchmark
+
+    library = make_library(20, 12, 3, formula_ingredients=10)
+    assert len(library.ingredients) == 20
+    assert len(library.formulas[0].ingredients) == 10
+    library.optimize()
+    assert {f.status for f in library.formulas} == {'Optimal'}
+
+    record = run_benchmark(12, 10, 2, repeat=1)
+    assert set(record['runs']) == {'build', 'solve', 'readback', 'library'}
+    assert compare(record, record) == {'build': 1, 'solve': 1,
+                                       'readback': 1, 'library': 1}
+
+
+def test_FormulaSolver_profile():
+    starter = make_starter()
+    calls = []
+    starter.solver.add_hook(lambda f, phase, seconds: calls.append(phase))
+    starter.optimize()
+    profile = starter.profile
+    assert profile.backend == 'pulp' and profile.status == 'Optimal'
+    assert (profile.variables, profile.constraints) == (5, 4)
+    assert profile.nonzeros == 16
+    assert calls == ['program', 'update', 'build', 'solve', 'readback',
+                     'sensitivity']
+    assert set(profile.phases) == set(calls)
+
+    starter.optimize()
+    assert 'build' not in starter.profile.phases
+
+    library = FormulaLibrary('library', formulas=[make_starter(),
+                                                  make_starter()])
+    library.add_hook(lambda f, phase, seconds: calls.append(f.name))
+    calls.clear()
+    library.optimize(workers=2)
+    assert calls.count('Starter') == 12
+    records = library.profile_records()
+    assert records[0]['code'] == 'B1'
+    assert records[0]['solve_seconds'] > 0
+    summary = library.profile_summary()
+    assert summary['formulas'] == 2
+    assert summary['statuses'] == {'Optimal': 2}
+    assert summary['phases']['solve'] == pytest.approx(
+        sum(r['solve_seconds'] for r in records))
+
+
+class SlowBackend(PulpBackend):
+    def solve(self, problem):
+        time.sleep(0.5)
+        return super().solve(problem)
+
+
+def test_optimize_async():
+    starter = make_starter()
+    asyncio.run(starter.optimize_async())
+    assert starter.status == 'Optimal'
+    assert starter.cost == pytest.approx(68.312016841)
+    assert not starter.dirty
+
+    formulas = [make_starter() for _ in range(4)]
+    library = FormulaLibrary('library', formulas=formulas)
+    asyncio.run(library.optimize_async(concurrency=2))
+    assert [f.cost for f in formulas] == pytest.approx([starter.cost] * 4)
+    assert not any(f.dirty for f in formulas)
+    profiles = [f.profile for f in formulas]
+    library.optimize()
+    assert [f.profile for f in formulas] == profiles
+
+    slow = make_starter()
+    slow.solver.backend = SlowBackend()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(slow.optimize_async(timeout=0.01))
+    assert slow.status == 'Unsolved'
+
+    async def cancel():
+        task = asyncio.ensure_future(slow.optimize_async())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancel())
+    assert slow.status == 'Unsolved' and slow.cost == 0
+
+    library = FormulaLibrary('library', formulas=[make_starter(), slow])
+    asyncio.run(library.optimize_async(timeout=0.2))
+    assert library.formulas[0].status == 'Optimal'
+    assert slow.status == 'Error'
+    assert isinstance(slow.error, asyncio.TimeoutError)
+
+
+@pytest.mark.parametrize('backend', ['pulp', 'highs'])
+def test_FormulaLibrary_optimize_joint(backend):
+    if backend == 'highs':
+        pytest.importorskip('highspy')
+    starter, grower = make_starter(), make_starter()
+    grower.code = 'B2'
+    grower.add_nutrient(energy, minimum=3175)
+    grower.add_nutrient(protein, minimum=22)
+    library = FormulaLibrary('library', formulas=[starter, grower])
+    library.optimize()
+    costs = [starter.cost, grower.cost]
+    meat_meal_used = 20 * starter.get_ingredient(meat_meal).amount + \
+        30 * grower.get_ingredient(meat_meal).amount
+    assert meat_meal_used > 300
+
+    demand = {starter: 2000, grower: 3000}
+    result = library.optimize_joint(demand, backend=backend)
+    assert result.status == 'Optimal'
+    assert [starter.cost, grower.cost] == pytest.approx(costs, rel=1e-6)
+    assert result.cost == pytest.approx(2000 * costs[0] + 3000 * costs[1])
+    assert result.usage[meat_meal] == pytest.approx(meat_meal_used)
+
+    result = library.optimize_joint(demand, inventory={meat_meal: 300},
+                                    backend=backend)
+    assert result.status == 'Optimal'
+    assert result.usage[meat_meal] == pytest.approx(300)
+    assert result.cost > 2000 * costs[0] + 3000 * costs[1]
+    assert result.cost == pytest.approx(
+        2000 * starter.cost + 3000 * grower.cost)
+    assert result.shadow_prices[meat_meal] < 0
+    for formula in (starter, grower):
+        assert sum(i.amount for i in formula.ingredients) == \
+            pytest.approx(100)
+
+    # the formulas solve on their own again afterwards
+    starter.optimize()
+    assert starter.cost == pytest.approx(costs[0])
+
+    # formulas sharing a code are kept apart
+    twin = make_starter()
+    result = FormulaLibrary('twins', formulas=[starter, twin]).optimize_joint(
+        {starter: 2000, twin: 3000}, inventory={meat_meal: 300},
+        backend=backend)
+    assert result.status == 'Optimal'
+    assert result.usage[meat_meal] == pytest.approx(300)
+
+    twin.batch_size = 0
+    with pytest.raises(ValueError):
+        library.optimize_joint({starter: 2000, twin: 3000}, backend=backend)
+
+
+def write_catalog(path, ingredients, nutrients, long=False):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        if long:
+            writer.writerow(['ingredient', 'nutrient', 'amount', 'cost'])
+            for i in ingredients:
+                for n in i.nutrients:
+                    writer.writerow([i.name, n.nutrient.name, n.amount,
+                                     i.cost])
+            return
+        writer.writerow(['name', 'code', 'cost']
+                        + [n.name for n in nutrients])
+        for i in ingredients:
+            amounts = [i.get_nutrient(n) for n in nutrients]
+            writer.writerow([i.name, i.code, i.cost]
+                            + ['' if a is None else a.amount
+                               for a in amounts])
+
+
+@pytest.mark.parametrize('layout', ['wide', 'long', 'npz'])
+def test_FormulaLibrary_load_catalog(tmp_path, layout):
+    starter = make_starter()
+    starter.optimize()
+    ingredients = [i.item for i in starter.ingredients]
+    nutrients = [energy, protein, fiber, calcium]
+    path = str(tmp_path / 'catalog.csv')
+    write_catalog(path, ingredients, nutrients, long=layout == 'long')
+    if layout == 'npz':
+        Catalog.load(path).save_npz(str(tmp_path / 'catalog.npz'))
+        path = str(tmp_path / 'catalog.npz')
+
+    library = FormulaLibrary('catalog')
+    catalog = library.load_catalog(path)
+    assert library.catalog is catalog
+    assert len(catalog) == 5
+    assert catalog._ingredients == {}
+    if layout == 'npz':
+        assert isinstance(catalog.amounts, np.memmap)
+
+    catalog_corn = catalog.get_ingredient('corn')
+    assert catalog.get_ingredient(0) is catalog_corn
+    assert catalog_corn.cost == corn.cost
+    assert catalog_corn.get_nutrient('protein').amount == \
+        corn.get_nutrient(protein).amount
+    assert catalog.get_nutrient('protein') is \
+        catalog_corn.get_nutrient('protein').nutrient
+
+    formula = Formula(name='Starter', code='B1', batch_size=100)
+    for item in starter.ingredients:
+        formula.add_ingredient(catalog.get_ingredient(item.code),
+                               maximum=item.maximum)
+    for item in starter.nutrients:
+        formula.add_nutrient(catalog.get_nutrient(item.code),
+                             minimum=item.minimum)
+    formula.optimize()
+    assert formula.status == 'Optimal'
+    assert formula.cost == pytest.approx(starter.cost)
+
+
+def test_FormulaLibrary_results(tmp_path):
+    starter, grower = make_starter(), make_starter()
+    grower.name, grower.code = 'Grower', 'B2'
+    grower.get_nutrient(protein).minimum = 22
+    library = FormulaLibrary('Broiler', formulas=[starter, grower])
+
+    path = str(tmp_path / 'results.csv')
+    written = []
+    with CsvResultWriter(path, library.name) as writer:
+        def on_result(formula):
+            writer.write(formula)
+            written.append(writer.rows)
+        library.optimize(workers=2, on_result=on_result)
+    assert written == [9, 18]
+
+    rows = list(library.iter_results())
+    assert len(rows) == 18
+    assert rows[0][:7] == ('Broiler', 'Starter', 'B1', starter.cost,
+                           'Optimal', 'ingredient', 'Corn')
+    assert rows[-1][5:7] == ('nutrient', 'Calcium')
+    with open(path, newline='') as file:
+        assert file.read() == library.to_csv()
+    lines = library.to_csv().splitlines()
+    assert lines[0].startswith('library_name,formula_name,formula_code')
+    assert lines[3].endswith(',0,10')
+
+    records = library.to_records()
+    assert records.shape == (18,)
+    assert records.item_name[1] == 'Soybean Meal'
+    assert records.item_amount == pytest.approx([r[8] for r in rows])
+    assert rows[7][10] is None and np.isnan(records.item_maximum[7])
+
+    pyarrow = pytest.importorskip('pyarrow.parquet')
+    writer = ArrowResultWriter(str(tmp_path / 'results.parquet'),
+                               library.name, batch_rows=4)
+    library.write_results(writer)
+    table = pyarrow.read_table(str(tmp_path / 'results.parquet'))
+    assert table.num_rows == 18
+    assert table.column('item_code').to_pylist() == [r[7] for r in rows]
+
+
+def test_FormulaSolver_diagnose():
+    starter = make_starter()
+    starter.solver = FormulaSolver(starter, diagnose=True)
+    starter.get_nutrient(protein).minimum = 60
+    starter.optimize()
+    assert starter.status == 'Infeasible'
+    assert 'diagnosis' in starter.profile.phases
+    conflict, = starter.diagnosis.conflicts
+    assert (conflict.item_type, conflict.code, conflict.bound) == \
+        ('nutrient', 'protein', 'minimum')
+    assert conflict.limit == 60 and conflict.violation > 0
+
+    # moving the bound by the violation makes the formula feasible
+    starter.get_nutrient(protein).minimum = conflict.value - 1e-6
+    starter.optimize()
+    assert starter.status == 'Optimal'
+    assert starter.diagnosis is None
+
+    starter.get_nutrient(protein).minimum = 24
+    starter.get_ingredient(corn).minimum = 50
+    starter.get_ingredient(soybean_meal).minimum = 60
+    library = FormulaLibrary('library', formulas=[starter])
+    library.optimize(workers=1)
+    conflict, = starter.diagnosis.conflicts
+    assert (conflict.item_type, conflict.code, conflict.bound) == \
+        ('ingredient', 'soybean_meal', 'minimum')
+    assert conflict.value < 50
+
+
+def test_Formula_sweep():
+    starter = make_starter()
+    grid = starter.sweep(energy, np.arange(2900, 3301, 50))
+    assert len(grid) == 9 and grid.statuses == ['Optimal'] * 9
+    assert np.all(np.diff(grid.costs) >= -1e-9)
+    assert grid.amounts.shape == (9, 5)
+    assert grid.nutrients[:, 0] == pytest.approx(grid.values, rel=1e-6)
+    assert starter.get_nutrient(energy).minimum == 3010
+    assert starter.status == 'Unsolved'
+
+    exact = starter.sweep(energy, [2900, 3300], exact=True)
+    assert exact.values[0] == 2900 and exact.values[-1] == 3300
+    assert len(exact) < len(grid)
+    for value, cost in zip(grid.values, grid.costs):
+        assert exact.cost_at(value) == pytest.approx(cost, abs=1e-5)
+    # the cost is linear between breakpoints with the shadow price slope
+    piece = exact.values[1:3]
+    assert np.diff(exact.costs[1:3]) / np.diff(piece) == \
+        pytest.approx(exact.slopes[1], rel=1e-4)
+
+    unbounded = starter.sweep(fiber, [4, 3, 2], bound='maximum')
+    assert unbounded.costs[0] == pytest.approx(68.312, abs=1e-3)
+    assert starter.get_nutrient(fiber).maximum is None
+
+    # without row duals the exact sweep steps through the range
+    starter.solver = FormulaSolver(starter, backend=NoDualsBackend())
+    stepped = starter.sweep(energy, [2900, 3300], exact=True)
+    assert len(stepped) == 51 and stepped.values[-1] == 3300
+    for value, cost in zip(stepped.values[::5], stepped.costs[::5]):
+        assert exact.cost_at(value) == pytest.approx(cost, abs=1e-5)
+
+    starter.solver = FormulaSolver(starter)
+    starter.add_ingredient(corn, increment=5)
+    with pytest.raises(ValueError):
+        starter.sweep(energy, [2900, 3300], exact=True)
+    assert len(starter.sweep(energy, [2900, 3300])) == 2
+
+
+class NoDualsBackend(PulpBackend):
+    def solve(self, problem):
+        result = super().solve(problem)
+        result.row_duals = None
+        return result
+
+
+def test_FormulaSolver_presolve():
+    def make_formula(presolve):
+        formula = make_starter()
+        pricey_corn = Ingredient('Pricey Corn', cost=corn.cost + 1)
+        pricey_corn.add_nutrients({n.nutrient: n.amount
+                                   for n in corn.nutrients})
+        formula.add_ingredient(pricey_corn)
+        formula.add_ingredient(Ingredient('Banned', cost=1,
+                                          nutrients={protein: 90}))
+        # add_ingredient takes a maximum of 0 as no bound
+        formula.get_ingredient('banned').maximum = 0
+        formula.add_nutrient(Nutrient('Lead'), maximum=1)
+        formula.add_nutrient(fiber, maximum=20)
+        formula.solver = FormulaSolver(formula, presolve=presolve)
+        return formula
+
+    full, reduced = make_formula(False), make_formula(True)
+    full.optimize()
+    reduced.optimize()
+    assert reduced.status == full.status == 'Optimal'
+    assert reduced.cost == pytest.approx(full.cost)
+    for a, b in zip(full.items, reduced.items):
+        assert b.amount == pytest.approx(a.amount, abs=1e-6)
+    assert reduced.get_nutrient(protein).shadow_price == \
+        pytest.approx(full.get_nutrient(protein).shadow_price)
+    assert reduced.presolved.report() == {
+        'fixed': ['Banned'], 'dominated': [('Pricey Corn', 'Corn')],
+        'empty_rows': ['Lead'], 'redundant_rows': ['Fiber'],
+        'tightened': []}
+    assert (reduced.profile.variables, reduced.profile.constraints) == (5, 4)
+    assert len(reduced.variables) == 5
+
+    # a price change keeps the reductions and patches the problem
+    reduced.get_ingredient('pricey_corn').item.cost += 1
+    reduced.optimize()
+    assert 'build' not in reduced.profile.phases
+    assert reduced.cost == pytest.approx(full.cost)
+
+
+def test_FormulaLibrary_dirty():
+    wheat = Ingredient('Wheat', cost=0.25)
+    wheat.add_nutrient(energy, 3100)
+    wheat.add_nutrient(protein, 12)
+    starter, grower = make_starter(), make_starter()
+    grower.name, grower.code = 'Grower', 'B2'
+    grower.add_ingredient(wheat)
+    library = FormulaLibrary('Broiler', formulas=[starter, grower])
+    assert starter.dirty and grower.dirty
+    library.optimize()
+    assert not starter.dirty and not grower.dirty
+    profiles = [starter.profile, grower.profile]
+
+    library.optimize()
+    assert [starter.profile, grower.profile] == profiles
+    wheat.cost = 0.1
+    assert grower.dirty and not starter.dirty
+    library.optimize()
+    assert starter.profile is profiles[0]
+    assert grower.profile is not profiles[1]
+    assert grower.get_ingredient(wheat).amount > 0
+
+    wheat.get_nutrient(protein).amount = 13
+    starter.get_nutrient(protein).minimum = 23
+    assert starter.dirty and grower.dirty
+    library.optimize(workers=2)
+    assert not starter.dirty and not grower.dirty
+    profiles = [starter.profile, grower.profile]
+    library.optimize(force=True)
+    assert starter.profile is not profiles[0]
+    assert grower.profile is not profiles[1]
+
+    class FailingBackend(PulpBackend):
+        def solve(self, problem):
+            raise RuntimeError('solver crashed')
+
+    starter.solver.backend = FailingBackend()
+    starter.get_nutrient(protein).minimum = 24
+    with pytest.raises(RuntimeError):
+        starter.optimize()
+    assert starter.dirty
+
+
+def test_Formula_compliance():
+    grain = Ingredient('Grain', cost=0.2)
+    grain.add_nutrient(energy, 3300, sd=150)
+    grain.add_nutrient(protein, 9, sd=0.8)
+    grain.add_nutrient(calcium, 0.02)
+    meal = Ingredient('Meal', cost=0.45)
+    meal.add_nutrient(energy, 2400, sd=100)
+    meal.add_nutrient(protein, 46, sd=2)
+    meal.add_nutrient(calcium, 0.3, sd=0.03)
+    lime = Ingredient('Lime', cost=0.05, nutrients={calcium: 38})
+    formula = Formula('Layer', batch_size=100, ingredients={
+        grain: (0, None), meal: (0, None), lime: (0, None)})
+    formula.add_nutrient(energy, minimum=2700)
+    formula.add_nutrient(protein, minimum=18)
+    formula.add_nutrient(calcium, minimum=1, maximum=1.2)
+    with pytest.raises(ValueError):
+        formula.compliance()
+    formula.optimize()
+
+    compliance = formula.compliance(samples=5000, seed=0)
+    assert compliance.totals.shape == (5000, 3)
+    assert compliance.totals.mean(axis=0) == pytest.approx(
+        [n.amount for n in formula.nutrients], rel=1e-2)
+    assert compliance.probability('protein') < 0.6
+    assert compliance.joint <= compliance.probabilities.min()
+
+    solution = formula.optimize_margin(0.95, samples=5000, seed=0)
+    assert solution.status == 'Optimal'
+    assert solution.cost > formula.cost
+    assert solution.nutrients[1] > 18
+    assert np.all(solution.compliance.probabilities > 0.94)
+    assert formula.get_nutrient(protein).amount == pytest.approx(18)
+
+
+def test_FormulaService(tmp_path):
+    import threading
+    import urllib.error
+    import urllib.request
+    from plend.server import FormulaService, formula_to_dict, make_server
+
+    library = FormulaLibrary(
+        'Broiler', nutrients=[energy, protein, fiber, calcium],
+        ingredients=[corn, soybean_meal, oil, limestone, meat_meal])
+    request = {'name': 'Starter', 'code': 'B1', 'batch_size': 100,
+               'ingredients': ['corn', 'soybean_meal',
+                               {'code': 'oil', 'maximum': 10}, 'limestone',
+                               {'code': 'meat_meal', 'maximum': 10}],
+               'nutrients': [{'code': 'energy', 'minimum': 3010},
+                             {'code': 'protein', 'minimum': 24}, 'fiber',
+                             {'code': 'calcium', 'minimum': 1}]}
+    starter = make_starter()
+    starter.optimize()
+
+    with ThreadPoolExecutor(2) as executor, \
+            FormulaService(library, executor=executor, max_batch=4,
+                           batch_wait=0.05) as service:
+        formulas = service.optimize(
+            [service.formula_from_dict(request) for _ in range(6)])
+        assert [f.status for f in formulas] == ['Optimal'] * 6
+        assert formulas[0].cost == pytest.approx(starter.cost)
+        stats = service.stats()
+        assert stats['requests'] == 6 and 2 <= stats['batches'] <= 6
+        assert stats['queue_depth'] == stats['in_flight'] == 0
+        with pytest.raises(ValueError):
+            service.formula_from_dict({'name': 'x', 'ingredients': ['sand']})
+        path = str(tmp_path / 'catalog.csv')
+        write_catalog(path, [corn, wheat], [energy, protein])
+        library.load_catalog(path)
+        with pytest.raises(ValueError):
+            service.formula_from_dict({'name': 'x', 'ingredients': [5]})
+        with pytest.raises(ValueError):
+            service.formula_from_dict({'name': 'x', 'nutrients': [
+                {'code': 0}]})
+
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            body = json.dumps({'formulas': [request, request]}).encode()
+            with urllib.request.urlopen(url + '/optimize', body) as response:
+                answer = json.load(response)
+            assert [f['status'] for f in answer['formulas']] == \
+                ['Optimal'] * 2
+            assert answer['formulas'][0]['ingredients'][0]['amount'] == \
+                pytest.approx(starter.ingredients[0].amount)
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + '/optimize', b'{"name": "x", '
+                                       b'"nutrients": ["salt"]}')
+            assert error.value.code == 400
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + '/optimize', b'{"name": "x", '
+                                       b'"ingredients": [{"code": 5}]}')
+            assert error.value.code == 400
+            with urllib.request.urlopen(url + '/metrics') as response:
+                assert json.load(response)['requests'] == 8
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    unsolved = make_starter()
+    unsolved.cost = float('nan')
+    answer = formula_to_dict(unsolved)
+    assert answer['cost'] is None
+    json.dumps(answer, allow_nan=False)
+
+
+class CrashingBackend(PulpBackend):
+    def solve(self, problem):
+        os._exit(1)
+
+
+class FailingExecutor(ThreadPoolExecutor):
+    def submit(self, fn, *args, **kwargs):
+        raise RuntimeError('executor is down')
+
+
+def test_FormulaService_errors():
+    from concurrent.futures.process import BrokenProcessPool
+    from plend.server import FormulaService
+
+    library = FormulaLibrary('Broiler', ingredients=[corn, soybean_meal],
+                             nutrients=[protein])
+    request = {'name': 'Starter', 'ingredients': ['corn', 'soybean_meal'],
+               'nutrients': [{'code': 'protein', 'minimum': 20}]}
+    with FailingExecutor(1) as executor, \
+            FormulaService(library, executor=executor) as service:
+        future = service.submit(service.formula_from_dict(request))
+        with pytest.raises(RuntimeError):
+            future.result(timeout=10)
+        future = service.submit(service.formula_from_dict(request))
+        assert isinstance(future.exception(timeout=10), RuntimeError)
+
+    with FormulaService(library, workers=1) as service:
+        crashing = service.formula_from_dict(request)
+        crashing.solver.backend = CrashingBackend()
+        with pytest.raises(BrokenProcessPool):
+            service.submit(crashing).result(timeout=30)
+        formula, = service.optimize([service.formula_from_dict(request)],
+                                    timeout=30)
+        assert formula.status == 'Optimal'
+        assert service.stats()['errors'] == 1
+
+
+def test_FormulaLibrary_save(tmp_path):
+    starter, grower = make_starter(), make_starter()
+    grower.name, grower.code = 'Grower', 'B2'
+    grower.get_ingredient(corn).maximum = None
+    starter.optimize()
+    library = FormulaLibrary('Broiler', nutrients=[energy, protein],
+                             ingredients=[corn, soybean_meal],
+                             formulas=[starter, grower])
+    write_catalog(str(tmp_path / 'catalog.csv'), [corn, wheat, oil],
+                  [energy, protein])
+    library.load_catalog(str(tmp_path / 'catalog.csv'))
+    path = str(tmp_path / 'library.npz')
+    library.save(path)
+
+    loaded = FormulaLibrary.load(path)
+    assert loaded.name == 'Broiler'
+    assert [n.code for n in loaded.nutrients] == ['energy', 'protein']
+    assert [i.name for i in loaded.ingredients] == ['Corn', 'Soybean Meal']
+    assert loaded.catalog.shape == library.catalog.shape
+    first, second = loaded.formulas
+    assert (first.status, first.cost) == ('Optimal', starter.cost)
+    assert [i.amount for i in first.ingredients] == \
+        [i.amount for i in starter.ingredients]
+    assert first.get_nutrient('protein').shadow_price == \
+        starter.get_nutrient(protein).shadow_price
+    assert starter.get_ingredient(corn).cost_range is not None
+    assert first.get_ingredient('corn').cost_range == \
+        starter.get_ingredient(corn).cost_range
+    assert first.get_nutrient('protein').minimum_range == \
+        starter.get_nutrient(protein).minimum_range
+    assert first.get_nutrient('protein').maximum_range is None
+    assert first.get_ingredient('corn').ingredient is loaded.ingredients[0]
+    assert first.get_ingredient('corn').cost == corn.cost
+    assert [n.amount for n in first.get_ingredient('corn').nutrients] == \
+        [n.amount for n in corn.nutrients]
+    assert second.get_ingredient('corn').maximum is None
+    assert not first.dirty and second.dirty
+    loaded.optimize()
+    assert second.cost == pytest.approx(starter.cost)
+
+    # a formula changed after its solve stays dirty
+    starter.get_nutrient(protein).minimum = 26
+    library.save(path)
+    first = FormulaLibrary.load(path).formulas[0]
+    assert first.get_nutrient('protein').minimum == 26
+    assert first.dirty
+
+    starter.optimize()
+    library.save(path)
+    assert not FormulaLibrary.load(path).formulas[0].dirty
+    arrays = dict(np.load(path))
+    arrays['format_version'] = np.array([1])
+    for name in ('formula_max_ingredients', 'formula_ingredient_inclusion',
+                 'formula_ingredient_increment', 'formula_dirty'):
+        del arrays[name]
+    for name in [name for name in arrays if '_range_' in name]:
+        del arrays[name]
+    np.savez(path, **arrays)
+    first = FormulaLibrary.load(path).formulas[0]
+    assert first.cost == starter.cost
+    # saved without ranging, solved again to get it
+    assert first.dirty and first.get_ingredient('corn').cost_range is None
+
+    arrays['format_version'] = np.array([99])
+    np.savez(path, **arrays)
+    with pytest.raises(ValueError):
+        FormulaLibrary.load(path)
+
+
+def test_Formula_analyze():
+    starter = make_starter()
+    starter.optimize()
+    analysis = starter.analyze()
+    assert analysis.costs[0] == pytest.approx(starter.cost)
+    assert analysis.nutrients[0] == pytest.approx(
+        [n.amount for n in starter.nutrients])
+    assert analysis.feasible().tolist() == [True]
+
+    mixes = [[i.amount for i in starter.ingredients],
+             [50, 50, 0, 0, 0],
+             [60, 20, 0, 0, 20]]
+    analysis = starter.analyze(mixes)
+    assert len(analysis) == 3
+    assert analysis.feasible().tolist() == [True, False, False]
+    assert analysis.level('protein')[1] == pytest.approx(
+        (50 * corn.get_nutrient(protein).amount
+         + 50 * soybean_meal.get_nutrient(protein).amount) / 100)
+    assert analysis.nutrient_shortfall[1, 3] > 0
+    assert analysis.ingredient_excess[2].tolist() == [0, 0, 0, 0, 10]
+    assert analysis.costs[1] == pytest.approx(
+        (corn.cost + soybean_meal.cost) / 2)
+    with pytest.raises(ValueError):
+        starter.analyze([[1, 2]])
+
+    # a mix that does not sum to the batch size is scaled to it
+    scaled = starter.analyze([[10 * i.amount for i in starter.ingredients],
+                              [6, 2, 0, 0, 2]])
+    assert scaled.feasible().tolist() == [True, False]
+    assert scaled.costs[0] == pytest.approx(starter.cost)
+    assert scaled.ingredient_excess[1].tolist() == pytest.approx(
+        [0, 0, 0, 0, 10])
+
+
+def test_Formula_mip(tmp_path):
+    starter = make_starter()
+    starter.optimize()
+
+    limited = make_starter()
+    limited.max_ingredients = 3
+    limited.optimize()
+    assert limited.status == 'Optimal'
+    assert sum(i.amount > 1e-6 for i in limited.ingredients) <= 3
+    assert limited.cost >= starter.cost - 1e-6
+    assert sum(i.amount for i in limited.ingredients) == pytest.approx(100)
+
+    included = make_starter()
+    included.add_ingredient(oil, maximum=10, inclusion=2)
+    included.optimize()
+    amount = included.get_ingredient(oil).amount
+    assert amount == pytest.approx(0, abs=1e-6) or amount >= 2 - 1e-6
+
+    stepped = make_starter()
+    stepped.add_ingredient(corn, increment=5)
+    stepped.solver = FormulaSolver(
+        stepped, backend=PulpBackend(time_limit=10, mip_gap=0),
+        warm_start=True)
+    stepped.optimize()
+    assert stepped.status == 'Optimal'
+    steps = stepped.get_ingredient(corn).amount / 5
+    assert steps == pytest.approx(round(steps), abs=1e-6)
+    cost = stepped.cost
+    stepped.optimize()
+    assert stepped.cost == pytest.approx(cost)
+    assert stepped.get_ingredient(corn).reduced_cost is None
+
+    # results of solves with limits are cached apart from those without
+    cache = SolutionCache()
+    for backend in (PulpBackend(time_limit=10, mip_gap=0.5), PulpBackend(),
+                    PulpBackend(threads=1)):
+        cached = make_starter()
+        cached.add_ingredient(corn, increment=5)
+        cached.solver = FormulaSolver(cached, backend=backend, cache=cache)
+        cached.optimize()
+    assert len(cache) == 2
+
+    library = FormulaLibrary('Broiler', formulas=[limited, stepped])
+    path = str(tmp_path / 'library.npz')
+    library.save(path)
+    first, second = FormulaLibrary.load(path).formulas
+    assert first.max_ingredients == 3
+    assert second.get_ingredient('corn').increment == 5
+    assert not first.dirty
+
+
+def test_Formula_mip_highs():
+    highspy = pytest.importorskip('highspy')
+    from plend.backends import _highs_status
+
+    stepped = make_starter()
+    stepped.add_ingredient(corn, increment=5)
+    stepped.solver = FormulaSolver(
+        stepped, backend=HighsBackend(time_limit=10, mip_gap=0),
+        warm_start=True)
+    stepped.optimize()
+    assert stepped.status == 'Optimal'
+    steps = stepped.get_ingredient(corn).amount / 5
+    assert steps == pytest.approx(round(steps), abs=1e-6)
+    assert stepped.profile.mip_gap == pytest.approx(0, abs=1e-6)
+
+    cache = SolutionCache()
+    for backend in (HighsBackend(time_limit=10, mip_gap=0.5),
+                    HighsBackend(), HighsBackend(threads=1)):
+        cached = make_starter()
+        cached.add_ingredient(corn, increment=5)
+        cached.solver = FormulaSolver(cached, backend=backend, cache=cache)
+        cached.optimize()
+    assert len(cache) == 2
+
+    limit = highspy.HighsModelStatus.kTimeLimit
+    assert _highs_status(limit, incumbent=True) == 'Feasible'
+    assert _highs_status(limit) == 'Not Solved'
+
+
+def test_import_time():
+    code = """if True:
+        import json, sys
+        import plend
+        from plend.presets import poultry
+        heavy = ['numpy', 'numpy.core', 'pulp', 'highspy', 'asyncio',
+                 'concurrent.futures.process']
+        print(json.dumps({
+            'loaded': [m for m in heavy if m in sys.modules],
+            'built': 'corn' in vars(poultry)}))
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = json.loads(output.stdout)
+    assert result['loaded'] == []
+    assert not result['built']